@@ -5,10 +5,16 @@ Uses LangChain agents with specialized tools for intelligent trip planning.
 
 import os
 import json
+import argparse
 import requests
-from typing import List, Dict, Optional, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any, Iterator, Set
 from dataclasses import dataclass
-from langchain.agents import Tool, AgentExecutor, create_react_agent
+from langchain.agents import Tool, AgentExecutor
+from langchain.agents.output_parsers import ReActSingleInputOutputParser
+from langchain.tools.render import render_text_description
+from langchain_core.runnables import RunnablePassthrough
 from langchain.prompts import PromptTemplate
 from langchain_ollama import OllamaLLM
 from langchain.schema import AgentAction, AgentFinish
@@ -17,6 +23,15 @@ from geopy.distance import geodesic
 import folium
 import pandas as pd
 from dotenv import load_dotenv
+from rate_limit import call_with_retry
+from road_routing import get_router
+from agent_scratchpad import ScratchpadManager, GEOCODE_TABLE_HEADER
+from llm_ledger import LedgerCallbackHandler, request_tags
+from poi_pool import plan_itineraries_from_pool
+from checkpoint_writer import CheckpointWriter, completed_iterations, export_json, run_key
+
+
+AGENT_RESULTS_PATH = os.getenv("AGENT_RESULTS_PATH", "output/agent_trip_results.jsonl")
 
 
 @dataclass
@@ -31,6 +46,7 @@ class TripConfig:
     interests: List[str] = None
     model_name: str = "llama3"
     ollama_host: str = "http://localhost:11434"
+    scratchpad_token_budget: int = 1500
     
     def __post_init__(self):
         if self.interests is None:
@@ -39,18 +55,27 @@ class TripConfig:
 
 class GeolocationTool:
     """Tool for accurate geolocation services."""
+
+    # Shared by all agents in the process, so trip variations reuse each other's lookups
+    _cache: Dict[str, Dict] = {}
+    _cache_lock = threading.Lock()
     
-    def __init__(self):
+    def __init__(self, max_workers: int = 4):
         self.geolocator = Nominatim(user_agent="trip_planner_agent", timeout=10)
+        self.max_workers = max_workers
     
     def geocode_location(self, location_name: str, country: str = None) -> Dict:
         """Get coordinates and detailed info for a location."""
         query = f"{location_name}, {country}" if country else location_name
+        cache_key = " ".join(query.split()).casefold()
+        with self._cache_lock:
+            if cache_key in self._cache:
+                return dict(self._cache[cache_key])
         
         try:
-            result = self.geolocator.geocode(query, exactly_one=True)
+            result = call_with_retry("nominatim", self.geolocator.geocode, query, exactly_one=True)
             if result:
-                return {
+                info = {
                     "name": result.address,
                     "lat": result.latitude,
                     "lon": result.longitude,
@@ -58,14 +83,41 @@ class GeolocationTool:
                     "confidence": "high"
                 }
             else:
-                return {"found": False, "error": "Location not found"}
+                info = {"found": False, "error": "Location not found"}
         except Exception as e:
+            # Errors are not cached, the next call may succeed
             return {"found": False, "error": str(e)}
+
+        with self._cache_lock:
+            self._cache[cache_key] = info
+        return dict(info)
+
+    def geocode_locations(self, location_names: List[str], country: str = None) -> List[Dict]:
+        """
+        Geocode many locations concurrently, reusing cached results.
+        Calls still respect the shared Nominatim rate limit; the threads overlap request latency.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(lambda name: self.geocode_location(name, country), location_names))
+        for name, result in zip(location_names, results):
+            result["query"] = name
+        return results
+
+    @staticmethod
+    def format_table(results: List[Dict]) -> str:
+        """Compact pipe-separated table of batch geocoding results for the agent."""
+        rows = [GEOCODE_TABLE_HEADER]
+        for r in results:
+            if r.get("found"):
+                rows.append(f"{r['query']} | {r['lat']:.4f} | {r['lon']:.4f} | ok")
+            else:
+                rows.append(f"{r['query']} | - | - | {str(r.get('error', 'not found'))[:40]}")
+        return "\n".join(rows)
     
     def validate_coordinates(self, lat: float, lon: float, expected_name: str) -> Dict:
         """Validate if coordinates match expected location."""
         try:
-            result = self.geolocator.reverse((lat, lon), exactly_one=True)
+            result = call_with_retry("nominatim", self.geolocator.reverse, (lat, lon), exactly_one=True)
             if result:
                 return {
                     "valid": True,
@@ -82,16 +134,24 @@ class DistanceTool:
     
     @staticmethod
     def calculate_distance(point1: tuple, point2: tuple) -> Dict:
-        """Calculate distance between two points."""
+        """Calculate distance between two points, by road when a road network is configured."""
         try:
-            distance = geodesic(point1, point2).kilometers
-            # Rough driving time estimate (60 km/h average)
-            drive_time_hours = distance / 60
+            router = get_router()
+            route = router.route(point1, point2) if router else None
+            if route is not None:
+                drive_time_hours, distance = route
+                method = "road"
+            else:
+                distance = geodesic(point1, point2).kilometers
+                # Rough driving time estimate (60 km/h average)
+                drive_time_hours = distance / 60
+                method = "geodesic"
             
             return {
                 "distance_km": round(distance, 2),
                 "drive_time_hours": round(drive_time_hours, 2),
-                "feasible_day_trip": drive_time_hours <= 3
+                "feasible_day_trip": drive_time_hours <= 3,
+                "method": method
             }
         except Exception as e:
             return {"error": str(e)}
@@ -101,12 +161,23 @@ class DistanceTool:
         """Validate that daily distances are reasonable."""
         issues = []
         daily_distances = []
+        points = [(loc["lat"], loc["lon"]) for loc in locations]
+
+        # With a road network, the consecutive legs are routed directly, each point snapped once
+        router = get_router()
+        legs = router.legs(points) if router else [None] * max(len(points) - 1, 0)
         
         for i in range(len(locations) - 1):
-            loc1 = (locations[i]["lat"], locations[i]["lon"])
-            loc2 = (locations[i+1]["lat"], locations[i+1]["lon"])
-            
-            dist_info = DistanceTool.calculate_distance(loc1, loc2)
+            if legs[i] is not None:
+                hours, km = legs[i]
+                dist_info = {
+                    "distance_km": round(km, 2),
+                    "drive_time_hours": round(hours, 2),
+                    "feasible_day_trip": hours <= 3,
+                    "method": "road"
+                }
+            else:
+                dist_info = DistanceTool.calculate_distance(points[i], points[i + 1])
             daily_distances.append(dist_info)
             
             if dist_info.get("drive_time_hours", 0) > 4:
@@ -133,6 +204,8 @@ class TripPlannerAgent:
         
         # Initialize tools
         self.geo_tool = GeolocationTool()
+        self.distance_tool = DistanceTool()
+        self.scratchpad = ScratchpadManager(token_budget=config.scratchpad_token_budget)
         
         # Create agent tools
         self.tools = self._create_tools()
@@ -154,9 +227,15 @@ class TripPlannerAgent:
                     self.geo_tool.geocode_location(location, self.config.country)
                 )
             ),
+            Tool(
+                name="geocode_locations_batch",
+                description="Get coordinates for many locations in one step, e.g. a whole itinerary. "
+                            "Input: JSON list of location names, or names separated by ';'",
+                func=self._batch_geocode_wrapper
+            ),
             Tool(
                 name="calculate_distance",
-                description="Calculate distance between two coordinates. Input: 'lat1,lon1,lat2,lon2'",
+                description="Calculate driving distance and time between two coordinates. Input: 'lat1,lon1,lat2,lon2'",
                 func=self._distance_tool_wrapper
             ),
             Tool(
@@ -166,6 +245,19 @@ class TripPlannerAgent:
             )
         ]
     
+    def _batch_geocode_wrapper(self, names_str: str) -> str:
+        """Wrapper for the batch geocoding tool."""
+        try:
+            names = json.loads(names_str)
+            if isinstance(names, str):
+                names = [names]
+        except ValueError:
+            names = names_str.replace("\n", ";").split(";")
+        names = [str(n).strip().strip("'\"") for n in names if str(n).strip()]
+        if not names:
+            return "error: no location names given"
+        return self.geo_tool.format_table(self.geo_tool.geocode_locations(names, self.config.country))
+
     def _distance_tool_wrapper(self, coords_str: str) -> str:
         """Wrapper for distance calculation tool."""
         try:
@@ -205,7 +297,7 @@ Family preferences:
 
 Use your tools systematically:
 1. Build initial trip outline with daily stops
-2. Ensure each location is geolocatable
+2. Ensure each location is geolocatable - verify all stops at once with geocode_locations_batch
 3. Create a final itinerary with verified locations
 
 Always use tools to verify information. Don't make assumptions about coordinates or attractions.
@@ -220,7 +312,18 @@ Question: Plan the complete trip itinerary.
 Thought: I need to start by understanding the seasonal conditions and then systematically plan the route.
 Action:""")
         
-        return create_react_agent(self.llm, self.tools, prompt)
+        # Same chain as create_react_agent, but the scratchpad goes through the budgeted
+        # ScratchpadManager instead of appending every full observation
+        prompt = prompt.partial(
+            tools=render_text_description(self.tools),
+            tool_names=", ".join(t.name for t in self.tools),
+        )
+        return (
+            RunnablePassthrough.assign(agent_scratchpad=lambda x: self.scratchpad.format(x["intermediate_steps"]))
+            | prompt
+            | self.llm.bind(stop=["\nObservation"])
+            | ReActSingleInputOutputParser()
+        )
     
     def plan_trip(self) -> Dict:
         """Execute the trip planning with agent."""
@@ -238,12 +341,13 @@ Action:""")
                 "month": self.config.month,
                 "interests": ', '.join(self.config.interests),
                 "budget": self.config.budget
-            })
+            }, config={"callbacks": [LedgerCallbackHandler("agent", request_tags(self.config))]})
             
             return {
                 "success": True,
                 "itinerary": result["output"],
-                "agent_steps": len(result.get("intermediate_steps", []))
+                "agent_steps": len(result.get("intermediate_steps", [])),
+                "scratchpad_tokens": self.scratchpad.step_tokens
             }
         except Exception as e:
             return {
@@ -260,11 +364,30 @@ class EnhancedTripPlanner:
         self.config = config
         self.agent = TripPlannerAgent(config)
     
-    def plan_multiple_trips(self, num_iterations: int = 3) -> List[Dict]:
-        """Plan multiple trip variations using agents."""
-        results = []
-        
+    def plan_multiple_trips(self, num_iterations: int = 3, use_poi_pool: bool = False) -> List[Dict]:
+        """
+        Plan multiple trip variations using agents.
+        With use_poi_pool, the variations are assembled locally from one cached pool of
+        candidate places instead of running the agent once per variation.
+        """
+        return list(self.iter_trip_variations(num_iterations, use_poi_pool))
+
+    def iter_trip_variations(self, num_iterations: int = 3, use_poi_pool: bool = False,
+                             skip: Optional[Set[int]] = None, seed: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Yield each variation's result as soon as it is planned, for callers that checkpoint results
+        instead of holding them all. Iterations (1-based) in skip are not planned again.
+        seed fixes the POI-pool assembly, so a resumed run assembles the same variations.
+        """
+        skip = skip or set()
+        if use_poi_pool:
+            yield from self._plan_from_poi_pool(num_iterations, skip, seed)
+            return
+
         for i in range(num_iterations):
+            if i + 1 in skip:
+                print(f"Skipping trip variation {i + 1}, already recorded")
+                continue
             print(f"\n=== Planning Trip Variation {i + 1} ===")
             
             # Vary config slightly for different results
@@ -273,14 +396,34 @@ class EnhancedTripPlanner:
             
             result = agent.plan_trip()
             result["iteration"] = i + 1
-            results.append(result)
             
             if result["success"]:
                 print(f"✅ Trip {i + 1} planned successfully in {result['agent_steps']} steps")
             else:
                 print(f"❌ Trip {i + 1} failed: {result['error']}")
-        
-        return results
+            yield result
+    
+    def _plan_from_poi_pool(self, num_iterations: int, skip: Set[int], seed: Optional[int] = None) -> Iterator[Dict]:
+        """Assemble variations from the POI pool and check their daily drives with the distance tool."""
+        try:
+            itineraries = plan_itineraries_from_pool(self.config, num_iterations, self.agent.llm.invoke, seed=seed)
+        except Exception as e:
+            yield {"success": False, "error": str(e), "partial_result": None, "iteration": 1}
+            return
+
+        for i, itinerary in enumerate(itineraries):
+            if i + 1 in skip:
+                continue
+            route_check = self.agent.distance_tool.validate_daily_distances(itinerary)
+            print(f"✅ Trip {i + 1} assembled from the POI pool ({len(route_check['issues'])} route issues)")
+            yield {
+                "success": True,
+                "itinerary": itinerary,
+                "agent_steps": 0,
+                "route_check": {"valid": route_check["valid"], "issues": route_check["issues"]},
+                "iteration": i + 1,
+                "source": "poi_pool"
+            }
     
     def _vary_config_for_iteration(self, iteration: int) -> TripConfig:
         """Create slight variations in config for different results."""
@@ -291,7 +434,8 @@ class EnhancedTripPlanner:
             duration=self.config.duration,
             month=self.config.month,
             model_name=self.config.model_name,
-            ollama_host=self.config.ollama_host
+            ollama_host=self.config.ollama_host,
+            scratchpad_token_budget=self.config.scratchpad_token_budget
         )
         
         # Vary interests and budget for different perspectives
@@ -309,8 +453,12 @@ class EnhancedTripPlanner:
         return config
 
 
-def main():
-    """Main entry point for agent-enhanced trip planner."""
+def main(resume: bool = False):
+    """
+    Main entry point for agent-enhanced trip planner.
+    Each variation is appended to AGENT_RESULTS_PATH (JSONL, fsync'd) as soon as it is planned;
+    with resume, variations a previous run of the same request already recorded are skipped.
+    """
     load_dotenv()
     
     # Create enhanced configuration
@@ -321,26 +469,42 @@ def main():
         duration=int(os.getenv("DURATION", "10")),
         month=os.getenv("MONTH", "July"),
         model_name=os.getenv("MODEL_NAME", "llama3"),
-        ollama_host=os.getenv("OLLAMA_HOST", "http://localhost:11434")
+        ollama_host=os.getenv("OLLAMA_HOST", "http://localhost:11434"),
+        scratchpad_token_budget=int(os.getenv("AGENT_SCRATCHPAD_TOKENS", "1500"))
     )
     
     # Create enhanced planner
     planner = EnhancedTripPlanner(config)
     
-    # Plan multiple variations
+    # Plan multiple variations, checkpointing each one
     num_iterations = 2 # int(os.getenv("NUM_ITERATIONS", "3"))
-    results = planner.plan_multiple_trips(num_iterations)
-    
-    # Save results
-    os.makedirs("output", exist_ok=True)
-    with open("output/agent_trip_results.json", "w") as f:
-        json.dump(results, f, indent=2)
+    planning_mode = os.getenv("PLANNING_MODE", "llm")
+    key = run_key({"country": config.country, "city_start": config.city_start, "city_end": config.city_end,
+                   "duration": config.duration, "month": config.month, "model": config.model_name,
+                   "mode": planning_mode})
+    done = completed_iterations(AGENT_RESULTS_PATH, key) if resume else set()
+    if done:
+        print(f"Resuming: {len(done)} variations already recorded in {AGENT_RESULTS_PATH}")
+
+    successful = len(done)
+    with CheckpointWriter(AGENT_RESULTS_PATH, key, resume=resume) as writer:
+        # Seeded by the run key, so a resumed run assembles exactly the variations it recorded before
+        for result in planner.iter_trip_variations(num_iterations, use_poi_pool=planning_mode == "poi_pool",
+                                                   skip=done, seed=int(key, 16)):
+            writer.write(result)
+            successful += bool(result["success"])
+
+    # Also keep the JSON array for existing consumers, the latest record of each variation
+    export_json(AGENT_RESULTS_PATH, "output/agent_trip_results.json", key)
     
     print(f"\n=== Summary ===")
-    successful = sum(1 for r in results if r["success"])
-    print(f"Successfully planned {successful}/{len(results)} trip variations")
-    print("Results saved to output/agent_trip_results.json")
+    print(f"Successfully planned {successful}/{num_iterations} trip variations "
+          f"({writer.written} planned in this run)")
+    print(f"Results saved to {AGENT_RESULTS_PATH} and output/agent_trip_results.json")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Plan trip variations with the agent planner.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip variations already recorded in AGENT_RESULTS_PATH by a previous run")
+    main(resume=parser.parse_args().resume)
@@ -0,0 +1,116 @@
+"""
+Agent Scratchpad
+Keeps the ReAct agent's {agent_scratchpad} within a token budget: recent
+steps are shown in full, older ones are compacted to one-line summaries,
+and verbose geocoder payloads are cut down to the fields the agent uses.
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+
+GEOCODE_TABLE_HEADER = "name | lat | lon | status"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return (len(text) + 3) // 4
+
+
+def _compact_geocode(payload: Dict) -> Dict:
+    """Keep only the fields of a geocoder result the agent needs."""
+    if not payload.get("found", True) or "error" in payload:
+        return {"found": False, "error": str(payload.get("error", ""))[:80]}
+    compact = {"found": True}
+    if "name" in payload:
+        # Nominatim addresses run to the country; the first parts identify the place
+        compact["name"] = ", ".join(str(payload["name"]).split(", ")[:2])
+    for key in ("lat", "lon"):
+        if isinstance(payload.get(key), (int, float)):
+            compact[key] = round(payload[key], 4)
+    return compact
+
+
+def compact_observation(observation, max_chars: int = 400) -> str:
+    """Shrink a tool observation: geocoder JSON to essential fields, anything else truncated."""
+    text = observation if isinstance(observation, str) else json.dumps(observation)
+    try:
+        payload = json.loads(text)
+    except (TypeError, ValueError):
+        payload = None
+
+    if isinstance(payload, dict) and ("lat" in payload or "found" in payload):
+        text = json.dumps(_compact_geocode(payload))
+    elif isinstance(payload, list) and payload and all(isinstance(p, dict) for p in payload):
+        text = json.dumps([_compact_geocode(p) if ("lat" in p or "found" in p) else p for p in payload])
+
+    if text.startswith(GEOCODE_TABLE_HEADER):
+        # Batch geocode tables are already compact; cutting rows would hide unverified stops
+        return text
+    if len(text) > max_chars:
+        text = text[:max_chars] + "...(truncated)"
+    return text
+
+
+def summarize_step(action, observation) -> str:
+    """One-line summary of an old step: tool(input) -> short result."""
+    tool_input = str(getattr(action, "tool_input", ""))[:60]
+    if str(observation).startswith(GEOCODE_TABLE_HEADER):
+        rows = str(observation).splitlines()[1:]
+        failed = [row.split(" | ")[0] for row in rows if not row.endswith("| ok")]
+        result = f"{len(rows) - len(failed)}/{len(rows)} found" + (f", not found: {', '.join(failed)}"[:100] if failed else "")
+        return f"{getattr(action, 'tool', 'tool')} -> {result}"
+    result = compact_observation(observation, max_chars=120)
+    return f"{getattr(action, 'tool', 'tool')}({tool_input}) -> {result}"
+
+
+class ScratchpadManager:
+    """
+    Formats intermediate steps for the ReAct prompt within a token budget,
+    and records how many scratchpad tokens each iteration sent.
+    """
+
+    def __init__(self, token_budget: int = 1500, keep_recent: int = 2, max_observation_chars: int = 400):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.max_observation_chars = max_observation_chars
+        self.step_tokens: List[Dict] = []
+
+    @staticmethod
+    def _render(summaries: List[str], omitted: int, full: str) -> str:
+        header = ""
+        if omitted:
+            header += f"({omitted} earlier steps omitted)\n"
+        if summaries:
+            header += "Earlier steps (summarized):\n" + "\n".join(summaries) + "\n"
+        return header + full
+
+    def format(self, intermediate_steps: List[Tuple]) -> str:
+        """Build the scratchpad text, same layout as LangChain's format_log_to_str for recent steps."""
+        older = intermediate_steps[:-self.keep_recent] if self.keep_recent else intermediate_steps
+        recent = intermediate_steps[len(older):]
+
+        summaries = [f"- Step {i + 1}: {summarize_step(action, obs)}" for i, (action, obs) in enumerate(older)]
+        full = ""
+        for action, observation in recent:
+            full += action.log
+            full += f"\nObservation: {compact_observation(observation, self.max_observation_chars)}\nThought: "
+
+        # Drop the oldest summaries first until the scratchpad fits the budget
+        omitted = 0
+        scratchpad = self._render(summaries, omitted, full)
+        while summaries and estimate_tokens(scratchpad) > self.token_budget:
+            summaries.pop(0)
+            omitted += 1
+            scratchpad = self._render(summaries, omitted, full)
+
+        tokens = estimate_tokens(scratchpad)
+        self.step_tokens.append({
+            "iteration": len(intermediate_steps) + 1,
+            "scratchpad_tokens": tokens,
+            "summarized_steps": len(summaries),
+            "omitted_steps": omitted,
+        })
+        print(f"Agent iteration {len(intermediate_steps) + 1}: scratchpad {tokens} tokens "
+              f"({len(summaries)} summarized, {omitted} omitted)")
+        return scratchpad
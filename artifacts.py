@@ -0,0 +1,134 @@
+"""
+Artifacts
+Content-addressed store for rendered trip artifacts (maps, coordinate CSVs).
+Each file is named by a hash of the itinerary it was made from, so identical
+itineraries share one file instead of being rendered again, and concurrent
+requests never overwrite each other's output. Files are written atomically
+and the directory is kept under ARTIFACT_MAX_MB by evicting the least
+recently used files.
+
+    python artifacts.py --cleanup     # evict down to ARTIFACT_MAX_MB now
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from typing import Callable, Optional, Tuple
+
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "output/artifacts")
+ARTIFACT_MAX_MB = float(os.getenv("ARTIFACT_MAX_MB", "500"))
+# Bump to re-render every artifact after a change to the map styles
+ARTIFACT_VERSION = os.getenv("ARTIFACT_VERSION", "1")
+# New artifacts written (per process) between two cleanup passes
+ARTIFACT_CLEANUP_EVERY = int(os.getenv("ARTIFACT_CLEANUP_EVERY", "50"))
+# Temp files of writers that died are removed after this long
+STALE_TMP_SECONDS = 3600
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def content_hash(kind: str, content) -> str:
+    """SHA-256 of the artifact kind and the JSON-serialized content it is made from."""
+    payload = json.dumps({"kind": kind, "version": ARTIFACT_VERSION, "content": content},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def artifact_path(kind: str, ext: str, content) -> str:
+    """Path of the artifact for this content, e.g. output/artifacts/3f/trip_map_3f9a....html."""
+    digest = content_hash(kind, content)
+    return os.path.join(ARTIFACT_DIR, digest[:2], f"{kind}_{digest}.{ext}")
+
+
+def existing_artifact(kind: str, ext: str, content) -> Optional[str]:
+    """Path of the artifact if it was already made, marking it as recently used; None otherwise."""
+    path = artifact_path(kind, ext, content)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def get_or_create(kind: str, ext: str, content, write: Callable[[str], None]) -> str:
+    """
+    Return the artifact for this content, calling write(path) to make it if it does not exist yet.
+    write gets a temporary path in the same directory, which is renamed into place once complete,
+    so readers never see a partial file; two processes making the same artifact both write
+    identical bytes and the last rename wins. Raises RuntimeError if write made no file.
+    """
+    path = existing_artifact(kind, ext, content)
+    if path is not None:
+        return path
+    path = artifact_path(kind, ext, content)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        if not os.path.exists(tmp_path):
+            raise RuntimeError(f"Writing the {kind} artifact produced no file")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    global _writes
+    with _writes_lock:
+        _writes += 1
+        due = _writes % ARTIFACT_CLEANUP_EVERY == 0
+    if due:
+        cleanup()
+    return path
+
+
+def cleanup(max_mb: float = ARTIFACT_MAX_MB, artifact_dir: str = ARTIFACT_DIR) -> Tuple[int, int]:
+    """
+    Evict least recently used artifacts until the directory is under max_mb, and remove temp files
+    left by writers that died. Returns (files removed, bytes freed).
+    """
+    files = []
+    now = time.time()
+    removed = freed = 0
+    for root, _, names in os.walk(artifact_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp"):
+                if now - stat.st_mtime > STALE_TMP_SECONDS:
+                    os.remove(path)
+                    removed, freed = removed + 1, freed + stat.st_size
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    limit = max_mb * 1024 * 1024
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed, freed = removed + 1, freed + size
+    return removed, freed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the content-addressed artifact directory.")
+    parser.add_argument("--cleanup", action="store_true", help="Evict least recently used artifacts now")
+    parser.add_argument("--max-mb", type=float, default=ARTIFACT_MAX_MB)
+    args = parser.parse_args()
+    if args.cleanup:
+        removed, freed = cleanup(args.max_mb)
+        print(f"✅ Removed {removed} artifacts ({freed / 1024 / 1024:.1f} MB) from {ARTIFACT_DIR}")
+    else:
+        parser.print_help()
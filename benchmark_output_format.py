@@ -0,0 +1,82 @@
+"""
+Output Format Benchmark
+Runs the trip prompt in the verbose dict format and the compact row format
+(alternating, same request) and prints their completion tokens, latency and
+parse results side by side, from the LLM ledger entries of this run.
+
+    python benchmark_output_format.py --runs 5
+    python benchmark_output_format.py --summary-only   # all ledger history, by format
+"""
+
+import time
+import argparse
+from collections import defaultdict
+
+from config import get_config
+from extract_coordinates import extract_coords_from_llm_result, parse_compact_itinerary
+from llm_ledger import load_ledger, percentile
+from prompt_trip import _get_trip_prompt_template, main_plan_prompt
+
+FORMATS = ["dict", "compact"]
+
+
+def run_benchmark(Config, runs: int):
+    """Alternate both formats `runs` times. Returns {format: [parse stats per run]} and the start time."""
+    started = time.time()
+    parse_stats = defaultdict(list)
+    for run in range(runs):
+        for output_format in FORMATS:
+            compact = output_format == "compact"
+            print(f"Run {run + 1}/{runs}: {output_format} format")
+            try:
+                result = main_plan_prompt(_get_trip_prompt_template(Config, compact=compact), Config,
+                                          output_format=output_format)
+            except Exception as e:
+                print(f"  failed: {e}")
+                parse_stats[output_format].append({"stops": 0, "rejected": 0, "failed": True})
+                continue
+            if compact:
+                locations, rejected = parse_compact_itinerary(result, Config.duration)
+                rejected = len(rejected)
+            else:
+                locations = extract_coords_from_llm_result(result) or []
+                rejected = sum(1 for loc in locations if loc.get("lat") is None or loc.get("lon") is None)
+            parse_stats[output_format].append({"stops": len(locations), "rejected": rejected, "failed": False})
+    return parse_stats, started
+
+
+def print_comparison(since: float = 0.0, parse_stats=None):
+    """Token and latency percentiles per format from ledger entries newer than `since`."""
+    entries = defaultdict(list)
+    for entry in load_ledger("main_plan_prompt"):
+        if entry.get("ts", 0) >= since:
+            entries[entry.get("format", "dict")].append(entry)
+
+    print(f"\n{'format':8s} {'calls':>5s} {'compl p50':>10s} {'compl p95':>10s} {'lat p50':>8s} {'lat p95':>8s} "
+          f"{'tok/day':>8s} {'stops':>6s} {'rejected':>8s}")
+    for output_format in FORMATS:
+        calls = entries.get(output_format, [])
+        completion = [e["completion_tokens"] for e in calls if e.get("completion_tokens")]
+        latency = [e["latency_s"] for e in calls if e.get("latency_s") is not None]
+        per_day = [e["completion_tokens"] / e["duration"] for e in calls if e.get("completion_tokens") and e.get("duration")]
+        stats = (parse_stats or {}).get(output_format, [])
+        stops = sum(s["stops"] for s in stats)
+        rejected = sum(s["rejected"] for s in stats)
+        fmt = lambda v, spec: "-" if v is None else format(v, spec)
+        print(f"{output_format:8s} {len(calls):5d} {fmt(percentile(completion, 50), '10.0f')} "
+              f"{fmt(percentile(completion, 95), '10.0f')} {fmt(percentile(latency, 50), '8.2f')} "
+              f"{fmt(percentile(latency, 95), '8.2f')} {fmt(percentile(per_day, 50), '8.1f')} "
+              f"{stops if stats else '-':>6} {rejected if stats else '-':>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the dict and compact itinerary output formats.")
+    parser.add_argument("--runs", type=int, default=3, help="Calls per format")
+    parser.add_argument("--summary-only", action="store_true", help="Only summarize the existing ledger")
+    args = parser.parse_args()
+
+    if args.summary_only:
+        print_comparison()
+    else:
+        stats, started = run_benchmark(get_config(), args.runs)
+        print_comparison(since=started, parse_stats=stats)
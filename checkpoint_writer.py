@@ -0,0 +1,122 @@
+"""
+Checkpoint Writer
+Append-only JSONL log of batch results, one line per finished variation,
+flushed and fsync'd as each one is written, so a crash loses at most the
+variation in flight. A resumed run reads back which variations of the same
+run are already recorded and skips them. Reading streams line by line, so
+memory stays flat whatever the batch size.
+"""
+
+import os
+import json
+from typing import Dict, Iterator, Optional, Set
+
+from stage_dag import fingerprint
+
+
+def run_key(fields: Dict) -> str:
+    """Identity of a batch run: results are only resumed into a run with the same request fields."""
+    return fingerprint(fields)[:16]
+
+
+def _drop_partial_line(path: str) -> None:
+    """Truncate a torn last line left by a crash mid-write, so new records start on a line of their own."""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                f.truncate(pos + newline + 1)
+                break
+        else:
+            f.truncate(0)
+        print(f"⚠️ Dropped a partially written record at the end of {path}")
+
+
+def read_checkpoint(path: str) -> Iterator[Dict]:
+    """Yield the records of a checkpoint file in order, skipping unreadable lines."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def completed_iterations(path: str, key: str) -> Set[int]:
+    """Iterations of run `key` that were recorded successfully; failed ones are run again on resume."""
+    return {r["iteration"] for r in read_checkpoint(path) if r.get("run_key") == key and r.get("success")}
+
+
+class CheckpointWriter:
+    """Appends one JSON record per line and makes each one durable before returning."""
+
+    def __init__(self, path: str, key: str, resume: bool = False):
+        self.path = path
+        self.key = key
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume and os.path.exists(path):
+            _drop_partial_line(path)
+        created = not os.path.exists(path) or not resume
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if created:
+            # Make the new file's directory entry durable too
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self.written = 0
+
+    def write(self, record: Dict) -> None:
+        """Append the record tagged with the run key, then flush and fsync it."""
+        self._file.write(json.dumps(dict(record, run_key=self.key), default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.written += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def export_json(jsonl_path: str, json_path: str, key: Optional[str] = None) -> int:
+    """
+    Write the latest record of every iteration (of run `key`, if given) as a JSON array, streaming
+    records from the checkpoint file rather than loading them all. Returns the number of records.
+    """
+    # First pass: line number of each iteration's latest record
+    latest = {}
+    for line_no, record in enumerate(read_checkpoint(jsonl_path)):
+        if key is None or record.get("run_key") == key:
+            latest[record.get("iteration")] = line_no
+    keep = set(latest.values())
+
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        written = 0
+        for line_no, record in enumerate(read_checkpoint(jsonl_path)):
+            if line_no in keep:
+                f.write((",\n" if written else "\n") + json.dumps(record, indent=2, default=str))
+                written += 1
+        f.write("\n]\n")
+    os.replace(tmp_path, json_path)
+    return written
@@ -20,5 +20,6 @@ def get_config():
         composition = os.getenv("COMPOSITION", "a family with young children")
         location_val = os.getenv("LOCATION_VAL" , "False").lower() == 'true'
         max_km_dist_per_day = int(os.getenv("MAX_KM_DIST_PER_DAY", "150"))
+        preferences = [p.strip() for p in os.getenv("PREFERENCES", "Nature,Culture,Relaxation").split(",") if p.strip()]
 
     return Config
\ No newline at end of file
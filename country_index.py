@@ -0,0 +1,226 @@
+"""
+Country Index
+Local index of simplified country and region polygons used to triage stops
+before geocoding: a bounding-box prefilter and a point-in-polygon test flag
+stops outside the requested country, or far from a region named in the stop,
+so only those are sent to the geocoder / LLM.
+
+Build the index once from Natural Earth GeoJSON (admin-0 countries, and
+optionally admin-1 states/provinces):
+    python country_index.py --countries ne_50m_admin_0_countries.geojson \
+        --regions ne_10m_admin_1_states_provinces.geojson
+"""
+
+import os
+import re
+import json
+import math
+import argparse
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+
+COUNTRY_INDEX_PATH = os.getenv("COUNTRY_INDEX_PATH", "data/country_index.json")
+# Stops this close to the border count as inside, simplified polygons cut corners
+BORDER_TOLERANCE_KM = float(os.getenv("BORDER_TOLERANCE_KM", "5"))
+# Stops naming a region must be within this distance of it
+REGION_TOLERANCE_KM = float(os.getenv("REGION_TOLERANCE_KM", "25"))
+# Douglas-Peucker tolerance used when building the index, ~1 km
+SIMPLIFY_DEGREES = 0.01
+# Region names shorter than this are too ambiguous to look for in stop names
+MIN_REGION_NAME_LENGTH = 4
+
+COUNTRY_NAME_FIELDS = ("NAME", "NAME_LONG", "ADMIN", "NAME_EN", "FORMAL_EN", "ISO_A2", "ISO_A3")
+REGION_NAME_FIELDS = ("name", "name_en", "gn_name", "woe_name")
+REGION_COUNTRY_FIELDS = ("admin", "iso_a2", "adm0_a3")
+KM_PER_DEGREE = 111.32
+
+_index = None
+
+
+def _fold(text) -> str:
+    """Lower-case and strip accents, so 'Brașov' and 'Brasov' match."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split()).casefold()
+
+
+def _simplify(ring: List[List[float]], tolerance: float) -> List[List[float]]:
+    """Douglas-Peucker simplification of a closed ring, keeping at least 4 points."""
+    if len(ring) <= 4:
+        return ring
+    keep = [False] * len(ring)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = ring[first], ring[last]
+        dx, dy = x2 - x1, y2 - y1
+        norm = math.hypot(dx, dy)
+        best, best_dist = None, tolerance
+        for i in range(first + 1, last):
+            x, y = ring[i]
+            dist = abs(dy * (x - x1) - dx * (y - y1)) / norm if norm else math.hypot(x - x1, y - y1)
+            if dist > best_dist:
+                best, best_dist = i, dist
+        if best is not None:
+            keep[best] = True
+            stack.extend([(first, best), (best, last)])
+    simplified = [p for p, k in zip(ring, keep) if k]
+    return simplified if len(simplified) >= 4 else ring
+
+
+def _polygons_from_geometry(geometry: Dict, tolerance: float) -> List[Dict]:
+    """Polygon / MultiPolygon GeoJSON geometry -> [{'bbox', 'rings'}], rings as [lon, lat] lists."""
+    if geometry is None:
+        return []
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    result = []
+    for rings in polygons:
+        rings = [[[round(x, 5), round(y, 5)] for x, y, *_ in _simplify(ring, tolerance)] for ring in rings]
+        xs, ys = [p[0] for p in rings[0]], [p[1] for p in rings[0]]
+        result.append({"bbox": [min(xs), min(ys), max(xs), max(ys)], "rings": rings})
+    return result
+
+
+def _names(properties: Dict, fields: Sequence[str]) -> List[str]:
+    return sorted({_fold(properties[f]) for f in fields if properties.get(f) and properties[f] != "-99"})
+
+
+def build_index(countries_path: str, regions_path: Optional[str] = None,
+                tolerance: float = SIMPLIFY_DEGREES) -> Dict:
+    """Build the index dict from admin-0 (and optionally admin-1) GeoJSON files."""
+    with open(countries_path, "r", encoding="utf-8") as f:
+        countries = json.load(f)["features"]
+    index = {"countries": [], "regions": []}
+    for feature in countries:
+        index["countries"].append({"names": _names(feature["properties"], COUNTRY_NAME_FIELDS),
+                                   "polygons": _polygons_from_geometry(feature["geometry"], tolerance)})
+    if regions_path:
+        with open(regions_path, "r", encoding="utf-8") as f:
+            regions = json.load(f)["features"]
+        for feature in regions:
+            names = [n for n in _names(feature["properties"], REGION_NAME_FIELDS) if len(n) >= MIN_REGION_NAME_LENGTH]
+            if names:
+                index["regions"].append({"names": names,
+                                         "countries": _names(feature["properties"], REGION_COUNTRY_FIELDS),
+                                         "polygons": _polygons_from_geometry(feature["geometry"], tolerance)})
+    return index
+
+
+def _in_ring(lon: float, lat: float, ring: List[List[float]]) -> bool:
+    """Even-odd ray casting test."""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _distance_to_ring_km(lon: float, lat: float, ring: List[List[float]]) -> float:
+    """Shortest distance from the point to the ring's edges, equirectangular approximation."""
+    scale = math.cos(math.radians(lat))
+    px, py = lon * scale, lat
+    best = math.inf
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        x1, x2 = x1 * scale, x2 * scale
+        dx, dy = x2 - x1, y2 - y1
+        t = 0.0 if dx == dy == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy)))
+        best = min(best, math.hypot(px - (x1 + t * dx), py - (y1 + t * dy)))
+    return best * KM_PER_DEGREE
+
+
+def _near_polygons(polygons: List[Dict], lat: float, lon: float, tolerance_km: float) -> bool:
+    """Whether the point is inside one of the polygons or within tolerance_km of its border."""
+    margin_lat = tolerance_km / KM_PER_DEGREE
+    margin_lon = margin_lat / max(math.cos(math.radians(lat)), 0.01)
+    for polygon in polygons:
+        min_lon, min_lat, max_lon, max_lat = polygon["bbox"]
+        if not (min_lon - margin_lon <= lon <= max_lon + margin_lon and min_lat - margin_lat <= lat <= max_lat + margin_lat):
+            continue
+        exterior, holes = polygon["rings"][0], polygon["rings"][1:]
+        if _in_ring(lon, lat, exterior) and not any(_in_ring(lon, lat, hole) for hole in holes):
+            return True
+        if tolerance_km and _distance_to_ring_km(lon, lat, exterior) <= tolerance_km:
+            return True
+    return False
+
+
+class CountryIndex:
+    """Point-in-country and named-region checks against the prebuilt index."""
+
+    def __init__(self, index: Dict):
+        self.countries = {}
+        for country in index["countries"]:
+            for name in country["names"]:
+                self.countries.setdefault(name, country)
+        self.regions = index.get("regions", [])
+
+    @classmethod
+    def load(cls, path: str = COUNTRY_INDEX_PATH) -> "CountryIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def knows(self, country: str) -> bool:
+        return _fold(country) in self.countries
+
+    def in_country(self, country: str, lat: float, lon: float, tolerance_km: float = BORDER_TOLERANCE_KM) -> bool:
+        """Whether the point lies in the country (or within tolerance_km of its border)."""
+        return _near_polygons(self.countries[_fold(country)]["polygons"], lat, lon, tolerance_km)
+
+    def named_regions(self, country: str, name: str) -> List[Dict]:
+        """Regions of the country whose name appears as a whole word in the stop name."""
+        entry_names = set(self.countries[_fold(country)]["names"])
+        folded = _fold(name)
+        return [region for region in self.regions
+                if entry_names & set(region["countries"])
+                and any(re.search(rf"\b{re.escape(n)}\b", folded) for n in region["names"])]
+
+    def flag(self, location: Dict, country: str) -> Optional[str]:
+        """Why the stop needs a geocoder check, or None if it looks right."""
+        lat, lon = location.get("lat"), location.get("lon")
+        if lat is None or lon is None:
+            return "missing coordinates"
+        if not self.knows(country):
+            return f"{country} not in the boundary index"
+        if not self.in_country(country, lat, lon):
+            return f"outside {country}"
+        for region in self.named_regions(country, location.get("name", "")):
+            if not _near_polygons(region["polygons"], lat, lon, REGION_TOLERANCE_KM):
+                return f"far from {region['names'][0]}"
+        return None
+
+    def triage(self, locations: List[Dict], country: str) -> List[Optional[str]]:
+        """flag() for every stop, in order."""
+        return [self.flag(loc, country) for loc in locations]
+
+
+def get_country_index() -> Optional[CountryIndex]:
+    """Return the process-wide index from COUNTRY_INDEX_PATH, or None if it has not been built."""
+    global _index
+    if _index is None and os.path.exists(COUNTRY_INDEX_PATH):
+        _index = CountryIndex.load(COUNTRY_INDEX_PATH)
+    return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the country boundary index from Natural Earth GeoJSON.")
+    parser.add_argument("--countries", required=True, help="Admin-0 countries GeoJSON")
+    parser.add_argument("--regions", help="Admin-1 states/provinces GeoJSON")
+    parser.add_argument("--output", default=COUNTRY_INDEX_PATH)
+    parser.add_argument("--tolerance", type=float, default=SIMPLIFY_DEGREES, help="Simplification tolerance in degrees")
+    args = parser.parse_args()
+
+    index = build_index(args.countries, args.regions, args.tolerance)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    print(f"✅ Indexed {len(index['countries'])} countries and {len(index['regions'])} regions to {args.output}")
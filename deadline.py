@@ -0,0 +1,55 @@
+"""
+Deadline
+Per-request time budget that is passed through every pipeline stage, so
+stages can cap their network timeouts, skip optional work when time runs
+out, and mark the result as degraded.
+"""
+
+import os
+import time
+from typing import List, Optional
+
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a required stage cannot finish within the request deadline."""
+
+
+class Deadline:
+    """Tracks the remaining time of one request and why its result is degraded."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = REQUEST_DEADLINE_SECONDS if seconds is None else seconds
+        self.expires_at = time.monotonic() + self.seconds
+        self.degraded_reasons: List[str] = []
+
+    def remaining(self) -> float:
+        """Seconds left, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def has_time_for(self, seconds: float) -> bool:
+        """Return True if at least `seconds` are left, used to decide whether to start optional work."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float, minimum: float = 1.0) -> float:
+        """Network timeout for the next call: the remaining time, capped, but at least `minimum`."""
+        return max(minimum, min(cap, self.remaining()))
+
+    def check(self, stage: str) -> None:
+        """Raise DeadlineExceeded if the budget is spent before a required stage."""
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:.0f}s exceeded before {stage}")
+
+    def degrade(self, reason: str) -> None:
+        """Record that optional work was skipped or cut short."""
+        print(f"⚠️ Degraded result: {reason} ({self.remaining():.1f}s left)")
+        self.degraded_reasons.append(reason)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.degraded_reasons)
@@ -1,6 +1,12 @@
 import re
 import ast
 from langchain.prompts import PromptTemplate
+from rate_limit import call_with_retry
+from llm_ledger import LedgerCallbackHandler
+
+# Header of the compact itinerary format: one '|'-delimited row per location
+COMPACT_FIELDS = ["day", "name", "lat", "lon", "stay_lat", "stay_lon", "description"]
+COMPACT_HEADER = "|".join(COMPACT_FIELDS)
 
 def get_coordinates_from_query(result):
     pattern = r"lat\s*:\s*([-\d.]+),\s*lon\s*:\s*([-\d.]+)"
@@ -73,12 +79,327 @@ def safe_extract_locations(llm_output: str):
     return locations
 
 
-   
-def extract_coords_from_llm_result(result):
+def parse_location_fragment(fragment: str):
+    """
+    Parse a single '{...}' location entry, applying the same fixes as safe_extract_locations.
+    Returns the location dict, or None if the fragment cannot be parsed.
+    """
+    fragment = fragment.replace("null", "None").replace("true", "True").replace("false", "False")
+    fragment = re.sub(r":\s*\d+\.\s+[a-zA-Z]+'?", ": None", fragment)
+    try:
+        loc = ast.literal_eval(fragment)
+    except Exception:
+        return None
+    if not isinstance(loc, dict):
+        return None
+    for key in ['lat', 'lon']:
+        try:
+            loc[key] = float(loc[key])
+        except:
+            loc[key] = None
+    return loc
+
+def iter_location_fragments(chunks, include_partial=False):
+    """
+    Yield the raw text of each '{...}' entry of a (streamed) LLM answer as soon as it is complete.
+    Args:
+        chunks: Iterable of text chunks, e.g. the contents of llm.stream(...).
+        include_partial: Also yield an entry left unclosed at the end, e.g. a truncated answer.
+    """
+    buffer = ""
+    pos = 0
+    depth = 0
+    start = None
+    quote = None
+    done = False
+    chunks = iter(chunks)
+    while not done:
+        chunk = next(chunks, None)
+        done = chunk is None
+        buffer += chunk or ""
+        while pos < len(buffer):
+            char = buffer[pos]
+            if quote:
+                # Inside a string literal braces do not count, until the same quote closes it.
+                # Entries never span lines, so a newline also resets a stray quote from broken output
+                if (char == quote and buffer[pos - 1] != "\\") or char == "\n":
+                    quote = None
+                elif char == "}" and depth == 1:
+                    # A quote still open at an entry boundary ('},' / '}]' / end of line) cannot be
+                    # balanced (e.g. "'lon': 27. organizes'"): close the entry here so the next ones
+                    # are not swallowed into it
+                    rest = buffer[pos + 1:].lstrip(" \t\r")
+                    if not rest and not done:
+                        break  # wait for the next chunk to tell
+                    if not rest or rest[0] in ",]\n":
+                        quote = None
+                        depth = 0
+                        yield buffer[start:pos + 1]
+            elif char in "'\"" and depth > 0:
+                quote = char
+            elif char == "{":
+                if depth == 0:
+                    start = pos
+                depth += 1
+            elif char == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    yield buffer[start:pos + 1]
+            pos += 1
+    if include_partial and depth > 0:
+        yield buffer[start:].rstrip().rstrip("]").rstrip()
+
+def iter_stream_locations(chunks):
+    """
+    Yield location dicts from a streamed LLM answer as soon as each '{...}' entry is complete.
+    Args:
+        chunks: Iterable of text chunks, e.g. the contents of llm.stream(...).
+    """
+    for fragment in iter_location_fragments(chunks):
+        loc = parse_location_fragment(fragment)
+        if loc is not None:
+            yield loc
+
+def iter_stream_compact_rows(chunks, duration=None):
+    """
+    Yield location dicts from a streamed compact-format answer as soon as each row is complete.
+    Rows are re-parsed with the strict parser as lines complete, so stays carry over between rows.
+    """
+    buffer = ""
+    emitted = 0
+    for chunk in chunks:
+        buffer += chunk
+        complete = buffer[:buffer.rfind("\n") + 1]
+        if not complete:
+            continue
+        locations, _ = parse_compact_itinerary(complete, duration)
+        yield from locations[emitted:]
+        emitted = len(locations)
+    locations, _ = parse_compact_itinerary(buffer, duration)
+    yield from locations[emitted:]
+
+def _is_broken(loc):
+    return loc is None or loc.get("lat") is None or loc.get("lon") is None
+
+def _get_repair_prompt(fragments):
+    """Prompt asking the LLM to fix only the given broken entries."""
+    entries = "\n".join(fragments)
+    return f"""
+You are a geolocation assistant fixing a broken trip plan.
+
+The entries below are broken Python dictionaries (cut off, or with invalid coordinates).
+Fix each one, keeping the place, day and description, with real coordinates accurate to within 1 km.
+Each dictionary must include: 'day', 'name', 'lat', 'lon', 'Stay_lat', 'Stay_lon', 'description'.
+
+{entries}
+
+Return exactly {len(fragments)} dictionaries, in the same order, as a Python list.
+Only return the list — no extra text or explanation.
+"""
+
+def _get_compact_repair_prompt(rows):
+    """Prompt asking the LLM to fix only the given rejected compact-format rows."""
+    entries = "\n".join(rows)
+    return f"""
+You are a geolocation assistant fixing a broken trip plan.
+
+The rows below are broken '|'-delimited rows of a trip plan (cut off, or with invalid values).
+Their columns are given by this header line:
+{COMPACT_HEADER}
+Fix each row, keeping the place, day and description, with real coordinates accurate to within 1 km.
+Fill in stay_lat and stay_lon, the coordinates of that night's stay, on every row.
+
+{entries}
+
+Return the header line followed by exactly {len(rows)} fixed rows, in the same order.
+Only return the header line and the rows — no extra text or explanation.
+"""
+
+def repair_locations(result, llm, deadline=None, locations=None):
+    """
+    Parse the answer entry by entry and send only the broken entries (unparseable, or
+    with invalid lat/lon such as "'lon': 27. organizes'") back to the LLM for correction.
+    Returns the locations in their original order, fixed entries merged with the parsed ones;
+    entries the repair could not fix are kept with missing coordinates, or dropped if unparseable.
+    With `locations` (the safe_extract_locations result) the fixes replace only its broken
+    entries, so the result never has fewer stops than it.
+    """
+    fragments = list(iter_location_fragments([result], include_partial=True))
+    parsed = [parse_location_fragment(fragment) for fragment in fragments]
+    broken = [ix for ix, loc in enumerate(parsed) if _is_broken(loc)]
+    if broken:
+        print(f"Repairing {len(broken)}/{len(fragments)} broken entries with the LLM")
+        ledger = LedgerCallbackHandler("repair_fragments", {"fragments": len(broken)})
+        try:
+            answer = call_with_retry("groq", llm.invoke, _get_repair_prompt([fragments[ix] for ix in broken]),
+                                     config={"callbacks": [ledger]}, deadline=deadline)
+            repaired = [loc for loc in safe_extract_locations(getattr(answer, "content", answer))
+                        if isinstance(loc, dict)]
+        except Exception as e:
+            print(f"Repair of broken entries failed: {e}")
+            repaired = []
+
+        if len(repaired) == len(broken):
+            matches = dict(zip(broken, repaired))
+        else:
+            # The model skipped or merged entries: match the fixes to the fragments by name
+            matches = {}
+            for ix in broken:
+                for loc in repaired:
+                    if str(loc.get("name", "")).casefold() in fragments[ix].casefold():
+                        matches[ix] = loc
+                        break
+        for ix, loc in matches.items():
+            if not _is_broken(loc):
+                parsed[ix] = loc
+    if not locations:
+        return [loc for loc in parsed if loc is not None]
+
+    merged = list(locations)
+    aligned = len(parsed) == len(merged)
+    for ix, loc in enumerate(merged):
+        if not _is_broken(loc):
+            continue
+        if aligned:
+            fix = parsed[ix]
+        else:
+            name = str(loc.get("name", "")).casefold()
+            fix = next((p for p in parsed if p is not None and str(p.get("name", "")).casefold() == name), None)
+        if not _is_broken(fix):
+            merged[ix] = fix
+    return merged
+
+def check_location_fields(loc, duration=None):
+    """Strict type and range check of a parsed location. Returns the reason it is invalid, or None."""
+    day = loc.get("day")
+    if not isinstance(day, int) or day < 1 or (duration is not None and day > int(duration)):
+        return f"day {day!r} out of range"
+    if not str(loc.get("name") or "").strip():
+        return "missing name"
+    for key, limit in (("lat", 90), ("lon", 180), ("Stay_lat", 90), ("Stay_lon", 180)):
+        value = loc.get(key)
+        if not isinstance(value, float) or not -limit <= value <= limit:
+            return f"{key} {value!r} out of range"
+    return None
+
+def parse_compact_itinerary(result, duration=None):
+    """
+    Strict parser of the compact format (see _get_trip_prompt_template(Config, compact=True)).
+    Rows after the header line are split on their first six '|'; empty stay fields repeat the
+    previous row's stay (the first row's default to its own coordinates). Every row is checked
+    with check_location_fields. Markdown table rows ('| 1 | ... |') and their '|---|' separator
+    rows are accepted too.
+    Returns (locations, rejected), rejected being (row text, reason) pairs in answer order.
+    """
+    lines = [line.strip().strip("`").strip() for line in result.splitlines()]
+    # Markdown tables wrap each row in one outer pipe on either side; plain rows may end in empty fields
+    lines = [line[1:-1].strip() if len(line) > 1 and line[0] == line[-1] == "|" else line for line in lines]
+    header = next((ix for ix, line in enumerate(lines) if line.replace(" ", "").lower() == COMPACT_HEADER), None)
+    rows = lines[header + 1:] if header is not None else lines
+
+    locations, rejected = [], []
+    stay = (None, None)
+    for row in rows:
+        if not row or "|" not in row or re.fullmatch(r"[\s|:-]+", row):
+            continue
+        fields = [field.strip() for field in row.split("|", len(COMPACT_FIELDS) - 1)]
+        if len(fields) < len(COMPACT_FIELDS) - 1:
+            rejected.append((row, f"{len(fields)} fields"))
+            continue
+        fields += [""] * (len(COMPACT_FIELDS) - len(fields))
+        raw = dict(zip(COMPACT_FIELDS, fields))
+        try:
+            loc = {"day": int(raw["day"]), "name": raw["name"], "lat": float(raw["lat"]), "lon": float(raw["lon"])}
+            if raw["stay_lat"] or raw["stay_lon"]:
+                stay = (float(raw["stay_lat"]), float(raw["stay_lon"]))
+            elif stay == (None, None):
+                stay = (loc["lat"], loc["lon"])
+        except ValueError as e:
+            rejected.append((row, str(e)))
+            continue
+        loc["Stay_lat"], loc["Stay_lon"] = stay
+        loc["description"] = raw["description"]
+        reason = check_location_fields(loc, duration)
+        if reason:
+            rejected.append((row, reason))
+        else:
+            locations.append(loc)
+    return locations, rejected
+
+def extract_compact_locations(result, duration=None, llm=None, deadline=None):
+    """
+    Parse a compact-format answer; with an llm, rejected rows are sent back in a repair prompt
+    and the fixed rows that pass the strict check are merged in day order.
+    """
+    locations, rejected = parse_compact_itinerary(result, duration)
+    for row, reason in rejected:
+        print(f"Rejected row ({reason}): {row}")
+    if rejected and llm is not None:
+        print(f"Repairing {len(rejected)} rejected rows with the LLM")
+        ledger = LedgerCallbackHandler("repair_fragments", {"fragments": len(rejected), "format": "compact"})
+        try:
+            answer = call_with_retry("groq", llm.invoke, _get_compact_repair_prompt([row for row, _ in rejected]),
+                                     config={"callbacks": [ledger]}, deadline=deadline)
+            # Fixed rows go through the same strict parser, rows still broken are dropped
+            repaired, still_rejected = parse_compact_itinerary(getattr(answer, "content", answer), duration)
+            for row, reason in still_rejected:
+                print(f"Repaired row still rejected ({reason}): {row}")
+        except Exception as e:
+            print(f"Repair of rejected rows failed: {e}")
+            repaired = []
+        locations.extend(repaired)
+        locations.sort(key=lambda loc: loc["day"])
+    return locations
+
+def parse_itinerary(result, compact=False, duration=None, llm=None, deadline=None):
+    """Parse one itinerary answer in the format it was asked for."""
+    if compact:
+        return extract_compact_locations(result, duration, llm, deadline)
+    return extract_coords_from_llm_result(result, llm, deadline)
+
+def split_itineraries(result: str, llm=None, deadline=None, compact=False, duration=None):
+    """
+    Split a multi-itinerary answer (see _get_trip_prompt_template(Config, variations)) into
+    separate location lists. Sections are found by their '### Itinerary <n>' headings; an
+    answer without headings is read as a list of lists, or as a single itinerary.
+    Empty sections are dropped. The other arguments are passed on to parse_itinerary.
+    """
+    sections = re.split(r"^[#*\s]*itinerary\s*\d+.*$", result, flags=re.IGNORECASE | re.MULTILINE)
+    if len(sections) > 1:
+        plans = [parse_itinerary(section.strip(), compact, duration, llm, deadline) for section in sections[1:]]
+        return [plan for plan in plans if plan]
+
+    try:
+        nested = None if compact else ast.literal_eval(result[result.find('['):result.rfind(']') + 1])
+    except Exception:
+        nested = None
+    if isinstance(nested, list) and nested and all(isinstance(plan, list) for plan in nested):
+        plans = [[loc for loc in plan if isinstance(loc, dict)] for plan in nested]
+        for plan in plans:
+            for loc in plan:
+                for key in ['lat', 'lon']:
+                    try:
+                        loc[key] = float(loc[key])
+                    except:
+                        loc[key] = None
+        return [plan for plan in plans if plan]
+
+    plan = parse_itinerary(result, compact, duration, llm, deadline)
+    return [plan] if plan else []
+
+def extract_coords_from_llm_result(result, llm=None, deadline=None):
+        """
+        Parse the LLM answer into location dicts.
+        With an llm, entries that cannot be parsed or have broken coordinates are repaired
+        with a small prompt holding only those entries (see repair_locations), instead of
+        losing them or the whole plan.
+        """
         try:
             locations = eval(result)
         except Exception as e:
             print (f" Error parsing result: {e} , trying to extract list from string.")
             locations = safe_extract_locations(result)
+            if llm is not None and (not locations or any(_is_broken(loc) for loc in locations)):
+                locations = repair_locations(result, llm, deadline=deadline, locations=locations)
         return locations
     
@@ -0,0 +1,191 @@
+"""
+Job Queue
+Persistent SQLite-backed queue of trip planning jobs, a local stand-in for a
+real broker: priorities, leases (a crashed worker's job is picked up again
+once its lease expires), retries with backoff and a dead-letter state.
+Workers (job_worker.py) are stateless and any number of them can share the
+queue store; the Streamlit app enqueues jobs and polls their status.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+from typing import Dict, List, Optional
+
+
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "output/jobs.sqlite")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Retry n waits JOB_RETRY_BASE_SECONDS * 2**(n-1)
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+
+STATUSES = ["queued", "running", "done", "dead"]
+# Request fields a job payload carries, the rest of the config comes from each worker's environment
+PAYLOAD_FIELDS = ["country", "city_start", "city_end", "composition", "max_km_dist_per_day", "duration",
+                  "month", "preferences", "location_val"]
+
+
+def payload_from_config(config, **options) -> Dict:
+    """Job payload for a request: its trip fields plus pipeline options such as fresh / reuse_similar."""
+    payload = {f: getattr(config, f) for f in PAYLOAD_FIELDS if hasattr(config, f)}
+    payload.update(options)
+    return payload
+
+
+class JobQueue:
+    """SQLite job queue, safe for concurrent workers: every state change is a single transaction."""
+
+    def __init__(self, path: str = JOB_QUEUE_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    available_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, available_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A short-lived connection per call, like the plan store; isolation_level=None lets
+        # claim() take the write lock up front with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, payload: Dict, priority: int = 0, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """Add a job; higher priorities are claimed first. Returns the job id."""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, priority, payload, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, priority, json.dumps(payload), max_attempts, now, now, now))
+        return job_id
+
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict]:
+        """
+        Lease the next job to worker_id: the highest priority, oldest queued job that is due, or a
+        running job whose lease expired (its worker died). Jobs out of attempts are dead-lettered
+        instead. Returns the job, or None if there is nothing to do.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired leases count as failed attempts
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', error = COALESCE(error, 'lease expired'), lease_owner = NULL, "
+                "updated_at = ? WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, now))
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY priority DESC, created_at LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, "
+                "lease_expires = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row["id"]))
+            job = self._to_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend the lease. Returns False if the job is no longer leased to this worker."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (now + lease_seconds, now, job_id, worker_id))
+            return cur.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict) -> bool:
+        """Mark the job done with its result. Returns False if the lease was lost meanwhile."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (json.dumps(result), time.time(), job_id, worker_id))
+            return cur.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> Optional[str]:
+        """
+        Record a failed attempt: the job is queued again after a backoff, or dead-lettered once it
+        has used max_attempts. Returns the new status, or None if the lease was lost meanwhile.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ? "
+                               "AND status = 'running'", (job_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            status = "dead" if row["attempts"] >= row["max_attempts"] else "queued"
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+            # Guarded on the lease again, another worker may have reclaimed the job since the select
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, available_at = ?, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (status, error, now + delay, now, job_id, worker_id))
+            return status if cur.rowcount == 1 else None
+
+    def retry_dead(self, job_id: str) -> bool:
+        """Give a dead-lettered job a fresh set of attempts."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?, updated_at = ? "
+                               "WHERE id = ? AND status = 'dead'", (now, now, job_id))
+            return cur.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the job as a dict (payload and result decoded), or None if unknown."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Most recently updated jobs, optionally of one status."""
+        query, args = "SELECT * FROM jobs", []
+        if status:
+            query, args = query + " WHERE status = ?", [status]
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY updated_at DESC LIMIT ?", args + [limit]).fetchall()
+        return [self._to_dict(row) for row in rows]
@@ -0,0 +1,115 @@
+"""
+Job Worker
+Stateless worker that claims trip planning jobs from the job queue
+(job_queue.py) and runs the plan pipeline on them. Throughput scales by
+starting more workers: several processes per host, on any number of hosts
+sharing the queue store (and the plan store / rate limit directory).
+
+Run with:
+    python job_worker.py                  # one worker, runs until interrupted
+    python job_worker.py --processes 4    # four worker processes on this host
+    python job_worker.py --once           # drain the queue, then exit
+"""
+
+import os
+import time
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+from typing import Dict
+
+from artifacts import artifact_path
+from config import get_config
+from deadline import Deadline
+from job_queue import JobQueue, JOB_LEASE_SECONDS
+from main import main as run_pipeline
+
+
+# Time budget of a queued request; larger than the interactive one, nobody is waiting on the page
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "300"))
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# Pipeline options a job payload may set, everything else is a config field
+JOB_OPTIONS = ("fresh", "reuse_similar", "segmented")
+
+
+def build_job_config(payload: Dict):
+    """Return the worker's default config with the job's request fields overridden."""
+    Config = get_config()
+    fields = {("max_km_dist_per_day" if k == "max_km" else k): v for k, v in payload.items() if k not in JOB_OPTIONS}
+    return type("JobConfig", (Config,), fields)
+
+
+def _keep_lease(queue: JobQueue, job_id: str, worker_id: str, done: threading.Event) -> None:
+    """Renew the job's lease every third of its length until the job finishes."""
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        if not queue.heartbeat(job_id, worker_id):
+            print(f"[{worker_id}] Lost the lease on job {job_id}, its result will be discarded")
+            return
+
+
+def run_job(queue: JobQueue, job: Dict, worker_id: str) -> None:
+    """Run the pipeline for one claimed job and record its result or failure."""
+    payload = job["payload"]
+    print(f"[{worker_id}] Job {job['id']} (attempt {job['attempts']}/{job['max_attempts']}): "
+          f"{payload.get('duration')} days in {payload.get('country')}")
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_keep_lease, args=(queue, job["id"], worker_id, done), daemon=True)
+    heartbeat.start()
+    try:
+        deadline = Deadline(JOB_DEADLINE_SECONDS)
+        # The archive's iteration column is an integer, the job id only names the exported files
+        locations = run_pipeline(0, fresh=payload.get("fresh", False), Config=build_job_config(payload),
+                                 deadline=deadline, reuse_similar=payload.get("reuse_similar", False),
+                                 segmented=payload.get("segmented", False), name=f"trip_{job['id']}")
+        result = {"locations": locations, "map_path": artifact_path("trip_map", "html", locations),
+                  "degraded_reasons": list(deadline.degraded_reasons), "worker": worker_id}
+    except Exception as e:
+        traceback.print_exc()
+        status = queue.fail(job["id"], worker_id, f"{type(e).__name__}: {e}")
+        print(f"[{worker_id}] Job {job['id']} failed: {e} -> {status or 'lease lost'}")
+        return
+    finally:
+        done.set()
+    if queue.complete(job["id"], worker_id, result):
+        print(f"[{worker_id}] Job {job['id']} done ({len(locations)} stops)")
+
+
+def work(once: bool = False) -> int:
+    """Claim and run jobs until interrupted (or, with once, until the queue has nothing due). Returns jobs run."""
+    queue = JobQueue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    print(f"[{worker_id}] Worker started on {queue.path}")
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+        run_job(queue, job, worker_id)
+        processed += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run trip planning jobs from the job queue.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this host")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue has no job due")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        work(args.once)
+    else:
+        workers = [multiprocessing.Process(target=work, args=(args.once,), name=f"job-worker-{i}")
+                   for i in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,180 @@
+"""
+LLM Ledger
+Records prompt/completion tokens and latency of every LLM call, tagged with
+the request parameters, and uses that history to size max_tokens per trip
+length so runaway generations are cut off.
+
+Print the summary with:
+    python llm_ledger.py
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+LLM_LEDGER_PATH = os.getenv("LLM_LEDGER_PATH", "output/llm_ledger.jsonl")
+# History needed before max_tokens is derived from it, and the headroom kept above the p95
+MIN_SAMPLES = 5
+MAX_TOKENS_MARGIN = 1.3
+MIN_MAX_TOKENS = 256
+# suggest_max_tokens re-reads the ledger at most this often per call
+LLM_LEDGER_CACHE_SECONDS = float(os.getenv("LLM_LEDGER_CACHE_SECONDS", "300"))
+# finish_reason values of completions cut off at max_tokens (Groq/OpenAI, Ollama)
+TRUNCATED_FINISH_REASONS = {"length", "max_tokens"}
+
+_write_lock = threading.Lock()
+_budget_lock = threading.Lock()
+# (path, call, format) -> (loaded at, number of samples, p95 completion tokens per trip day)
+_budget_cache: Dict[tuple, tuple] = {}
+
+
+def _usage_from_result(response) -> Dict[str, Optional[int]]:
+    """Extract token usage from a LangChain LLMResult (Groq/OpenAI chat models or Ollama)."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if prompt is None and response.generations and response.generations[0]:
+        generation = response.generations[0][0]
+        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        info = generation.generation_info or {}
+        prompt = metadata.get("input_tokens", info.get("prompt_eval_count"))
+        completion = metadata.get("output_tokens", info.get("eval_count"))
+    return {"prompt_tokens": prompt, "completion_tokens": completion}
+
+
+def _finish_reason(response) -> Optional[str]:
+    """Why the model stopped ('stop', or 'length' when cut off at max_tokens), if the provider says."""
+    if not response.generations or not response.generations[0]:
+        return None
+    generation = response.generations[0][0]
+    info = generation.generation_info or {}
+    metadata = getattr(getattr(generation, "message", None), "response_metadata", None) or {}
+    return info.get("finish_reason") or metadata.get("finish_reason") or metadata.get("done_reason")
+
+
+def record_call(call: str, latency_s: float, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                tags: Optional[Dict[str, Any]] = None, path: str = LLM_LEDGER_PATH,
+                finish_reason: Optional[str] = None) -> None:
+    """Append one LLM call to the ledger."""
+    entry = {"ts": time.time(), "call": call, "latency_s": round(latency_s, 3),
+             "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "finish_reason": finish_reason}
+    entry.update(tags or {})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _write_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+class LedgerCallbackHandler(BaseCallbackHandler):
+    """LangChain callback that writes every LLM call it sees to the ledger."""
+
+    def __init__(self, call: str, tags: Optional[Dict[str, Any]] = None, path: str = LLM_LEDGER_PATH):
+        self.call = call
+        self.tags = tags or {}
+        self.path = path
+        self._started: Dict[Any, float] = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        latency = time.perf_counter() - self._started.pop(run_id, time.perf_counter())
+        usage = _usage_from_result(response)
+        record_call(self.call, latency, usage["prompt_tokens"], usage["completion_tokens"], self.tags, self.path,
+                    finish_reason=_finish_reason(response))
+
+
+def request_tags(Config) -> Dict[str, Any]:
+    """Request parameters every ledger entry is tagged with."""
+    return {
+        "country": getattr(Config, "country", None),
+        "duration": getattr(Config, "duration", None),
+        "month": getattr(Config, "month", None),
+        "composition": getattr(Config, "composition", None),
+    }
+
+
+def load_ledger(call: Optional[str] = None, path: str = LLM_LEDGER_PATH) -> List[Dict]:
+    """Read ledger entries, optionally only those of one call."""
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if call is None or entry.get("call") == call:
+                entries.append(entry)
+    return entries
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def percentile_summary(call: Optional[str] = None, by: str = "duration",
+                       percentiles=(50, 90, 95, 99), path: str = LLM_LEDGER_PATH) -> Dict:
+    """
+    Latency and token percentiles per call, grouped by a tag.
+    Returns {(call, tag value): {'count', 'latency_s': {p: v}, 'prompt_tokens': {...}, 'completion_tokens': {...}}}.
+    """
+    groups = defaultdict(list)
+    for entry in load_ledger(call, path):
+        groups[(entry["call"], entry.get(by))].append(entry)
+
+    summary = {}
+    for key, entries in sorted(groups.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+        stats = {"count": len(entries)}
+        for field in ("latency_s", "prompt_tokens", "completion_tokens"):
+            values = [e[field] for e in entries if e.get(field) is not None]
+            stats[field] = {p: percentile(values, p) for p in percentiles}
+        summary[key] = stats
+    return summary
+
+
+def suggest_max_tokens(call: str, duration: int, default: Optional[int] = None,
+                       path: str = LLM_LEDGER_PATH, output_format: Optional[str] = None) -> Optional[int]:
+    """
+    max_tokens for a call on a trip of `duration` days: the p95 of completion tokens
+    per day seen so far, times the duration, with MAX_TOKENS_MARGIN headroom.
+    With output_format, only entries tagged with that format count ('dict' for entries from
+    before formats were tagged): compact answers are much shorter than dict ones.
+    Completions cut off at max_tokens are left out, they would only echo the old cap.
+    Returns `default` until MIN_SAMPLES calls with a known duration are recorded.
+    The p95 is cached per call and format and refreshed every LLM_LEDGER_CACHE_SECONDS.
+    """
+    now = time.monotonic()
+    with _budget_lock:
+        cached = _budget_cache.get((path, call, output_format))
+        if cached is None or now - cached[0] > LLM_LEDGER_CACHE_SECONDS:
+            per_day = [e["completion_tokens"] / e["duration"] for e in load_ledger(call, path)
+                       if e.get("completion_tokens") and e.get("duration")
+                       and e.get("finish_reason") not in TRUNCATED_FINISH_REASONS
+                       and (output_format is None or e.get("format", "dict") == output_format)]
+            cached = (now, len(per_day), percentile(per_day, 95))
+            _budget_cache[(path, call, output_format)] = cached
+    _, samples, p95 = cached
+    if samples < MIN_SAMPLES:
+        return default
+    return max(MIN_MAX_TOKENS, math.ceil(p95 * int(duration) * MAX_TOKENS_MARGIN))
+
+
+if __name__ == "__main__":
+    for (call, duration), stats in percentile_summary().items():
+        print(f"{call} duration={duration} n={stats['count']}")
+        for field in ("latency_s", "prompt_tokens", "completion_tokens"):
+            print(f"  {field:18s} " + "  ".join(f"p{p}={v}" for p, v in stats[field].items()))
@@ -1,45 +1,274 @@
-
-from extract_coordinates import extract_coords_from_llm_result
+import argparse
+from extract_coordinates import parse_itinerary, split_itineraries
 from multi_day_map import generate_map
 from config import get_config
 from remove_problemtaic_coords import ignore_null_coords_locations
-from prompt_trip import main_plan_prompt , _get_trip_prompt_template
-from validate_locations_coords import validate_location
+from prompt_trip import main_plan_prompt , _get_trip_prompt_template, get_llm_model, LLM_TIMEOUT_CAP, main_plan_variations, OUTPUT_FORMAT
+from validate_locations_coords import validate_location, MIN_GEOCODE_SECONDS
+from trip_export import export_trip
+from trip_archive import archive_itinerary
+from plan_store import PlanStore
+from deadline import Deadline
+from render_pool import RenderPipeline, RENDER_WORKERS, IO_WORKERS
+from poi_pool import plan_itineraries_from_pool
+from rate_limit import call_with_retry
+from llm_ledger import LedgerCallbackHandler, request_tags
+from profiler import profile_request
+from segmented_planner import plan_segmented, use_segmented_planning
+from variation_controller import VariationController, VARIATION_EARLY_STOP
 
 # --- Run LangChain chain ---
 
-def main(index=0):
+def generate_locations(Config, index=0, deadline=None, segmented=False, exclude=None):
     """
-    Main function to run the trip planner.
+    Generate a fresh trip plan with the LLM and clean its coordinates.
     Args:
-        index (int): Index for the trip iteration, used for generating unique filenames.
+        Config: Configuration object with the trip parameters.
+        index (int): Index for the trip iteration.
+        deadline: Optional deadline.Deadline; optional stages are skipped when it runs out.
+        segmented (bool): Plan trips longer than SEGMENT_THRESHOLD_DAYS as parallel segments
+                          (also enabled by SEGMENTED_PLANNING=true).
+        exclude: Optional place names the plan must avoid (covered by earlier variations).
+    Returns:
+        List of location dictionaries.
     """
-    # --- Load configuration ---
+    if use_segmented_planning(Config, force=segmented):
+        # Skeleton of overnight bases, then the segments' days in parallel LLM calls
+        locations = plan_segmented(Config, deadline=deadline, exclude=exclude)
+        return clean_locations(Config, locations, index, deadline=deadline)
 
-    Config = get_config()
-
-    PROMPT = _get_trip_prompt_template(Config)
+    compact = OUTPUT_FORMAT == "compact"
+    PROMPT = _get_trip_prompt_template(Config, compact=compact, exclude=exclude)
     # --- Initialize LLM ---
     # Run the main prompt to get the trip plan
-    result = main_plan_prompt(PROMPT , Config)
-    # --- Extract locations coordinates from the LLM result ---
-    locations = extract_coords_from_llm_result(result)
+    result = main_plan_prompt(PROMPT , Config, deadline=deadline, output_format=OUTPUT_FORMAT)
+    # --- Extract locations coordinates from the LLM result, repairing broken entries with the LLM ---
+    llm_timeout = None if deadline is None else deadline.timeout(LLM_TIMEOUT_CAP)
+    locations = parse_itinerary(result, compact, Config.duration, llm=get_llm_model(Config, timeout=llm_timeout),
+                                deadline=deadline)
+    return clean_locations(Config, locations, index, deadline=deadline)
 
+def clean_locations(Config, locations, index=0, deadline=None):
+    """
+    Validate the coordinates of a parsed plan (if enabled) and drop outlier locations.
+    Args:
+        Config: Configuration object with the trip parameters.
+        locations: Location dictionaries parsed from the LLM answer.
+        index (int): Index for the trip iteration.
+        deadline: Optional deadline.Deadline; optional stages are skipped when it runs out.
+    Returns:
+        List of location dictionaries.
+    """
     # Validate with geolocator. If coordinates significantly differ - query them again using LLM
-    # if Config.location_val:    
-    #     locations , locations_orig = validate_location(locations , llm_model)
-    # else:
-    #     locations_orig = locations.copy()
-    locations_orig = locations.copy()
+    if getattr(Config, "location_val", False) and deadline is not None and not deadline.has_time_for(MIN_GEOCODE_SECONDS):
+        deadline.degrade("skipped location validation")
+        locations_orig = locations.copy()
+    elif getattr(Config, "location_val", False):
+        llm_timeout = None if deadline is None else deadline.timeout(LLM_TIMEOUT_CAP)
+        locations , locations_orig = validate_location(locations , get_llm_model(Config, timeout=llm_timeout),
+                                                       deadline=deadline, country=Config.country)
+    else:
+        locations_orig = locations.copy()
     # Detect and remove locations which are way too far from most locations
     locations = ignore_null_coords_locations(locations , locations_orig, index ,
                                              threshold_km=Config.max_km_dist_per_day, ignore_geolocator=False)
+    return locations
+
+def main(index=0, fresh=False, Config=None, deadline=None, render=True, reuse_similar=False, segmented=False,
+         name=None):
+    """
+    Main function to run the trip planner.
+    Args:
+        index (int): Index for the trip iteration, used for generating unique filenames.
+        fresh (bool): Always generate a new plan instead of serving a stored one.
+        Config: Configuration object, loaded from the environment if not given.
+        deadline: deadline.Deadline for this request, REQUEST_DEADLINE_SECONDS if not given.
+                  deadline.degraded tells whether the result is a partial one.
+        render (bool): Render the map here; batch runs pass False and render on render_pool instead.
+        reuse_similar (bool): Serve a close-enough stored plan when there is none for this exact request.
+        segmented (bool): Plan long trips as parallel segments, see generate_locations.
+        name (str): Prefix of the exported files, 'trip_<index>' if not given.
+    """
+    # --- Load configuration ---
+    if Config is None:
+        Config = get_config()
+    if deadline is None:
+        deadline = Deadline()
+
+    # --- Serve a stored plan for this request if there is one ---
+    store = PlanStore()
+    locations, similarity = (None, None) if fresh else store.lookup(Config, reuse_similar=reuse_similar)
+    generated = False
+    if locations is not None:
+        print(f"Serving stored plan (similarity {similarity:.2f}), skipping LLM call.")
+    else:
+        try:
+            locations = generate_locations(Config, index, deadline=deadline, segmented=segmented)
+        except Exception:
+            # Out of time with no itinerary: fall back to any stored variation
+            locations = store.get_plan(Config) if deadline.expired() else None
+            if locations is None:
+                raise
+            deadline.degrade("LLM generation timed out, serving a stored plan")
+        else:
+            # Only complete plans are reused for later requests
+            if not deadline.degraded:
+                store.save_plan(Config, locations)
+            generated = True
+
+    # --- Export machine-readable GeoJSON / GPX / columnar files ---
+    if deadline.expired():
+        deadline.degrade("skipped GeoJSON/GPX/columnar exports")
+    else:
+        export_trip(locations, f"output/{name or f'trip_{index}'}")
 
     # --- Generate map with planned route---
-    generate_map(locations, index)
+    if render:
+        generate_map(locations, name or index)
+
+    # --- Append the itinerary with run metadata to the analytics archive ---
+    # Last, so a run failing in the exports or the map is only archived once, as a failure
+    if generated:
+        archive_itinerary(locations, Config, iteration=index, source="main")
+    return locations
     
+def generate_variations(Config, iterations, deadline=None):
+    """
+    Multi-sample mode: ask for all `iterations` itineraries in one LLM request and split them.
+    Returns the parsed, not yet cleaned, location lists; may hold fewer plans than requested.
+    """
+    compact = OUTPUT_FORMAT == "compact"
+    result = main_plan_variations(Config, iterations, deadline=deadline, compact=compact)
+    llm_timeout = None if deadline is None else deadline.timeout(LLM_TIMEOUT_CAP)
+    plans = split_itineraries(result, llm=get_llm_model(Config, timeout=llm_timeout), deadline=deadline,
+                              compact=compact, duration=Config.duration)
+    print(f"Got {len(plans)}/{iterations} itineraries from a single LLM request")
+    return plans[:iterations]
+
+def save_variation(Config, locations, index, source, store):
+    """Store, archive and export a finished batch variation; the map is rendered by the caller."""
+    store.save_plan(Config, locations)
+    archive_itinerary(locations, Config, iteration=index, source=source)
+    export_trip(locations, f"output/trip_{index}")
+    return locations
+
+def generate_until_converged(Config, iterations, pipeline, store):
+    """
+    Plan up to `iterations` variations one LLM call at a time, keeping only ones that differ from
+    the variations so far, re-prompting with an exclusion list after a near-duplicate and stopping
+    once the samples converge (see variation_controller). Returns the accepted variations.
+    """
+    controller = VariationController(iterations, fixed=[Config.city_start, Config.city_end])
+    while not controller.done:
+        exclude = controller.exclusions()
+        index = len(controller.accepted)
+        try:
+            locations = generate_locations(Config, index, deadline=Deadline(), exclude=exclude)
+        except Exception as e:
+            print(f"Error in variation {index + 1}: {e}")
+            archive_itinerary([], Config, iteration=index, source="converged", success=False, error=str(e))
+            controller.offer([], excluded=bool(exclude))
+            continue
+        if controller.offer(locations, excluded=bool(exclude)):
+            save_variation(Config, locations, index, "converged", store)
+            pipeline.submit_render(locations)
+    print(controller.report())
+    return controller.accepted
+
+def plan_from_pool(Config, iterations, refresh=False):
+    """
+    POI-pool mode: one LLM call for a pool of candidate places per (country, season, preferences),
+    cached and reused, then `iterations` itineraries assembled locally.
+    """
+    def invoke(prompt):
+        ledger = LedgerCallbackHandler("poi_pool_prompt", request_tags(Config))
+        return call_with_retry("groq", get_llm_model(Config, timeout=LLM_TIMEOUT_CAP).invoke, prompt,
+                               config={"callbacks": [ledger]}).content
+
+    validate = None
+    if Config.location_val:
+        validate = lambda pois: validate_location(pois, get_llm_model(Config, timeout=LLM_TIMEOUT_CAP),
+                                                  country=Config.country)[0]
+    return plan_itineraries_from_pool(Config, iterations, invoke, validate=validate, refresh=refresh)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the trip planner.")
+    parser.add_argument("--fresh", action="store_true", help="Generate new plans instead of serving stored ones")
+    parser.add_argument("--reuse-similar", action="store_true",
+                        help="Serve a close-enough stored plan when none matches the request exactly")
+    parser.add_argument("--poi-pool", action="store_true",
+                        help="Assemble all iterations locally from one cached LLM pool of places")
+    parser.add_argument("--multi-sample", action="store_true",
+                        help="Request all iterations in a single LLM call and split the answer")
+    parser.add_argument("--segmented", action="store_true",
+                        help="Plan long trips as a skeleton of bases plus parallel segment calls")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile every run (PROFILE_SAMPLE_RATE profiles a random share of runs)")
+    parser.add_argument("--until-converged", action="store_true", default=VARIATION_EARLY_STOP,
+                        help="Plan variations one by one, skipping near-duplicates and stopping once they converge")
+    parser.add_argument("--iterations", type=int, default=1, help="Number of trip variations to plan")
+    parser.add_argument("--io-workers", type=int, default=IO_WORKERS, help="Threads for LLM/geocoder stages")
+    parser.add_argument("--render-workers", type=int, default=RENDER_WORKERS, help="Processes for map rendering")
+    args = parser.parse_args()
+
     Config = get_config()
-    for index in range(1):
+
+    def run_iteration(index, render=True, fresh=args.fresh):
         print(f"Running trip planner iteration {index + 1}...")
-        main(index)
+        try:
+            with profile_request(f"main_{index}", force=args.profile):
+                return main(index, fresh=fresh, Config=Config, render=render, reuse_similar=args.reuse_similar,
+                            segmented=args.segmented)
+        except Exception as e:
+            # Keep failed runs in the archive so failure rates can be queried later
+            archive_itinerary([], Config, iteration=index, source="main", success=False, error=str(e))
+            raise
+
+    if args.poi_pool:
+        itineraries = plan_from_pool(Config, args.iterations, refresh=args.fresh)
+        store = PlanStore()
+        with profile_request("main_poi_pool", force=args.profile, all_threads=True), \
+                RenderPipeline(render_workers=args.render_workers, io_workers=args.io_workers) as pipeline:
+            for index, locations in enumerate(itineraries):
+                save_variation(Config, locations, index, "poi_pool", store)
+                pipeline.submit_render(locations)
+        for error in pipeline.errors:
+            print(f"Error: {error}")
+    elif args.multi_sample and args.iterations > 1:
+        store = PlanStore()
+
+        def finish_variation(index, locations):
+            try:
+                return save_variation(Config, clean_locations(Config, locations, index), index, "multi_sample", store)
+            except Exception as e:
+                # Archived like run_iteration failures, for the failure-rate queries
+                archive_itinerary([], Config, iteration=index, source="multi_sample", success=False, error=str(e))
+                raise
+
+        with profile_request("main_multi_sample", force=args.profile, all_threads=True), \
+                RenderPipeline(render_workers=args.render_workers, io_workers=args.io_workers) as pipeline:
+            plans = generate_variations(Config, args.iterations)
+            # Validation and clustering of each variation run on the I/O threads
+            for index, locations in enumerate(plans):
+                pipeline.submit_plan(finish_variation, None, index, locations)
+            # Variations the model left out are planned with separate requests, always new ones:
+            # a stored plan could repeat one of the variations above
+            for index in range(len(plans), args.iterations):
+                pipeline.submit_plan(run_iteration, None, index, render=False, fresh=True)
+        for error in pipeline.errors:
+            print(f"Error: {error}")
+    elif args.until_converged and args.iterations > 1:
+        with profile_request("main_converged", force=args.profile, all_threads=True), \
+                RenderPipeline(render_workers=args.render_workers, io_workers=args.io_workers) as pipeline:
+            generate_until_converged(Config, args.iterations, pipeline, PlanStore())
+        for error in pipeline.errors:
+            print(f"Error: {error}")
+    elif args.iterations == 1:
+        run_iteration(0)
+    else:
+        # Batch: planning on I/O threads, folium rendering on a process pool
+        with RenderPipeline(render_workers=args.render_workers, io_workers=args.io_workers) as pipeline:
+            for index in range(args.iterations):
+                pipeline.submit_plan(run_iteration, None, index, render=False)
+        for error in pipeline.errors:
+            print(f"Error: {error}")
@@ -1,17 +1,19 @@
-import os
 import pandas as pd
 import folium
 from collections import defaultdict
 
+from artifacts import get_or_create
 
-def generate_map(locations, index):
+
+def build_map(locations):
     """
-    Generate a map with the trip locations and save it as an HTML file.
-    :param locations: List of dictionaries with trip locations containing 'lat', 'lon', 'name', and 'day'.
-    :param index: Index for the output file name.
+    Build a folium map with the trip locations.
+    :param locations: List of dictionaries with trip locations containing 'lat', 'lon', 'Stay_lat', 'Stay_lon', 'name', and 'day'.
+    :return: folium.Map
     """
     # Group locations by coordinates to handle multiple days at same place
     location_groups = defaultdict(list)
+    locations = [dict(loc) for loc in locations] # Copy, so the caller's locations are not modified
     locations[-1]['lon'] += 0.0001 # Add epsilon to avoid ignoring connection of first and last identical locations 
     for loc in locations:
         coord_key = (round(loc['lat'], 6), round(loc['lon'], 6),round(loc['Stay_lat'], 6), round(loc['Stay_lon'], 6))  # Round to avoid floating point issues
@@ -115,7 +117,17 @@ def generate_map(locations, index):
             opacity=0.8
         ).add_to(m)
 
-    # Save map
-    os.makedirs("output", exist_ok=True)
-    m.save(f"output/trip_map_{index}.html")
-    print("✅ Map saved to output/trip_map.html")
\ No newline at end of file
+    return m
+
+
+def generate_map(locations, index=None):
+    """
+    Generate a map with the trip locations and save it as a content-addressed HTML artifact.
+    An identical itinerary rendered before is served from its existing file.
+    :param locations: List of dictionaries with trip locations containing 'lat', 'lon', 'name', and 'day'.
+    :param index: Trip iteration, only used in the log message.
+    :return: Path of the map file.
+    """
+    path = get_or_create("trip_map", "html", locations, lambda p: build_map(locations).save(p))
+    print(f"✅ Map{'' if index is None else f' {index}'} saved to {path}")
+    return path
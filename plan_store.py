@@ -0,0 +1,232 @@
+"""
+Plan Store
+SQLite store of finished trip plans, indexed on the canonical request
+(normalized strings, sorted preferences, bucketed max km per day) so repeat
+requests can be served without an LLM call. Close-enough requests can
+optionally reuse a similar stored plan.
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import calendar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+PLAN_STORE_DB = os.getenv("PLAN_STORE_DB", "output/plans.sqlite")
+# Requests whose max km per day fall in the same bucket share stored plans (200 and 249 km at 50)
+MAX_KM_BUCKET = int(os.getenv("PLAN_MAX_KM_BUCKET", "50"))
+# Minimum score (0-1) for a stored plan of a different request to be reused
+PLAN_SIMILARITY_THRESHOLD = float(os.getenv("PLAN_SIMILARITY_THRESHOLD", "0.75"))
+
+KEY_FIELDS = ["country", "city_start", "city_end", "duration", "month", "composition", "preferences", "max_km_bucket"]
+# A similar plan must match these exactly, the remaining fields are scored
+SIMILAR_MATCH_FIELDS = ["country", "city_start", "city_end", "duration"]
+SIMILARITY_WEIGHTS = {"preferences": 0.4, "month": 0.3, "composition": 0.15, "max_km_bucket": 0.15}
+
+_MONTHS = {name.casefold(): name.casefold() for name in calendar.month_name if name}
+_MONTHS.update({abbr.casefold(): name.casefold() for abbr, name in zip(calendar.month_abbr, calendar.month_name) if abbr})
+
+
+def _normalize_text(value) -> str:
+    """Lower-case and collapse whitespace, so 'Cluj  Napoca' and 'cluj napoca' match."""
+    return " ".join(str(value or "").split()).casefold()
+
+
+def _normalize_month(value) -> str:
+    """Full lower-case month name, so 'march', 'March' and 'Mar' match."""
+    month = _normalize_text(value).rstrip(".")
+    return _MONTHS.get(month, month)
+
+
+def max_km_bucket(max_km) -> int:
+    """Bucket of a max km per day value (floored, 200-249 km is one bucket at 50), -1 when it is not set."""
+    if max_km is None:
+        return -1
+    return int(float(max_km) // MAX_KM_BUCKET)
+
+
+def normalize_request(config) -> Dict:
+    """Return the canonical request parameters a stored plan is indexed on."""
+    preferences = getattr(config, "preferences", None) or []
+    return {
+        "country": _normalize_text(config.country),
+        "city_start": _normalize_text(config.city_start),
+        "city_end": _normalize_text(config.city_end),
+        "duration": int(config.duration),
+        "month": _normalize_month(config.month),
+        "composition": _normalize_text(getattr(config, "composition", "")),
+        "preferences": ",".join(sorted({_normalize_text(p) for p in preferences})),
+        "max_km_bucket": max_km_bucket(getattr(config, "max_km_dist_per_day", None)),
+    }
+
+
+def request_key(config) -> str:
+    """Canonical request key as a single string, e.g. for logs and caches keyed on the request."""
+    key = normalize_request(config)
+    return "|".join(str(key[f]) for f in KEY_FIELDS)
+
+
+def request_similarity(a: Dict, b: Dict) -> float:
+    """
+    Similarity (0-1) of two normalized requests that match on SIMILAR_MATCH_FIELDS:
+    preference overlap, month distance (adjacent months count half), same composition
+    and max km bucket distance, weighted by SIMILARITY_WEIGHTS.
+    """
+    if any(a[f] != b[f] for f in SIMILAR_MATCH_FIELDS):
+        return 0.0
+    prefs_a, prefs_b = set(filter(None, a["preferences"].split(","))), set(filter(None, b["preferences"].split(",")))
+    prefs = len(prefs_a & prefs_b) / len(prefs_a | prefs_b) if prefs_a | prefs_b else 1.0
+
+    months = list(_MONTHS.values())
+    if a["month"] == b["month"]:
+        month = 1.0
+    elif a["month"] in months and b["month"] in months:
+        gap = abs(months.index(a["month"]) - months.index(b["month"]))
+        month = 0.5 if min(gap, 12 - gap) == 1 else 0.0
+    else:
+        month = 0.0
+
+    composition = 1.0 if a["composition"] == b["composition"] else 0.0
+    if -1 in (a["max_km_bucket"], b["max_km_bucket"]):
+        # Plans stored before bucketing match any max km
+        km = 1.0
+    else:
+        km = max(0.0, 1.0 - abs(a["max_km_bucket"] - b["max_km_bucket"]) / 2)
+    scores = {"preferences": prefs, "month": month, "composition": composition, "max_km_bucket": km}
+    return sum(SIMILARITY_WEIGHTS[f] * scores[f] for f in SIMILARITY_WEIGHTS)
+
+
+class PlanStore:
+    """Stores finished itineraries and serves them back for identical requests."""
+
+    def __init__(self, path: str = PLAN_STORE_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS plans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    country TEXT NOT NULL,
+                    city_start TEXT NOT NULL,
+                    city_end TEXT NOT NULL,
+                    duration INTEGER NOT NULL,
+                    month TEXT NOT NULL,
+                    composition TEXT NOT NULL,
+                    preferences TEXT NOT NULL,
+                    max_km_bucket INTEGER NOT NULL DEFAULT -1,
+                    locations TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )""")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(plans)")}
+            if "max_km_bucket" not in columns:
+                # Stores created before requests were bucketed on max km: their plans keep -1,
+                # which get_plans treats as matching any bucket
+                conn.execute("ALTER TABLE plans ADD COLUMN max_km_bucket INTEGER NOT NULL DEFAULT -1")
+                conn.execute("DROP INDEX IF EXISTS idx_plans_request")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_plans_request ON plans ({', '.join(KEY_FIELDS)})")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A short-lived connection per call keeps the store safe to share across Streamlit threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def save_plan(self, config, locations: List[Dict]) -> int:
+        """Store a finished itinerary for the request described by config. Returns the plan id."""
+        key = normalize_request(config)
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"INSERT INTO plans ({', '.join(KEY_FIELDS)}, locations, created_at) "
+                f"VALUES ({', '.join('?' * (len(KEY_FIELDS) + 2))})",
+                [key[f] for f in KEY_FIELDS] + [json.dumps(locations), time.time()])
+            return cur.lastrowid
+
+    @staticmethod
+    def _request_where(config) -> Tuple[str, List]:
+        """WHERE clause and arguments matching the request's plans; plans without a max km bucket (-1) match any."""
+        key = normalize_request(config)
+        where = " AND ".join("(max_km_bucket = ? OR max_km_bucket = -1)" if f == "max_km_bucket" else f"{f} = ?"
+                             for f in KEY_FIELDS)
+        return where, [key[f] for f in KEY_FIELDS]
+
+    def get_plans(self, config) -> List[Dict]:
+        """
+        Return all stored variations for the request as {'id', 'created_at', 'locations'} dicts.
+        Plans stored without a max km bucket (-1) match any bucket.
+        """
+        where, args = self._request_where(config)
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT id, created_at, locations FROM plans WHERE {where}", args).fetchall()
+        return [{"id": r[0], "created_at": r[1], "locations": json.loads(r[2])} for r in rows]
+
+    def get_plan(self, config, random_choice: bool = True) -> Optional[List[Dict]]:
+        """
+        Return a stored itinerary for the request, or None if there is none.
+        With random_choice, a random stored variation is returned, otherwise the newest one.
+        """
+        plans = self.get_plans(config)
+        if not plans:
+            return None
+        plan = random.choice(plans) if random_choice else max(plans, key=lambda p: p["created_at"])
+        return plan["locations"]
+
+    def find_similar_plan(self, config, threshold: float = PLAN_SIMILARITY_THRESHOLD) -> Optional[Tuple[Dict, float]]:
+        """
+        Return the (plan, score) of the most similar stored request scoring at least threshold,
+        or None. Candidates must share country, start/end city and duration; the newest plan
+        of the best scoring request is returned.
+        """
+        key = normalize_request(config)
+        where = " AND ".join(f"{f} = ?" for f in SIMILAR_MATCH_FIELDS)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, created_at, locations, {', '.join(KEY_FIELDS)} FROM plans WHERE {where} "
+                f"ORDER BY created_at DESC", [key[f] for f in SIMILAR_MATCH_FIELDS]).fetchall()
+
+        best = None
+        for row in rows:
+            score = request_similarity(key, dict(zip(KEY_FIELDS, row[3:])))
+            if score >= threshold and (best is None or score > best[1]):
+                best = ({"id": row[0], "created_at": row[1], "locations": json.loads(row[2])}, score)
+        return best
+
+    def lookup(self, config, reuse_similar: bool = False) -> Tuple[Optional[List[Dict]], Optional[float]]:
+        """
+        Stored itinerary for the request and its similarity score: an exact canonical match
+        scores 1.0; with reuse_similar the closest stored request above the threshold is used
+        when there is no exact match. Returns (None, None) if nothing can be reused.
+        """
+        locations = self.get_plan(config)
+        if locations is not None:
+            return locations, 1.0
+        if reuse_similar:
+            similar = self.find_similar_plan(config)
+            if similar is not None:
+                return similar[0]["locations"], similar[1]
+        return None, None
+
+    def count_plans(self, config) -> int:
+        """Return how many variations are stored for the request."""
+        return len(self.get_plans(config))
+
+    def delete_plans_older_than(self, config, cutoff: float) -> int:
+        """
+        Delete stored variations of the request created before the cutoff timestamp, the same plans
+        get_plans serves (legacy ones without a max km bucket included). Returns the number deleted.
+        """
+        where, args = self._request_where(config)
+        with self._connect() as conn:
+            cur = conn.execute(f"DELETE FROM plans WHERE {where} AND created_at < ?", args + [cutoff])
+            return cur.rowcount
+
+    def iter_all_plans(self) -> Iterator[Dict]:
+        """Yield every stored plan as {'id', 'created_at', 'locations'}, one row at a time."""
+        conn = self._connect()
+        try:
+            for row in conn.execute("SELECT id, created_at, locations FROM plans ORDER BY id"):
+                yield {"id": row[0], "created_at": row[1], "locations": json.loads(row[2])}
+        finally:
+            conn.close()
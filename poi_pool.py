@@ -0,0 +1,276 @@
+"""
+POI Pool
+Alternative generation mode: the LLM is asked once per (country, season,
+preferences) for a large pool of geolocated candidate places, the pool is
+validated and cached on disk, and any number of distinct itineraries are
+then assembled locally under the duration, daily distance and overnight
+stay constraints.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from geopy.distance import geodesic
+from geopy.geocoders import Nominatim
+
+from extract_coordinates import safe_extract_locations
+from plan_store import _normalize_month, _normalize_text
+from rate_limit import call_with_retry
+from road_routing import get_router
+from validate_locations_coords import GEOCODE_TIMEOUT_CAP
+
+
+POI_POOL_DIR = os.getenv("POI_POOL_DIR", "output/poi_pools")
+POI_POOL_SIZE = int(os.getenv("POI_POOL_SIZE", "60"))
+POI_POOL_MAX_AGE_DAYS = float(os.getenv("POI_POOL_MAX_AGE_DAYS", "30"))
+# Same rule as the trip prompt: keep the overnight stay if the day ends closer than this to it
+STAY_SWITCH_KM = 50
+DEFAULT_MAX_KM = 150
+# Weight kept by places already used in an earlier variation, so variations differ
+REUSE_PENALTY = 0.25
+
+_SEASONS = {"december": "winter", "january": "winter", "february": "winter",
+            "march": "spring", "april": "spring", "may": "spring",
+            "june": "summer", "july": "summer", "august": "summer",
+            "september": "autumn", "october": "autumn", "november": "autumn"}
+
+
+def season_of(month) -> str:
+    """Season of a month name ('March', 'mar', ...), the normalized month itself if unknown."""
+    month = _normalize_month(month)
+    return _SEASONS.get(month, month)
+
+
+def _preferences(config) -> List[str]:
+    # main/Streamlit configs have 'preferences', the agent's TripConfig calls them 'interests'
+    prefs = getattr(config, "preferences", None) or getattr(config, "interests", None) or []
+    return sorted({_normalize_text(p) for p in prefs})
+
+
+def pool_key(config) -> Dict:
+    """The request parameters a POI pool is shared across."""
+    return {"country": _normalize_text(config.country), "season": season_of(config.month),
+            "preferences": _preferences(config)}
+
+
+def _pool_path(key: Dict, pool_dir: str) -> str:
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(pool_dir, f"pool_{digest}.json")
+
+
+def _get_poi_pool_prompt(config, size: int = POI_POOL_SIZE) -> str:
+    """Prompt for a pool of candidate places, not tied to a route or a number of days."""
+    preferences = _preferences(config)
+    return f"""
+You are a travel expert and geolocation assistant.
+
+Your task: List {size} places worth visiting on a road trip in {config.country} in {season_of(config.month)}.
+
+Preferences:
+- Enjoy : {', '.join(preferences) or 'anything well-known'}
+- Prefer well-known, or natural sites
+- Spread the places over the whole country, including smaller towns used as overnight bases
+
+Return the places as a Python list of dictionaries.
+Each dictionary must include:
+- 'name': Exact name of the location or attraction
+- 'lat': Latitude in decimal degrees
+- 'lon': Longitude in decimal degrees
+- 'tags': List of the preferences above the place matches
+- 'description': Short, optional description
+
+VERY IMPORTANT:
+- All coordinates ('lat', 'lon') must be real and accurate to within 1 km of the actual location.
+- Do NOT invent places. Avoid ambiguous or generic names.Select locations that Nominatim can recognize.
+- Every place must be open or worth visiting in {season_of(config.month)}.
+
+
+Only return the list — no extra text or explanation.
+"""
+
+
+def load_pool(config, pool_dir: str = POI_POOL_DIR, max_age_days: float = POI_POOL_MAX_AGE_DAYS) -> Optional[Dict]:
+    """Return the cached pool record for the request, or None if there is none or it is too old."""
+    path = _pool_path(pool_key(config), pool_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        record = json.load(f)
+    if time.time() - record.get("created_at", 0) > max_age_days * 86400:
+        return None
+    return record
+
+
+def save_pool(config, record: Dict, pool_dir: str = POI_POOL_DIR) -> str:
+    """Write the pool record atomically, so concurrent readers never see a partial file."""
+    os.makedirs(pool_dir, exist_ok=True)
+    path = _pool_path(pool_key(config), pool_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_poi_pool(config, invoke: Callable[[str], str],
+                 validate: Optional[Callable[[List[Dict]], List[Dict]]] = None,
+                 refresh: bool = False, pool_dir: str = POI_POOL_DIR) -> Dict:
+    """
+    Return the pool record {'key', 'created_at', 'pois', 'cities'} for the request.
+    On a cache miss, invoke(prompt) -> str is called once, its answer parsed, passed through
+    validate (e.g. geocoder checks) if given, de-duplicated and cached.
+    """
+    record = None if refresh else load_pool(config, pool_dir)
+    if record is not None:
+        print(f"Using cached POI pool ({len(record['pois'])} places)")
+        return record
+
+    pois = safe_extract_locations(invoke(_get_poi_pool_prompt(config)))
+    if validate is not None:
+        pois = validate(pois)
+
+    unique = {}
+    for poi in pois:
+        name = _normalize_text(poi.get("name"))
+        if name and poi.get("lat") is not None and poi.get("lon") is not None and name not in unique:
+            unique[name] = {"name": poi["name"], "lat": float(poi["lat"]), "lon": float(poi["lon"]),
+                            "tags": [_normalize_text(t) for t in poi.get("tags") or []],
+                            "description": poi.get("description", "")}
+    if not unique:
+        raise ValueError("LLM returned no usable places for the POI pool")
+
+    record = {"key": pool_key(config), "created_at": time.time(), "pois": list(unique.values()), "cities": {}}
+    save_pool(config, record, pool_dir)
+    print(f"Cached POI pool with {len(record['pois'])} places")
+    return record
+
+
+def _city_coords(record: Dict, config, city: str, pool_dir: str = POI_POOL_DIR) -> Tuple[float, float]:
+    """Coordinates of a start/end city, geocoded once and kept in the pool record."""
+    key = _normalize_text(city)
+    if key not in record["cities"]:
+        geolocator = Nominatim(user_agent="trip_planner", timeout=GEOCODE_TIMEOUT_CAP)
+        result = call_with_retry("nominatim", geolocator.geocode, f"{city}, {config.country}")
+        if result is None:
+            raise ValueError(f"Could not geocode {city}")
+        record["cities"][key] = [result.latitude, result.longitude]
+        save_pool(config, record, pool_dir)
+    return tuple(record["cities"][key])
+
+
+def _distance_matrix(points: Sequence[Tuple[float, float]]) -> List[List[float]]:
+    """Road km between all points when a road network is configured, straight-line km otherwise."""
+    router = get_router()
+    if router is not None:
+        _, km = router.table(points, points)
+        return km
+    return [[0.0 if i == j else geodesic(a, b).kilometers for j, b in enumerate(points)]
+            for i, a in enumerate(points)]
+
+
+def assemble_itinerary(points: List[Dict], km: List[List[float]], duration: int, max_km: float,
+                       rng: random.Random, weights: Sequence[float]) -> List[Dict]:
+    """
+    Build one itinerary by a randomized greedy walk over the pool.
+    points are the start city, the end city, then the pool places, all as {'name', 'lat', 'lon'}.
+    Each day visits 1-3 unused places within max_km of driving, only picks places from which
+    the end city stays reachable in the days left, and moves the overnight stay to the last
+    place of the day unless that is within STAY_SWITCH_KM of the current stay.
+    """
+    start, end = 0, 1
+    used = set()
+    stay = start
+    itinerary = []
+    for day in range(1, duration + 1):
+        days_left = duration - day
+        pos, driven, stops = stay, 0.0, []
+        for _ in range(rng.choice((1, 2, 2, 3))):
+            candidates, candidate_weights = [], []
+            for p in range(2, len(points)):
+                leg = km[pos][p]
+                if p in used or driven + leg > max_km:
+                    continue
+                if km[p][end] > (max_km - driven - leg) + max_km * days_left:
+                    continue
+                candidates.append(p)
+                # Prefer nearby places, so days are not spent driving
+                candidate_weights.append(weights[p - 2] / (1 + leg / 25))
+            if not candidates:
+                break
+            p = rng.choices(candidates, candidate_weights)[0]
+            used.add(p)
+            driven += km[pos][p]
+            pos = p
+            stops.append(p)
+
+        if day == duration:
+            stay = end
+        elif km[stay][pos] > STAY_SWITCH_KM:
+            stay = pos
+        stay_lat, stay_lon = points[stay]["lat"], points[stay]["lon"]
+
+        if not stops:
+            # Nothing reachable today: a free day around the overnight stay
+            itinerary.append({"day": day, "name": f"Free day in {points[stay]['name']}", "lat": stay_lat,
+                              "lon": stay_lon, "Stay_lat": stay_lat, "Stay_lon": stay_lon, "description": ""})
+        for p in stops:
+            itinerary.append({"day": day, "name": points[p]["name"], "lat": points[p]["lat"],
+                              "lon": points[p]["lon"], "Stay_lat": stay_lat, "Stay_lon": stay_lon,
+                              "description": points[p].get("description", "")})
+    return itinerary
+
+
+def assemble_itineraries(record: Dict, config, n: int, seed: Optional[int] = None,
+                         attempts: int = 5, pool_dir: str = POI_POOL_DIR) -> List[List[Dict]]:
+    """
+    Assemble up to n distinct itineraries from a pool record. Places used by earlier variations
+    are down-weighted by REUSE_PENALTY, and an itinerary visiting exactly the same places
+    as an earlier one is retried up to `attempts` times, then left out: a small pool can
+    yield fewer than n. pool_dir is where the record lives, geocoded cities are saved back there.
+    """
+    cities = [config.city_start, config.city_end]
+    points = [dict(zip(("name", "lat", "lon"), (city,) + _city_coords(record, config, city, pool_dir)))
+              for city in cities]
+    points += record["pois"]
+    km = _distance_matrix([(p["lat"], p["lon"]) for p in points])
+    max_km = float(getattr(config, "max_km_dist_per_day", None) or DEFAULT_MAX_KM)
+
+    preferences = set(_preferences(config))
+    base_weights = [1.0 + len(preferences & set(p.get("tags") or [])) for p in record["pois"]]
+    poi_index = {p["name"]: i for i, p in enumerate(record["pois"])}
+    rng = random.Random(seed)
+    used_counts = [0] * len(base_weights)
+    seen = set()
+    itineraries = []
+    for variation in range(n):
+        weights = [w * REUSE_PENALTY ** used_counts[i] for i, w in enumerate(base_weights)]
+        for _ in range(attempts):
+            itinerary = assemble_itinerary(points, km, int(config.duration), max_km, rng, weights)
+            visited = frozenset(loc["name"] for loc in itinerary)
+            if visited not in seen:
+                break
+        else:
+            print(f"Variation {variation + 1} repeats an earlier itinerary after {attempts} attempts, skipping it")
+            continue
+        seen.add(visited)
+        for loc in itinerary:
+            if loc["name"] in poi_index:
+                used_counts[poi_index[loc["name"]]] += 1
+        itineraries.append(itinerary)
+    return itineraries
+
+
+def plan_itineraries_from_pool(config, n: int, invoke: Callable[[str], str],
+                               validate: Optional[Callable[[List[Dict]], List[Dict]]] = None,
+                               refresh: bool = False, seed: Optional[int] = None,
+                               pool_dir: str = POI_POOL_DIR) -> List[List[Dict]]:
+    """One LLM call at most (none with a cached pool), then up to n distinct itineraries assembled locally."""
+    record = get_poi_pool(config, invoke, validate=validate, refresh=refresh, pool_dir=pool_dir)
+    t = time.time()
+    itineraries = assemble_itineraries(record, config, n, seed=seed, pool_dir=pool_dir)
+    print(f"Assembled {len(itineraries)} itineraries from the POI pool in {time.time() - t:.3f} seconds")
+    return itineraries
@@ -0,0 +1,152 @@
+"""
+Prewarm
+Scheduler/worker that precomputes and refreshes plans and maps for popular
+trip requests during off-peak hours, so the Streamlit app can serve them
+straight from the plan store.
+
+Run with:
+    python prewarm.py            # loop forever, work only inside PREWARM_HOURS
+    python prewarm.py --once     # single pass (e.g. from cron), still window-bound
+    python prewarm.py --once --ignore-window
+"""
+
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, List
+
+from config import get_config
+from main import generate_locations
+from multi_day_map import generate_map
+from plan_store import PlanStore
+from trip_archive import archive_itinerary
+
+
+def get_prewarm_settings():
+    """
+    Load prewarm settings from environment variables.
+    """
+    class Settings:
+        popular_trips_file = os.getenv("POPULAR_TRIPS_FILE", "popular_trips.json")
+        # Off-peak window as 'start-end' hours, local time. '22-6' wraps around midnight, '0-0' is all day
+        hours = os.getenv("PREWARM_HOURS", "1-6")
+        # Geocode-validate prewarmed plans whatever LOCATION_VAL says: off-peak there is time for it,
+        # and the app then serves checked coordinates without waiting on the geocoder
+        location_val = os.getenv("PREWARM_LOCATION_VAL", "True").lower() == "true"
+        # Max km per day of entries without one: the Streamlit slider's default, so the app's
+        # default requests land in the same plan store bucket as the prewarmed plans
+        max_km = int(os.getenv("PREWARM_MAX_KM", "200"))
+        # Maximum number of LLM plan generations per pass
+        llm_budget = int(os.getenv("PREWARM_LLM_BUDGET", "20"))
+        # Number of stored variations to keep per request and how long they stay fresh
+        variations = int(os.getenv("PREWARM_VARIATIONS", "3"))
+        max_age_hours = float(os.getenv("PREWARM_MAX_AGE_HOURS", "168"))
+        # Minimum hours between passes, the LLM budget is spent at most once per pass
+        pass_interval_hours = float(os.getenv("PREWARM_PASS_INTERVAL_HOURS", "24"))
+        # Seconds to wait between scheduler checks
+        check_interval = int(os.getenv("PREWARM_CHECK_INTERVAL", "600"))
+
+    return Settings
+
+
+def in_off_peak_window(hours: str, now: datetime = None) -> bool:
+    """Return True if the current hour is inside the 'start-end' window; equal hours mean all day."""
+    start, end = (int(h) for h in hours.split("-"))
+    hour = (now or datetime.now()).hour
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def load_popular_trips(path: str) -> List[Dict]:
+    """
+    Load the list of popular requests. Each entry overrides the default config, e.g.
+    {"country": "Romania", "city_start": "Cluj Napoca", "city_end": "Cluj Napoca",
+     "duration": 7, "month": "July", "composition": "Couple", "preferences": ["Nature", "Culture"]}
+    """
+    if not os.path.exists(path):
+        print(f"No popular trips file found at {path}")
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_config(overrides: Dict, location_val: bool = True, max_km: int = 200):
+    """Return the default config with location_val and max km set and the request's fields overridden."""
+    Config = get_config()
+    fields = {"location_val": location_val, "max_km_dist_per_day": max_km}
+    fields.update({"max_km_dist_per_day" if k == "max_km" else k: v for k, v in overrides.items()})
+    return type("PrewarmConfig", (Config,), fields)
+
+
+def run_pass(settings, store: PlanStore, ignore_window: bool = False) -> int:
+    """
+    Refresh stale or missing variations of every popular request until the LLM budget is spent.
+    Returns the number of LLM generations used.
+    """
+    budget = settings.llm_budget
+    cutoff = time.time() - settings.max_age_hours * 3600
+
+    for trip_ix, overrides in enumerate(load_popular_trips(settings.popular_trips_file)):
+        Config = build_config(overrides, settings.location_val, settings.max_km)
+        fresh_plans = [p for p in store.get_plans(Config) if p["created_at"] >= cutoff]
+        missing = settings.variations - len(fresh_plans)
+
+        for variation in range(missing):
+            if budget <= 0:
+                print("LLM budget spent, stopping prewarm pass.")
+                return settings.llm_budget - budget
+            if not ignore_window and not in_off_peak_window(settings.hours):
+                print("Left off-peak window, stopping prewarm pass.")
+                return settings.llm_budget - budget
+
+            print(f"Prewarming {Config.country} {Config.city_start} -> {Config.city_end}, "
+                  f"{Config.duration} days in {Config.month} (variation {variation + 1}/{missing})")
+            budget -= 1
+            try:
+                # Geocoder validation shares the host-wide Nominatim rate limit
+                locations = generate_locations(Config, variation)
+                store.save_plan(Config, locations)
+                generate_map(locations, f"prewarm_{trip_ix}_{variation}")
+                # After the map, so a failed render is archived once, as a failure
+                archive_itinerary(locations, Config, iteration=variation, source="prewarm")
+            except Exception as e:
+                print(f"Error prewarming trip {trip_ix}: {e}")
+                archive_itinerary([], Config, iteration=variation, source="prewarm", success=False, error=str(e))
+
+        # Drop stale variations once enough fresh ones replace them
+        fresh_count = len([p for p in store.get_plans(Config) if p["created_at"] >= cutoff])
+        if fresh_count >= settings.variations:
+            store.delete_plans_older_than(Config, cutoff)
+
+    return settings.llm_budget - budget
+
+
+def run_scheduler(ignore_window: bool = False, once: bool = False) -> None:
+    """Run prewarm passes inside the off-peak window, sleeping outside it."""
+    settings = get_prewarm_settings()
+    store = PlanStore()
+    last_pass = 0.0
+    while True:
+        due = time.time() - last_pass >= settings.pass_interval_hours * 3600
+        if due and (ignore_window or in_off_peak_window(settings.hours)):
+            last_pass = time.time()
+            used = run_pass(settings, store, ignore_window)
+            print(f"Prewarm pass finished, {used} LLM generations used.")
+        elif once:
+            print(f"Outside off-peak window {settings.hours}, nothing to do.")
+        if once:
+            return
+        time.sleep(settings.check_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute plans for popular trip requests.")
+    parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    parser.add_argument("--ignore-window", action="store_true", help="Run even outside the off-peak window")
+    args = parser.parse_args()
+    run_scheduler(ignore_window=args.ignore_window, once=args.once)
@@ -0,0 +1,148 @@
+"""
+Sampling Profiler
+Low-overhead, stdlib-only sampling profiler for pipeline runs: a background
+thread reads the stacks of the profiled thread(s) every few milliseconds via
+sys._current_frames and counts them. Each profiled request writes a
+collapsed-stack file (input for flamegraph.pl / speedscope) and a top-N
+hot-function summary to PROFILE_DIR.
+
+Switches (env): PROFILE=true profiles every request, PROFILE_SAMPLE_RATE=0.05
+profiles a random 5% of them.
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+
+PROFILE_ALWAYS = os.getenv("PROFILE", "False").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "output/profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    if filename == "__init__.py":
+        # Name packages by their directory, e.g. 're/__init__.py:sub'
+        filename = f"{os.path.basename(os.path.dirname(code.co_filename))}/{filename}"
+    return f"{filename}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (or every thread but its own) at a fixed interval.
+    Stacks are kept as root-first tuples of 'file.py:function' labels with their sample counts.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frames = {self.thread_id: frames[self.thread_id]} if self.thread_id in frames else {}
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if self.thread_id is None:
+                    # Profiling several threads: keep them apart at the root of the flamegraph
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append(f"thread:{names.get(thread_id, thread_id)}")
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text, one 'root;...;leaf count' line per distinct stack."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def hot_functions(self) -> Tuple[Counter, Counter]:
+        """(self, total) sample counts per function: self counts leaf frames, total any frame."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return own, total
+
+    def summary(self, top_n: int = PROFILE_TOP_N) -> str:
+        """Top-N hot functions by self and total time, as text."""
+        own, total = self.hot_functions()
+        stack_samples = sum(self.stacks.values()) or 1
+        # The sampler can fall behind its interval (it needs the GIL), so time is apportioned by share
+        seconds_per_sample = self.elapsed / max(self.samples, 1)
+        lines = [f"{self.samples} samples (every {self.interval * 1000:.1f} ms requested) over {self.elapsed:.2f} s", ""]
+        for title, counts in (("Self time", own), ("Total time", total)):
+            lines.append(f"{title} (top {top_n}):")
+            for label, count in counts.most_common(top_n):
+                lines.append(f"  {100 * count / stack_samples:6.2f}%  {count * seconds_per_sample:8.3f} s  {label}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def write(self, name: str, profile_dir: str = PROFILE_DIR) -> Dict[str, str]:
+        """Write <name>.collapsed and <name>.top.txt. Returns their paths."""
+        os.makedirs(profile_dir, exist_ok=True)
+        paths = {"collapsed": os.path.join(profile_dir, f"{name}.collapsed"),
+                 "summary": os.path.join(profile_dir, f"{name}.top.txt")}
+        with open(paths["collapsed"], "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(paths["summary"], "w", encoding="utf-8") as f:
+            f.write(self.summary())
+        return paths
+
+
+def should_profile(force: bool = False) -> bool:
+    """Whether to profile this request: forced, PROFILE=true, or sampled at PROFILE_SAMPLE_RATE."""
+    return force or PROFILE_ALWAYS or random.random() < PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def profile_request(name: str, force: bool = False, all_threads: bool = False) -> Iterator[Optional[SamplingProfiler]]:
+    """
+    Profile the block if this request is selected (see should_profile), writing the results
+    as <PROFILE_DIR>/<name>_<timestamp>.* when it ends, also when it raises.
+    Only the calling thread is sampled unless all_threads is set, e.g. for batch runs on a pool.
+    Yields the profiler, or None when the request is not profiled.
+    """
+    if not should_profile(force):
+        yield None
+        return
+    profiler = SamplingProfiler(None if all_threads else threading.get_ident()).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        paths = profiler.write(f"{name}_{time.strftime('%Y%m%d-%H%M%S')}")
+        print(f"Profile written to {paths['collapsed']} and {paths['summary']}")
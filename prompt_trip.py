@@ -1,6 +1,15 @@
 from langchain.prompts import PromptTemplate
 from langchain_groq import ChatGroq
+import os
 import time
+from rate_limit import call_with_retry
+from llm_ledger import LedgerCallbackHandler, request_tags, suggest_max_tokens
+from extract_coordinates import COMPACT_HEADER
+
+# Longest single LLM request allowed within a request deadline, in seconds
+LLM_TIMEOUT_CAP = 120
+# Itinerary format asked from the LLM: 'dict' (Python list of dicts) or 'compact' ('|'-delimited rows)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "dict")
 
 def _get_trip_prompt_template(Config):
     """
@@ -48,11 +57,55 @@ Only return the list — no extra text or explanation.
     
     return PROMPT
 
-def _get_trip_prompt_template(Config):
+def _get_trip_prompt_template(Config, variations=1, compact=False, exclude=None):
     """
     Returns the prompt template for generating a trip plan.
+    With variations > 1, asks for that many different itineraries in one answer,
+    each under a '### Itinerary <n>' heading (see extract_coordinates.split_itineraries).
+    With compact, asks for '|'-delimited rows under a single header line instead of a list of
+    dicts repeating every key (see extract_coordinates.parse_compact_itinerary).
+    With exclude, asks to avoid those places, already covered by earlier variations
+    (see variation_controller.VariationController.exclusions).
     """ 
    
+    if compact:
+        output_spec = f"""Return the trip as rows separated by '|', starting with this header line:
+{COMPACT_HEADER}
+- day: Day number (1 to {Config.duration}) - same day can have multiple rows
+- name: Exact name of the location or attraction
+- lat, lon: Latitude and longitude in decimal degrees, 4 decimals
+- stay_lat, stay_lon: Latitude and longitude of the place where staying at night; leave both empty when the same as the previous row
+- description: Short, optional description, without '|'
+Example:
+{COMPACT_HEADER}
+1|Bran Castle|45.5149|25.3672|45.6427|25.5887|Medieval castle
+1|Rasnov Fortress|45.5922|25.4606|||Hilltop fortress"""
+        plan_kind = "header line and rows"
+    else:
+        output_spec = f"""Return the trip as a Python list of dictionaries.
+Each dictionary must include:
+- 'day': Day number (1 to {Config.duration}) - same day can have multiple locations
+- 'name': Exact name of the location or attraction
+- 'lat': Latitude in decimal degrees
+- 'lon': Longitude in decimal degrees
+- 'Stay_lat' : Latitude in decimal degree of the place where staying at night
+- 'Stay_lon' : Longitude in decimal degree of the place where staying at night
+- 'description': Short, optional description"""
+        plan_kind = "Python list of dictionaries"
+
+    if variations > 1:
+        output_format = f"""Return {variations} clearly different itineraries, with different places and staying locations where possible.
+Write each one under its own heading line '### Itinerary <number>', followed by its {plan_kind}.
+Only return the headings and the itineraries — no extra text or explanation."""
+    elif compact:
+        output_format = "Only return the header line and the rows — no extra text or explanation."
+    else:
+        output_format = "Only return the list — no extra text or explanation."
+
+    exclusion_rule = ""
+    if exclude:
+        exclusion_rule = f"- Other itineraries already cover these places, do NOT include them: {'; '.join(exclude)}\n"
+
     # --- Prompt for the trip plan ---
     PROMPT = f"""
 You are a travel planner and geolocation assistant.
@@ -70,15 +123,7 @@ Preferences:
 - Prefer well-known, or natural sites
 - Aim to build the route which will enable as least Staying locations switches as possible 
 
-Return the trip as a Python list of dictionaries.
-Each dictionary must include:
-- 'day': Day number (1 to {Config.duration}) - same day can have multiple locations
-- 'name': Exact name of the location or attraction
-- 'lat': Latitude in decimal degrees
-- 'lon': Longitude in decimal degrees
-- 'Stay_lat' : Latitude in decimal degree of the place where staying at night
-- 'Stay_lon' : Longitude in decimal degree of the place where staying at night
-- 'description': Short, optional description
+{output_spec}
 
 VERY IMPORTANT:
 - All coordinates ('lat', 'lon') must be real and accurate to within 1 km of the actual location.
@@ -87,25 +132,69 @@ VERY IMPORTANT:
 - No more than 2.5 hours drive per day
 - No more than {Config.max_km_dist_per_day * 1.5} kilometers per day
 - Do not change Staying location if it is less then 50 kilometers away from the next location
+{exclusion_rule}
 
-
-Only return the list — no extra text or explanation.
+{output_format}
 """
     
     
     return PROMPT
     
-def main_plan_prompt(PROMPT: str , Config) -> str:
+def get_llm_model(Config, timeout: float = None, max_tokens: int = None):
         """
-        Main function to generate the trip plan using the LLM.
+        Returns the chat model used for trip planning and coordinate fallback.
+        timeout caps each HTTP request, normally derived from the request deadline.
+        max_tokens caps the completion, normally from llm_ledger.suggest_max_tokens.
         """
-        llm_model = ChatGroq(model="llama-3.3-70b-versatile", api_key=Config.GROQ_API_KEY)
+        # Client-side retries are disabled, rate_limit.call_with_retry owns retry and backoff
+        return ChatGroq(model="llama-3.3-70b-versatile", api_key=Config.GROQ_API_KEY, max_retries=0,
+                        timeout=timeout, max_tokens=max_tokens)
 
-        # Now this should work
-        result = llm_model.invoke(PROMPT)
+def _invoke_within_deadline(Config, prompt, deadline, max_tokens, config=None):
+        """
+        One LLM attempt, for call_with_retry: the model is built per attempt so its timeout
+        is capped by the time left now, not when the first attempt started.
+        """
+        timeout = None if deadline is None else deadline.timeout(LLM_TIMEOUT_CAP)
+        return get_llm_model(Config, timeout=timeout, max_tokens=max_tokens).invoke(prompt, config=config)
+
+def main_plan_prompt(PROMPT: str , Config, deadline=None, output_format="dict") -> str:
+        """
+        Main function to generate the trip plan using the LLM.
+        With a deadline.Deadline, each attempt's request timeout is capped by the time left.
+        output_format is recorded in the ledger, to compare tokens and latency across formats.
+        """
+        if deadline is not None:
+            deadline.check("LLM call")
+        # Completion budget sized from past generations of trips this long
+        max_tokens = suggest_max_tokens("main_plan_prompt", Config.duration, output_format=output_format)
+        ledger = LedgerCallbackHandler("main_plan_prompt", dict(request_tags(Config), format=output_format))
+
+        # Shared rate limit across processes, with backoff on 429s
+        result = call_with_retry("groq", _invoke_within_deadline, Config, PROMPT, deadline, max_tokens,
+                                 config={"callbacks": [ledger]}, deadline=deadline)
         result = result.content
         return result
 
+def main_plan_variations(Config, variations: int, deadline=None, compact=False) -> str:
+        """
+        Generate `variations` itineraries in a single LLM request, so the long prompt is sent once.
+        Groq only accepts n=1 and Ollama has no n parameter, so the variations are requested as
+        headed sections of one answer; split them with extract_coordinates.split_itineraries.
+        """
+        if deadline is not None:
+            deadline.check("LLM call")
+        # Single-plan history per day, scaled to all variations
+        max_tokens = suggest_max_tokens("main_plan_prompt", Config.duration * variations,
+                                        output_format="compact" if compact else "dict")
+        tags = dict(request_tags(Config), variations=variations, format="compact" if compact else "dict")
+        ledger = LedgerCallbackHandler("main_plan_variations", tags)
+
+        result = call_with_retry("groq", _invoke_within_deadline, Config,
+                                 _get_trip_prompt_template(Config, variations, compact), deadline, max_tokens,
+                                 config={"callbacks": [ledger]}, deadline=deadline)
+        return result.content
+
 
         # prompt_template = PromptTemplate(
         # input_variables=["query"],
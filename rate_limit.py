@@ -0,0 +1,205 @@
+"""
+Rate Limit
+Token-bucket rate limiting shared across processes (via a file lock) and
+jittered exponential backoff with a retry budget, for the Groq LLM and the
+Nominatim geocoder.
+"""
+
+import os
+import json
+import time
+import random
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+
+from deadline import DeadlineExceeded
+from geopy.exc import GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", os.path.join(tempfile.gettempdir(), "trip_planner_ratelimit"))
+
+# Requests per second and burst size for each shared limiter
+LIMITS = {
+    "groq": (float(os.getenv("GROQ_REQUESTS_PER_MIN", "30")) / 60, int(os.getenv("GROQ_BURST", "3"))),
+    # Nominatim's usage policy allows at most 1 request per second per host
+    "nominatim": (1 / float(os.getenv("GEOCODE_MIN_DELAY", "1.0")), 1),
+}
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class FileTokenBucket:
+    """
+    Token bucket whose state lives in a small JSON file guarded by an exclusive
+    file lock, so every process on the host draws from the same bucket.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: int, state_dir: str = RATE_LIMIT_DIR):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f"{name}.bucket")
+        self.rate = rate
+        self.capacity = capacity
+        # The file lock is per process, threads of one process serialize on this lock first
+        self._thread_lock = threading.Lock()
+
+    def _lock(self, f) -> None:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock(self, f) -> None:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _try_take(self) -> float:
+        """Take a token if available. Returns 0 on success, otherwise the seconds to wait."""
+        with self._thread_lock, open(self.path, "a+") as f:
+            self._lock(f)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens = state.get("tokens", self.capacity)
+                tokens = min(self.capacity, tokens + (now - state.get("updated", now)) * self.rate)
+
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": now}))
+                f.flush()
+                return wait
+            finally:
+                self._unlock(f)
+
+    def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """Block until a token is available. Returns False if max_wait seconds pass first."""
+        deadline = None if max_wait is None else time.time() + max_wait
+        while True:
+            wait = self._try_take()
+            if wait == 0:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of all calls, so a sustained outage does not
+    multiply the load on a struggling service.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 5):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.retries < self.min_retries + self.ratio * self.calls:
+                self.retries += 1
+                return True
+            return False
+
+
+_limiters: Dict[str, FileTokenBucket] = {}
+_budgets: Dict[str, RetryBudget] = {}
+
+
+def get_limiter(name: str) -> FileTokenBucket:
+    """Return the shared limiter for a service ('groq' or 'nominatim')."""
+    if name not in _limiters:
+        rate, capacity = LIMITS[name]
+        _limiters[name] = FileTokenBucket(name, rate, capacity)
+    return _limiters[name]
+
+
+def get_retry_budget(name: str) -> RetryBudget:
+    """Return the process-wide retry budget for a service."""
+    if name not in _budgets:
+        _budgets[name] = RetryBudget(ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.2")))
+    return _budgets[name]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return True for throttling, timeouts and transient server errors."""
+    if isinstance(error, (GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable)):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in RETRYABLE_STATUS
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Return the server-requested delay from a 429 response, if any."""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        retry_after = headers.get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(service: str, func: Callable, *args, max_retries: int = None,
+                    base_delay: float = 1.0, max_delay: float = 60.0, deadline=None, **kwargs):
+    """
+    Call func under the service's shared rate limit, retrying transient failures
+    with full-jitter exponential backoff while the retry budget allows.
+    Args:
+        service: Limiter name, 'groq' or 'nominatim'.
+        func: The client call, e.g. llm_model.invoke or geolocator.geocode.
+        max_retries: Retries per call (default MAX_RETRIES env, 4).
+        deadline: Optional deadline.Deadline, no waiting or retrying past it.
+    """
+    if max_retries is None:
+        max_retries = int(os.getenv("MAX_RETRIES", "4"))
+    limiter = get_limiter(service)
+    budget = get_retry_budget(service)
+    budget.record_call()
+
+    attempt = 0
+    while True:
+        if not limiter.acquire(max_wait=None if deadline is None else deadline.remaining()):
+            raise DeadlineExceeded(f"Request deadline reached while waiting for the {service} rate limit")
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries or not budget.try_spend():
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if deadline is not None and not deadline.has_time_for(delay):
+                raise
+            attempt += 1
+            print(f"{service} call failed ({e}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
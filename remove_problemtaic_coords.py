@@ -2,11 +2,15 @@ import pandas as pd
 from geopy.distance import geodesic
 import numpy as np
 from sklearn.cluster import AgglomerativeClustering
+from road_routing import get_router
 
 def locations_clusters(coords, threshold_km=100):
     """
     Performs agglomerative clustering on latitude/longitude coordinates
     using a distance threshold in kilometers.
+    Distances are road kilometers when a road network is configured (ROAD_NETWORK_PBF),
+    straight-line otherwise, and for pairs the router cannot snap or connect (e.g. an island,
+    or a stop outside the extract).
 
     Args:
         coords: List of (lat, lon) tuples.
@@ -17,12 +21,23 @@ def locations_clusters(coords, threshold_km=100):
     """
     n = len(coords)
     # Compute distance matrix
-    dist_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(i + 1, n):
-            dist = geodesic(coords[i], coords[j]).kilometers
-            dist_matrix[i, j] = dist
-            dist_matrix[j, i] = dist
+    router = get_router()
+    if router is not None:
+        points = [tuple(c) for c in coords]
+        _, km = router.table(points, points)
+        km = np.array(km)
+        for i, j in zip(*np.nonzero(np.isinf(km))):
+            km[i, j] = geodesic(coords[i], coords[j]).kilometers
+        # Clustering needs a symmetric matrix, one-way streets can make the two directions differ
+        dist_matrix = np.minimum(km, km.T)
+        np.fill_diagonal(dist_matrix, 0)
+    else:
+        dist_matrix = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                dist = geodesic(coords[i], coords[j]).kilometers
+                dist_matrix[i, j] = dist
+                dist_matrix[j, i] = dist
 
     # Perform clustering
     clustering = AgglomerativeClustering(
@@ -0,0 +1,176 @@
+"""
+Render Pool
+Batch pipeline that keeps CPU-bound folium rendering off the I/O threads:
+plans are produced by a thread pool (LLM / geocoder calls), handed over
+through a bounded queue and rendered by a process pool.
+
+Re-render every stored plan, e.g. after a map style change:
+    python render_pool.py --rerender-store --render-workers 8
+"""
+
+import os
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from artifacts import existing_artifact, get_or_create
+from plan_store import PlanStore
+
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "64"))
+# Render processes are spawned rather than forked: forking a process that runs I/O threads can
+# copy their locks (logging, SQLite, HTTP clients) into the child in a held state
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "spawn")
+
+
+# Artifact kind of each map style, see artifacts.py
+MAP_KINDS = {"multi_day": "trip_map", "simple": "trip_map_simple"}
+
+
+def _render_to(locations: List[Dict], output_path: str, style: str) -> None:
+    if style == "multi_day":
+        from multi_day_map import build_map
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        build_map(locations).save(output_path)
+    else:
+        from restructured_trip_planner import Location, MapGenerator
+        fields = ("day", "name", "lat", "lon", "description")
+        MapGenerator.generate_trip_map([Location(**{k: loc.get(k) for k in fields if k in loc})
+                                        for loc in locations], output_path)
+
+
+def render_map(locations: List[Dict], output_path: Optional[str] = None,
+               style: str = "multi_day") -> Optional[str]:
+    """
+    Render one map to output_path, or to its content-addressed artifact when no path is given
+    (reused as is if the same itinerary was rendered before). Runs in a worker process, so imports stay local.
+    style: 'multi_day' (multi_day_map, overnight stays) or 'simple' (restructured MapGenerator).
+    Returns None, writing nothing, when no location has coordinates.
+    """
+    if not any(loc.get("lat") is not None and loc.get("lon") is not None for loc in locations):
+        print("No valid locations to map")
+        return None
+    if output_path is None:
+        return get_or_create(MAP_KINDS[style], "html", locations, lambda p: _render_to(locations, p, style))
+    _render_to(locations, output_path, style)
+    return output_path
+
+
+class RenderPipeline:
+    """
+    Two-stage pipeline: I/O tasks on threads, map rendering on processes.
+    The queue between the stages is bounded, so when rendering falls behind the
+    I/O threads block instead of piling up finished plans in memory.
+    """
+
+    _DONE = object()
+
+    def __init__(self, render_workers: int = RENDER_WORKERS, io_workers: int = IO_WORKERS,
+                 queue_size: int = RENDER_QUEUE_SIZE, style: str = "multi_day"):
+        self.style = style
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="plan-io")
+        self.render_pool = ProcessPoolExecutor(max_workers=render_workers,
+                                               mp_context=multiprocessing.get_context(RENDER_START_METHOD))
+        self.render_queue = queue.Queue(maxsize=queue_size)
+        # At most two maps per render process in flight, the rest wait in the queue
+        self.in_flight = threading.BoundedSemaphore(render_workers * 2)
+        # Paths of the finished maps; the render futures themselves are dropped as they complete
+        self.rendered: List[str] = []
+        self.errors: List[str] = []
+        self.dispatcher = threading.Thread(target=self._dispatch, name="render-dispatch", daemon=True)
+        self.dispatcher.start()
+
+    def _dispatch(self) -> None:
+        """Move queued plans into the process pool as render slots free up."""
+        while True:
+            item = self.render_queue.get()
+            if item is self._DONE:
+                return
+            locations, output_path = item
+            self.in_flight.acquire()
+            try:
+                future = self.render_pool.submit(render_map, locations, output_path, self.style)
+            except Exception as e:
+                # E.g. a broken pool: record it and keep draining, so submit_render never blocks on a full queue
+                self.in_flight.release()
+                self.errors.append(f"render submit failed: {e}")
+                continue
+            future.add_done_callback(self._render_done)
+
+    def _render_done(self, future: Future) -> None:
+        self.in_flight.release()
+        if future.exception() is not None:
+            self.errors.append(f"render failed: {future.exception()}")
+        elif future.result() is not None:
+            self.rendered.append(future.result())
+
+    def submit_render(self, locations: List[Dict], output_path: Optional[str] = None) -> None:
+        """
+        Queue a finished plan for rendering, blocking while the queue is full. Without an output_path
+        the map goes to its content-addressed artifact, and a map already rendered is not queued at all.
+        """
+        if not locations:
+            return
+        if output_path is None:
+            existing = existing_artifact(MAP_KINDS[self.style], "html", locations)
+            if existing is not None:
+                self.rendered.append(existing)
+                return
+        self.render_queue.put((locations, output_path))
+
+    def submit_plan(self, plan_fn: Callable[..., Optional[List[Dict]]], output_path: Optional[str] = None,
+                    *args, **kwargs) -> Future:
+        """Run plan_fn(*args, **kwargs) on an I/O thread and queue its locations for rendering."""
+        def task():
+            try:
+                locations = plan_fn(*args, **kwargs)
+            except Exception as e:
+                self.errors.append(f"{output_path or getattr(plan_fn, '__name__', 'plan')}{args}: {e}")
+                raise
+            self.submit_render(locations, output_path)
+            return locations
+
+        return self.io_pool.submit(task)
+
+    def close(self) -> List[str]:
+        """Wait for all planning and rendering to finish. Returns the rendered map paths."""
+        self.io_pool.shutdown(wait=True)
+        self.render_queue.put(self._DONE)
+        self.dispatcher.join()
+        self.render_pool.shutdown(wait=True)
+        return list(self.rendered)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def rerender_store(output_dir: str = "output/maps", render_workers: int = RENDER_WORKERS,
+                   style: str = "multi_day") -> List[str]:
+    """Re-render the map of every plan in the plan store, streaming plans from SQLite into the pool."""
+    with RenderPipeline(render_workers=render_workers, style=style) as pipeline:
+        for plan in PlanStore().iter_all_plans():
+            pipeline.submit_render(plan["locations"], os.path.join(output_dir, f"plan_{plan['id']}.html"))
+    paths = pipeline.rendered
+    print(f"✅ Rendered {len(paths)} maps to {output_dir} ({len(pipeline.errors)} errors)")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render trip maps on a process pool.")
+    parser.add_argument("--rerender-store", action="store_true", help="Re-render every plan in the plan store")
+    parser.add_argument("--output-dir", default="output/maps")
+    parser.add_argument("--render-workers", type=int, default=RENDER_WORKERS)
+    parser.add_argument("--style", choices=["multi_day", "simple"], default="multi_day")
+    args = parser.parse_args()
+    if args.rerender_store:
+        rerender_store(args.output_dir, args.render_workers, args.style)
+    else:
+        parser.print_help()
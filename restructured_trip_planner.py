@@ -16,6 +16,17 @@ from langchain.prompts import PromptTemplate
 from langchain_ollama import OllamaLLM
 from geopy.distance import geodesic
 from dotenv import load_dotenv
+from trip_export import export_trip
+from rate_limit import call_with_retry
+from deadline import Deadline
+from validate_locations_coords import (GEOCODE_TIMEOUT_CAP, MIN_GEOCODE_SECONDS, MIN_LLM_FALLBACK_SECONDS,
+                                       geocode_within_deadline)
+from trip_archive import archive_itinerary
+from poi_pool import plan_itineraries_from_pool
+from profiler import profile_request
+from country_index import get_country_index
+from artifacts import get_or_create
+from variation_controller import VariationController, VARIATION_EARLY_STOP
 
 
 @dataclass
@@ -90,10 +101,10 @@ class LLMService:
     def __init__(self, model_name: str, base_url: str):
         self.llm = OllamaLLM(model=model_name, base_url=base_url)
     
-    def generate_trip_plan(self, config: TripConfig) -> str:
-        """Generate trip plan using LLM."""
+    def generate_trip_plan(self, config: TripConfig, exclude: Optional[List[str]] = None) -> str:
+        """Generate trip plan using LLM, avoiding the places in exclude if given."""
         prompt_template = PromptTemplate(
-            input_variables=["country", "duration", "city_start", "city_end", "month"],
+            input_variables=["country", "duration", "city_start", "city_end", "month", "exclusions"],
             template=self._get_trip_prompt_template()
         )
         
@@ -104,7 +115,9 @@ class LLMService:
             "duration": config.duration,
             "city_start": config.city_start,
             "city_end": config.city_end,
-            "month": config.month
+            "month": config.month,
+            "exclusions": (f"Other itineraries already cover these places, do NOT include them: {'; '.join(exclude)}\n"
+                           if exclude else "")
         }
         
         start_time = time.time()
@@ -141,7 +154,7 @@ Check that:
 - Each location name is real and specific enough to be found on Nominatim.
 - The coordinates (lat/lon) are accurate within 1 km of the real location.
 - There are no invented, ambiguous, or overly generic names.
-
+{exclusions}
 Step 3: If any location is unclear or inaccurate, revise it using a real-world equivalent.
 Return only the improved trip as a Python list of dictionaries, one per day:
 - 'day': integer
@@ -158,17 +171,31 @@ class GeolocationValidator:
     """Validates and corrects location coordinates."""
     
     def __init__(self, llm_service: LLMService):
-        self.geolocator = Nominatim(user_agent="trip_planner", timeout=100)
+        self.geolocator = Nominatim(user_agent="trip_planner", timeout=GEOCODE_TIMEOUT_CAP)
         self.llm_service = llm_service
     
-    def validate_locations(self, locations: List[Location], country: str) -> List[Location]:
-        """Validate and correct location coordinates."""
-        for location in locations:
-            if not location.has_coordinates():
+    def validate_locations(self, locations: List[Location], country: str,
+                           deadline: Optional[Deadline] = None) -> List[Location]:
+        """
+        Validate and correct location coordinates, stopping early when the deadline runs out.
+        With a built country index, only locations it flags are geocoded.
+        """
+        index = get_country_index()
+        flags = index.triage([loc.to_dict() for loc in locations], country) if index else [True] * len(locations)
+        for ix, location in enumerate(locations):
+            if not location.has_coordinates() or not flags[ix]:
                 continue
+            if deadline is not None and not deadline.has_time_for(MIN_GEOCODE_SECONDS):
+                deadline.degrade(f"validated only {ix}/{len(locations)} locations")
+                break
                 
             # Try to geocode the location
-            geo_result = self.geolocator.geocode(f"{location.name}, {country}")
+            try:
+                geo_result = call_with_retry("nominatim", geocode_within_deadline, self.geolocator,
+                                             f"{location.name}, {country}", deadline, deadline=deadline)
+            except Exception as e:
+                print(f"Warning: Could not geocode {location.name}: {e}")
+                continue
             
             if geo_result is None:
                 print(f"Warning: Could not geocode {location.name}")
@@ -179,6 +206,9 @@ class GeolocationValidator:
             lon_diff = abs(geo_result.longitude - location.lon)
             
             if lat_diff > 0.25 or lon_diff > 0.25:
+                if deadline is not None and not deadline.has_time_for(MIN_LLM_FALLBACK_SECONDS):
+                    deadline.degrade(f"skipped LLM coordinate fallback for {location.name}")
+                    continue
                 print(f"Large coordinate difference for {location.name}, using LLM detection")
                 new_lat, new_lon = self.llm_service.detect_coordinates(location.name)
                 if new_lat is not None and new_lon is not None:
@@ -268,42 +298,108 @@ class TripPlanner:
     
     def plan_trip(self, iteration: int = 0) -> List[Location]:
         """Plan a complete trip and generate map."""
+        locations = self.generate_trip(iteration)
+        self._save_outputs(locations, iteration, source="restructured")
+        return locations
+
+    def generate_trip(self, iteration: int = 0, exclude: Optional[List[str]] = None) -> List[Location]:
+        """Plan a trip without saving it, avoiding the places in exclude if given."""
         print(f"Planning trip iteration {iteration + 1}...")
         
+        deadline = Deadline()
+
         # Generate trip plan using LLM
-        llm_result = self.llm_service.generate_trip_plan(self.config)
+        llm_result = self.llm_service.generate_trip_plan(self.config, exclude=exclude)
         
         # Extract locations from LLM result
         locations_data = CoordinateExtractor.extract_locations_list(llm_result)
         locations = [Location(**loc_data) for loc_data in locations_data]
         
         # Validate and correct coordinates
-        locations = self.validator.validate_locations(locations, self.config.country)
+        locations = self.validator.validate_locations(locations, self.config.country, deadline)
         
         # Filter outliers and invalid locations
         locations = self.validator.filter_outliers(locations)
-        
-        # Generate map
-        output_path = f"output/trip_map_{iteration}.html"
-        self.map_generator.generate_trip_map(locations, output_path)
+
+        if deadline.degraded:
+            print(f"Trip {iteration + 1} is partial: {'; '.join(deadline.degraded_reasons)}")
+        return locations
+
+    def plan_trips_until_converged(self, num_iterations: int) -> List[List[Location]]:
+        """
+        Plan up to num_iterations trips, keeping only ones that differ from the trips so far and
+        stopping once new samples stop adding diversity (see variation_controller).
+        """
+        controller = VariationController(num_iterations, fixed=[self.config.city_start, self.config.city_end])
+        trips = []
+        while not controller.done:
+            exclude = controller.exclusions()
+            iteration = len(trips)
+            try:
+                locations = self.generate_trip(iteration, exclude=exclude)
+            except Exception as e:
+                print(f"Error in trip {iteration + 1}: {e}")
+                archive_itinerary([], self.config, iteration=iteration, source="restructured", success=False,
+                                  error=str(e))
+                controller.offer([], excluded=bool(exclude))
+                continue
+            if controller.offer([loc.to_dict() for loc in locations], excluded=bool(exclude)):
+                self._save_outputs(locations, iteration, source="restructured")
+                trips.append(locations)
+        print(controller.report())
+        return trips
+
+    def plan_trips_from_pool(self, num_iterations: int, refresh: bool = False) -> List[List[Location]]:
+        """
+        Plan num_iterations trips from one cached pool of candidate places (a single LLM call
+        per country, season and preferences), assembling each itinerary locally.
+        """
+        def validate(pois: List[Dict]) -> List[Dict]:
+            checked = self.validator.validate_locations(
+                [Location(day=0, name=p["name"], lat=p.get("lat"), lon=p.get("lon")) for p in pois],
+                self.config.country)
+            return [{**p, "lat": loc.lat, "lon": loc.lon} for p, loc in zip(pois, checked)]
+
+        itineraries = plan_itineraries_from_pool(self.config, num_iterations, self.llm_service.llm.invoke,
+                                                 validate=validate, refresh=refresh)
+        trips = []
+        for iteration, itinerary in enumerate(itineraries):
+            locations = [Location(day=loc["day"], name=loc["name"], lat=loc["lat"], lon=loc["lon"],
+                                  description=loc.get("description", "")) for loc in itinerary]
+            self._save_outputs(locations, iteration, source="poi_pool")
+            trips.append(locations)
+        return trips
+
+    def _save_outputs(self, locations: List[Location], iteration: int, source: str) -> None:
+        """Write the map, CSV and exports of a finished trip and append it to the archive."""
+        # Generate map, named by the itinerary's content so identical trips share one file
+        if any(loc.has_coordinates() for loc in locations):
+            map_path = get_or_create("trip_map_simple", "html", [loc.to_dict() for loc in locations],
+                                     lambda path: self.map_generator.generate_trip_map(locations, path))
+            print(f"✅ Map of trip {iteration + 1} at {map_path}")
+        else:
+            print(f"No valid locations to map for trip {iteration + 1}")
         
         # Save coordinates to CSV
         self._save_coordinates_csv(locations, iteration)
-        
-        return locations
+
+        # Export GeoJSON / GPX / columnar files for downstream consumers
+        export_trip((loc.to_dict() for loc in locations if loc.has_coordinates()),
+                    f"output/trip_{iteration}")
+
+        # Append to the analytics archive with run metadata
+        archive_itinerary([loc.to_dict() for loc in locations], self.config,
+                          iteration=iteration, source=source)
     
-    def _save_coordinates_csv(self, locations: List[Location], iteration: int) -> None:
-        """Save location coordinates to CSV file."""
+    def _save_coordinates_csv(self, locations: List[Location], iteration: int) -> Optional[str]:
+        """Save location coordinates to a content-addressed CSV file. Returns its path."""
         if not locations:
-            return
+            return None
             
-        df = pd.DataFrame([
-            {'lat': loc.lat, 'lon': loc.lon} 
-            for loc in locations if loc.has_coordinates()
-        ])
-        
-        os.makedirs("output", exist_ok=True)
-        df.to_csv(f"output/coords_{iteration}.csv", index=False)
+        coords = [{'lat': loc.lat, 'lon': loc.lon} for loc in locations if loc.has_coordinates()]
+        path = get_or_create("coords", "csv", coords, lambda p: pd.DataFrame(coords).to_csv(p, index=False))
+        print(f"✅ Coordinates of trip {iteration + 1} saved to {path}")
+        return path
 
 
 def main():
@@ -326,12 +422,24 @@ def main():
     
     # Generate multiple trip variations
     num_iterations = int(os.getenv("NUM_ITERATIONS", "5"))
+    if os.getenv("PLANNING_MODE", "llm") == "poi_pool":
+        # One LLM call for a pool of places, all variations assembled locally
+        trips = planner.plan_trips_from_pool(num_iterations)
+        print(f"Planned {len(trips)} trips from the POI pool")
+        return
+    if VARIATION_EARLY_STOP:
+        # Stop early once new variations repeat the earlier ones
+        planner.plan_trips_until_converged(num_iterations)
+        return
     for i in range(num_iterations):
         try:
-            locations = planner.plan_trip(i)
+            # Profiled when PROFILE=true, or for a PROFILE_SAMPLE_RATE share of trips
+            with profile_request(f"restructured_{i}"):
+                locations = planner.plan_trip(i)
             print(f"Trip {i + 1} completed with {len(locations)} locations")
         except Exception as e:
             print(f"Error in trip {i + 1}: {e}")
+            archive_itinerary([], config, iteration=i, source="restructured", success=False, error=str(e))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,383 @@
+"""
+Road Routing
+Offline drive-time engine built from an OpenStreetMap PBF extract.
+
+The drivable road network is compressed to junction nodes, preprocessed with
+contraction hierarchies (CH) and cached next to the extract. Queries only
+search "upward" in the hierarchy, so a many-to-many table over a trip's stops
+needs one small search per stop instead of one full Dijkstra per pair.
+
+Set ROAD_NETWORK_PBF to a regional extract (e.g. romania-latest.osm.pbf from
+Geofabrik) to enable it; without it callers fall back to geodesic distance.
+Building needs the optional `osmium` package; preprocessing a country takes a
+while the first time, later runs load the cached hierarchy.
+"""
+
+import os
+import math
+import heapq
+import pickle
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+ROAD_NETWORK_PBF = os.getenv("ROAD_NETWORK_PBF", "")
+ROAD_NETWORK_CACHE = os.getenv("ROAD_NETWORK_CACHE", "")
+# Speed assumed for the straight-line leg between a stop and its nearest road node
+ACCESS_SPEED_KMH = 20
+
+# Default speeds (km/h) per OSM highway type, used when a way has no usable maxspeed
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 110, "trunk": 90, "primary": 70, "secondary": 60, "tertiary": 50,
+    "unclassified": 40, "residential": 30, "living_street": 10, "service": 20,
+    "motorway_link": 60, "trunk_link": 50, "primary_link": 45, "secondary_link": 40, "tertiary_link": 35,
+}
+
+GRID_CELL_DEG = 0.02
+WITNESS_SETTLE_LIMIT = 60
+
+Point = Tuple[float, float]
+
+
+def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def _way_speed_kmh(tags) -> Optional[float]:
+    """Speed for a drivable way, or None if the way is not for cars."""
+    highway = tags.get("highway")
+    if highway not in HIGHWAY_SPEEDS_KMH or tags.get("access") in ("no", "private"):
+        return None
+    maxspeed = (tags.get("maxspeed") or "").strip()
+    try:
+        if maxspeed.endswith("mph"):
+            return float(maxspeed[:-3]) * 1.609
+        return float(maxspeed)
+    except ValueError:
+        return HIGHWAY_SPEEDS_KMH[highway]
+
+
+def _oneway(tags) -> int:
+    """1 for forward-only, -1 for backward-only, 0 for two-way."""
+    oneway = tags.get("oneway")
+    if oneway in ("yes", "1", "true"):
+        return 1
+    if oneway == "-1":
+        return -1
+    if tags.get("highway") == "motorway" or tags.get("junction") == "roundabout":
+        return 1
+    return 0
+
+
+def _read_pbf(pbf_path: str):
+    """Read the drivable network from a PBF file, compressed to junction-to-junction edges."""
+    import osmium
+
+    class WayCounter(osmium.SimpleHandler):
+        """First pass: count how many drivable ways use each node, to find junctions."""
+        def __init__(self):
+            super().__init__()
+            self.uses = defaultdict(int)
+
+        def way(self, w):
+            if _way_speed_kmh(w.tags) is None:
+                return
+            refs = [n.ref for n in w.nodes]
+            for ref in refs:
+                self.uses[ref] += 1
+            if refs:
+                # Way ends are always graph nodes
+                self.uses[refs[0]] += 1
+                self.uses[refs[-1]] += 1
+
+    class WayBuilder(osmium.SimpleHandler):
+        """Second pass: walk each way and emit one edge per stretch between junctions."""
+        def __init__(self, uses):
+            super().__init__()
+            self.uses = uses
+            self.index: Dict[int, int] = {}
+            self.lat = array("d")
+            self.lon = array("d")
+            self.edges: List[Tuple[int, int, float, float]] = []
+
+        def _node(self, ref, location) -> int:
+            if ref not in self.index:
+                self.index[ref] = len(self.lat)
+                self.lat.append(location.lat)
+                self.lon.append(location.lon)
+            return self.index[ref]
+
+        def way(self, w):
+            speed = _way_speed_kmh(w.tags)
+            if speed is None:
+                return
+            direction = _oneway(w.tags)
+            start, length, prev = None, 0.0, None
+            for n in w.nodes:
+                if not n.location.valid():
+                    continue
+                if prev is not None:
+                    length += _haversine_m(prev.lat, prev.lon, n.location.lat, n.location.lon)
+                prev = n.location
+                if self.uses.get(n.ref, 0) > 1:
+                    node = self._node(n.ref, n.location)
+                    if start is not None and node != start:
+                        seconds = length / (speed / 3.6)
+                        if direction >= 0:
+                            self.edges.append((start, node, seconds, length))
+                        if direction <= 0:
+                            self.edges.append((node, start, seconds, length))
+                    start, length = node, 0.0
+
+    counter = WayCounter()
+    counter.apply_file(pbf_path)
+    builder = WayBuilder(counter.uses)
+    builder.apply_file(pbf_path, locations=True)
+    print(f"Road network: {len(builder.lat)} junctions, {len(builder.edges)} edges")
+    return builder.lat, builder.lon, builder.edges
+
+
+class RoadRouter:
+    """Contraction-hierarchy router answering drive time/distance queries between coordinates."""
+
+    def __init__(self, lat: Sequence[float], lon: Sequence[float],
+                 fwd_up: List[List[Tuple[int, float, float]]], bwd_up: List[List[Tuple[int, float, float]]]):
+        self.lat = lat
+        self.lon = lon
+        # fwd_up[v]: edges v -> w to higher-ranked w; bwd_up[v]: edges u -> v from higher-ranked u
+        self.fwd_up = fwd_up
+        self.bwd_up = bwd_up
+        self.grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        # Every node is indexed: the highest-ranked nodes have no upward edges but are still on the road
+        for node in range(len(lat)):
+            self.grid[self._cell(lat[node], lon[node])].append(node)
+
+    # --- Building ---
+
+    @classmethod
+    def from_edges(cls, lat: Sequence[float], lon: Sequence[float],
+                   edges: Sequence[Tuple[int, int, float, float]]) -> "RoadRouter":
+        """Contract a graph given as (from, to, seconds, meters) edges."""
+        n = len(lat)
+        out_edges: List[Dict[int, Tuple[float, float]]] = [dict() for _ in range(n)]
+        in_edges: List[Dict[int, Tuple[float, float]]] = [dict() for _ in range(n)]
+        for u, v, seconds, meters in edges:
+            if u != v and (v not in out_edges[u] or seconds < out_edges[u][v][0]):
+                out_edges[u][v] = (seconds, meters)
+                in_edges[v][u] = (seconds, meters)
+
+        contracted = [False] * n
+        deleted_neighbors = [0] * n
+        fwd_up: List[List[Tuple[int, float, float]]] = [[] for _ in range(n)]
+        bwd_up: List[List[Tuple[int, float, float]]] = [[] for _ in range(n)]
+
+        def witness_costs(source: int, skip: int, limit: float) -> Dict[int, float]:
+            """Bounded Dijkstra from source avoiding skip, used to prove a shortcut is unnecessary."""
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < WITNESS_SETTLE_LIMIT:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                if d > limit:
+                    break
+                settled += 1
+                for w, (seconds, _) in out_edges[u].items():
+                    nd = d + seconds
+                    if w != skip and nd < dist.get(w, math.inf):
+                        dist[w] = nd
+                        heapq.heappush(heap, (nd, w))
+            return dist
+
+        def shortcuts_for(v: int) -> List[Tuple[int, int, float, float]]:
+            # Contracted nodes are removed from the adjacency, so every neighbour here is still in the graph
+            shortcuts = []
+            outs = out_edges[v]
+            if not outs:
+                return shortcuts
+            max_out = max(c[0] for c in outs.values())
+            for u, (in_sec, in_m) in in_edges[v].items():
+                dist = witness_costs(u, v, in_sec + max_out)
+                for w, (out_sec, out_m) in outs.items():
+                    if w != u and dist.get(w, math.inf) > in_sec + out_sec:
+                        shortcuts.append((u, w, in_sec + out_sec, in_m + out_m))
+            return shortcuts
+
+        def priority(v: int, shortcuts) -> int:
+            return len(shortcuts) - len(in_edges[v]) - len(out_edges[v]) + deleted_neighbors[v]
+
+        heap = [(priority(v, shortcuts_for(v)), v) for v in range(n)]
+        heapq.heapify(heap)
+        done = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            # Lazy update: re-queue if the node got more expensive since it was queued
+            shortcuts = shortcuts_for(v)
+            p = priority(v, shortcuts)
+            if heap and p > heap[0][0]:
+                heapq.heappush(heap, (p, v))
+                continue
+
+            for u, w, seconds, meters in shortcuts:
+                if w not in out_edges[u] or seconds < out_edges[u][w][0]:
+                    out_edges[u][w] = (seconds, meters)
+                    in_edges[w][u] = (seconds, meters)
+            # Every remaining neighbour is contracted later, i.e. ranked higher than v
+            for w, (seconds, meters) in out_edges[v].items():
+                fwd_up[v].append((w, seconds, meters))
+                deleted_neighbors[w] += 1
+                del in_edges[w][v]
+            for u, (seconds, meters) in in_edges[v].items():
+                bwd_up[v].append((u, seconds, meters))
+                deleted_neighbors[u] += 1
+                del out_edges[u][v]
+            out_edges[v] = {}
+            in_edges[v] = {}
+            contracted[v] = True
+            done += 1
+            if done % 50000 == 0:
+                print(f"Contracted {done}/{n} nodes")
+
+        return cls(lat, lon, fwd_up, bwd_up)
+
+    @classmethod
+    def from_pbf(cls, pbf_path: str, cache_path: str = "") -> "RoadRouter":
+        """Load the cached hierarchy for a PBF extract, building and caching it if needed."""
+        cache_path = cache_path or f"{pbf_path}.ch.pickle"
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(pbf_path):
+            with open(cache_path, "rb") as f:
+                data = pickle.load(f)
+            return cls(data["lat"], data["lon"], data["fwd_up"], data["bwd_up"])
+
+        print(f"Building road network hierarchy from {pbf_path}, this runs once per extract...")
+        lat, lon, edges = _read_pbf(pbf_path)
+        router = cls.from_edges(lat, lon, edges)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"lat": router.lat, "lon": router.lon,
+                         "fwd_up": router.fwd_up, "bwd_up": router.bwd_up}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        print(f"✅ Road network hierarchy cached to {cache_path}")
+        return router
+
+    # --- Queries ---
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / GRID_CELL_DEG)), int(math.floor(lon / GRID_CELL_DEG))
+
+    def snap(self, point: Point, max_rings: int = 25) -> Optional[Tuple[int, float]]:
+        """Return (nearest road node, distance in meters), searching grid rings outward."""
+        lat, lon = point
+        ci, cj = self._cell(lat, lon)
+        best = None
+        for ring in range(max_rings + 1):
+            for i in range(ci - ring, ci + ring + 1):
+                for j in range(cj - ring, cj + ring + 1):
+                    if max(abs(i - ci), abs(j - cj)) != ring:
+                        continue
+                    for node in self.grid.get((i, j), ()):
+                        d = _haversine_m(lat, lon, self.lat[node], self.lon[node])
+                        if best is None or d < best[1]:
+                            best = (node, d)
+            # Any node in a further ring is at least `ring` cells away
+            if best is not None and best[1] <= ring * GRID_CELL_DEG * 111000 * math.cos(math.radians(lat)):
+                break
+        return best
+
+    @staticmethod
+    def _upward_search(start: int, adjacency) -> Dict[int, Tuple[float, float]]:
+        """Full Dijkstra restricted to upward edges. Returns node -> (seconds, meters)."""
+        dist = {start: (0.0, 0.0)}
+        heap = [(0.0, 0.0, start)]
+        while heap:
+            seconds, meters, u = heapq.heappop(heap)
+            if seconds > dist[u][0]:
+                continue
+            for w, edge_sec, edge_m in adjacency[u]:
+                nd = seconds + edge_sec
+                if w not in dist or nd < dist[w][0]:
+                    dist[w] = (nd, meters + edge_m)
+                    heapq.heappush(heap, (nd, meters + edge_m, w))
+        return dist
+
+    def table(self, sources: Sequence[Point], targets: Sequence[Point]) -> Tuple[List[List[float]], List[List[float]]]:
+        """
+        Many-to-many drive times (hours) and road distances (km) using CH bucket search.
+        Pairs that cannot be snapped or connected are math.inf.
+        """
+        snapped_sources = [self.snap(p) for p in sources]
+        snapped_targets = [self.snap(p) for p in targets]
+
+        # Backward search from every target, leaving (target, seconds, meters) in each reached node's bucket
+        buckets: Dict[int, List[Tuple[int, float, float]]] = defaultdict(list)
+        for j, snapped in enumerate(snapped_targets):
+            if snapped is None:
+                continue
+            for node, (seconds, meters) in self._upward_search(snapped[0], self.bwd_up).items():
+                buckets[node].append((j, seconds, meters))
+
+        hours = [[math.inf] * len(targets) for _ in sources]
+        km = [[math.inf] * len(targets) for _ in sources]
+        for i, snapped in enumerate(snapped_sources):
+            if snapped is None:
+                continue
+            best = {}
+            for node, (seconds, meters) in self._upward_search(snapped[0], self.fwd_up).items():
+                for j, t_sec, t_m in buckets.get(node, ()):
+                    if j not in best or seconds + t_sec < best[j][0]:
+                        best[j] = (seconds + t_sec, meters + t_m)
+            for j, (seconds, meters) in best.items():
+                access_m = snapped[1] + snapped_targets[j][1]
+                hours[i][j] = seconds / 3600 + access_m / 1000 / ACCESS_SPEED_KMH
+                km[i][j] = (meters + access_m) / 1000
+        return hours, km
+
+    def legs(self, points: Sequence[Point]) -> List[Optional[Tuple[float, float]]]:
+        """
+        Drive (hours, km) of each consecutive pair of points, None for legs that cannot be snapped or
+        connected. Every point is snapped once and each leg is one forward and one backward search.
+        """
+        snapped = [self.snap(p) for p in points]
+        legs = []
+        for source, target in zip(snapped, snapped[1:]):
+            if source is None or target is None:
+                legs.append(None)
+                continue
+            fwd = self._upward_search(source[0], self.fwd_up)
+            bwd = self._upward_search(target[0], self.bwd_up)
+            best = min(((fwd[n][0] + bwd[n][0], fwd[n][1] + bwd[n][1]) for n in fwd.keys() & bwd.keys()),
+                       default=None)
+            if best is None:
+                legs.append(None)
+                continue
+            access_m = source[1] + target[1]
+            legs.append((best[0] / 3600 + access_m / 1000 / ACCESS_SPEED_KMH, (best[1] + access_m) / 1000))
+        return legs
+
+    def route(self, point1: Point, point2: Point) -> Optional[Tuple[float, float]]:
+        """Drive (hours, km) between two points, or None if they are not connected."""
+        hours, km = self.table([point1], [point2])
+        if math.isinf(hours[0][0]):
+            return None
+        return hours[0][0], km[0][0]
+
+
+_router = None
+
+
+def get_router() -> Optional[RoadRouter]:
+    """Return the process-wide router for ROAD_NETWORK_PBF, or None if no extract is configured."""
+    global _router
+    if _router is None and ROAD_NETWORK_PBF:
+        if not os.path.exists(ROAD_NETWORK_PBF):
+            print(f"Road network extract {ROAD_NETWORK_PBF} not found, using straight-line distances")
+            return None
+        _router = RoadRouter.from_pbf(ROAD_NETWORK_PBF, ROAD_NETWORK_CACHE)
+    return _router
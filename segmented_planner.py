@@ -0,0 +1,248 @@
+"""
+Segmented Planner
+Map-reduce generation for long trips: the LLM first returns a short skeleton
+of overnight bases, then the daily stops of each segment of a few days are
+generated by parallel LLM calls, and the segments are stitched back together
+with continuity checks on Stay_lat / Stay_lon. Wall time then depends on the
+segment length rather than on the trip length.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from geopy.distance import geodesic
+
+from extract_coordinates import extract_coords_from_llm_result, safe_extract_locations
+from llm_ledger import LedgerCallbackHandler, request_tags, suggest_max_tokens
+from prompt_trip import _invoke_within_deadline, get_llm_model, LLM_TIMEOUT_CAP
+from rate_limit import call_with_retry
+
+
+SEGMENTED_PLANNING = os.getenv("SEGMENTED_PLANNING", "False").lower() == "true"
+# Trips longer than this are planned in segments when segmented planning is on
+SEGMENT_THRESHOLD_DAYS = int(os.getenv("SEGMENT_THRESHOLD_DAYS", "7"))
+SEGMENT_DAYS = int(os.getenv("SEGMENT_DAYS", "5"))
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "6"))
+# A stop's overnight stay further than this from the skeleton base is reset to the base
+STAY_TOLERANCE_KM = 25
+
+
+def use_segmented_planning(Config, force: bool = False) -> bool:
+    """Whether the trip is long enough, and segmented planning enabled, to plan it in segments."""
+    return (force or SEGMENTED_PLANNING) and int(Config.duration) > SEGMENT_THRESHOLD_DAYS
+
+
+def _get_skeleton_prompt(Config) -> str:
+    """Prompt for the overnight bases only, a short answer even for a 30-day trip."""
+    return f"""
+You are a travel planner and geolocation assistant.
+
+Your task: Choose the overnight bases for a {Config.duration}-day family road trip in {Config.country}.
+
+Start point: {Config.city_start}
+End point: {Config.city_end}
+Month: {Config.month}
+Who: {Config.composition}
+Preferences: {','.join(getattr(Config, 'preferences', []) or [])}
+
+Return the bases in travel order as a Python list of dictionaries.
+Each dictionary must include:
+- 'name': Town or city of the base
+- 'lat': Latitude in decimal degrees
+- 'lon': Longitude in decimal degrees
+- 'nights': Number of nights spent there
+
+VERY IMPORTANT:
+- The nights must add up to exactly {Config.duration}; the last base is the night of day {Config.duration}.
+- Prefer few base changes: stay several nights where there is a lot to see nearby.
+- No more than {Config.max_km_dist_per_day * 1.5} kilometers between consecutive bases.
+- All coordinates must be real and accurate to within 1 km.
+
+
+Only return the list — no extra text or explanation.
+"""
+
+
+def _get_segment_prompt(Config, segment: Dict, exclude: Optional[List[str]] = None) -> str:
+    """Prompt for the daily stops of one segment, with its overnight bases fixed, avoiding the places in exclude."""
+    exclusion_rule = ""
+    if exclude:
+        exclusion_rule = f"- Other itineraries already cover these places, do NOT include them: {'; '.join(exclude)}\n"
+    nights = "\n".join(f"- Night of day {day}: {base['name']} (Stay_lat {base['lat']}, Stay_lon {base['lon']})"
+                       for day, base in segment["nights"])
+    before = segment["previous"]
+    after = segment["next"]
+    return f"""
+You are a travel planner and geolocation assistant.
+
+Your task: Plan days {segment['first_day']} to {segment['last_day']} of a {Config.duration}-day family road trip in {Config.country}.
+
+Month: {Config.month}
+Who: {Config.composition}
+How: Travel by car, staying in apartments.
+Day {segment['first_day']} starts from {before['name']}.{f" After day {segment['last_day']} the trip continues to {after['name']}." if after else ""}
+
+Overnight stays (fixed):
+{nights}
+
+Preferences:
+- Enjoy : {','.join(getattr(Config, 'preferences', []) or [])}
+- Prefer well-known, or natural sites
+
+Return the days as a Python list of dictionaries.
+Each dictionary must include:
+- 'day': Day number ({segment['first_day']} to {segment['last_day']}) - same day can have multiple locations
+- 'name': Exact name of the location or attraction
+- 'lat': Latitude in decimal degrees
+- 'lon': Longitude in decimal degrees
+- 'Stay_lat' : Latitude of that day's overnight stay, as listed above
+- 'Stay_lon' : Longitude of that day's overnight stay, as listed above
+- 'description': Short, optional description
+
+VERY IMPORTANT:
+- All coordinates ('lat', 'lon') must be real and accurate to within 1 km of the actual location.
+- Do NOT invent places. Avoid ambiguous or generic names.Select locations that Nominatim can recognize.
+- No more than {Config.max_km_dist_per_day * 1.5} kilometers per day
+{exclusion_rule}
+
+Only return the list — no extra text or explanation.
+"""
+
+
+def _invoke(Config, prompt: str, call: str, days: int, deadline=None, budget_call: str = "main_plan_prompt",
+            budget_format: Optional[str] = "dict", **tags) -> str:
+    """
+    One rate-limited, ledger-tracked LLM call, max_tokens sized for `days` days of output
+    from the ledger history of `budget_call` in `budget_format` (segments answer in dict format).
+    """
+    if deadline is not None:
+        deadline.check(call)
+    ledger = LedgerCallbackHandler(call, dict(request_tags(Config), duration=days, **tags))
+    return call_with_retry("groq", _invoke_within_deadline, Config, prompt, deadline,
+                           suggest_max_tokens(budget_call, days, output_format=budget_format), config={"callbacks": [ledger]},
+                           deadline=deadline).content
+
+
+def nights_from_skeleton(bases: List[Dict], duration: int) -> List[Dict]:
+    """
+    Base of every night, index 0 being the night of day 1. Night counts that do not add up
+    to the duration are fixed by trimming the last bases or extending the last one.
+    """
+    nights = []
+    for base in bases:
+        if base.get("lat") is None or base.get("lon") is None:
+            continue
+        try:
+            count = max(1, int(base.get("nights") or 1))
+        except (TypeError, ValueError):
+            count = 1
+        nights.extend([base] * count)
+    if not nights:
+        raise ValueError("Skeleton has no usable overnight bases")
+    if len(nights) != duration:
+        print(f"Skeleton covers {len(nights)} nights for a {duration}-day trip, adjusting the last bases")
+    return (nights + [nights[-1]] * duration)[:duration]
+
+
+def split_segments(nights: List[Dict], start: Dict, segment_days: int = SEGMENT_DAYS) -> List[Dict]:
+    """
+    Cut the nights into segments of about segment_days days, preferring to cut where the base
+    changes so one stay is not split across two LLM calls.
+    """
+    segments = []
+    first = 0
+    while first < len(nights):
+        last = min(first + segment_days, len(nights)) - 1
+        # Move the cut back to a base change within the last two days of the segment, if there is one
+        for cut in range(last, max(first, last - 2), -1):
+            if cut + 1 < len(nights) and nights[cut] is not nights[cut + 1]:
+                last = cut
+                break
+        segments.append({
+            "first_day": first + 1,
+            "last_day": last + 1,
+            "nights": [(day + 1, nights[day]) for day in range(first, last + 1)],
+            "previous": nights[first - 1] if first else start,
+            "next": nights[last + 1] if last + 1 < len(nights) else None,
+        })
+        first = last + 1
+    return segments
+
+
+def stitch_segments(segments: List[Dict], results: List[List[Dict]], max_km: float) -> List[Dict]:
+    """
+    Concatenate segment results in day order with continuity checks: stops outside their
+    segment's days are dropped, overnight stays off the skeleton base are reset to it, days
+    the model left empty get a free day at the base, and long jumps between consecutive
+    segments are reported.
+    """
+    stitched = []
+    for segment, locations in zip(segments, results):
+        bases = dict(segment["nights"])
+        by_day = {day: [] for day in bases}
+        for loc in locations:
+            try:
+                day = int(loc.get("day"))
+            except (TypeError, ValueError):
+                continue
+            if day not in bases:
+                print(f"Dropping {loc.get('name')}: day {day} is outside days "
+                      f"{segment['first_day']}-{segment['last_day']}")
+                continue
+            base = bases[day]
+            stay = (loc.get("Stay_lat"), loc.get("Stay_lon"))
+            if None in stay or geodesic(stay, (base["lat"], base["lon"])).kilometers > STAY_TOLERANCE_KM:
+                loc["Stay_lat"], loc["Stay_lon"] = base["lat"], base["lon"]
+            loc["day"] = day
+            by_day[day].append(loc)
+
+        for day, stops in by_day.items():
+            if not stops:
+                base = bases[day]
+                stops.append({"day": day, "name": base["name"], "lat": base["lat"], "lon": base["lon"],
+                              "Stay_lat": base["lat"], "Stay_lon": base["lon"],
+                              "description": "Free day around the overnight stay"})
+            stitched.extend(stops)
+
+        # Continuity: day one of the next segment must be reachable from this segment's last night
+        if segment["next"] is not None and stitched:
+            last_stay = (stitched[-1]["Stay_lat"], stitched[-1]["Stay_lon"])
+            next_base = (segment["next"]["lat"], segment["next"]["lon"])
+            jump = geodesic(last_stay, next_base).kilometers
+            if jump > max_km * 1.5:
+                print(f"⚠️ {jump:.0f} km from the night of day {segment['last_day']} to {segment['next']['name']}")
+    return stitched
+
+
+def plan_segmented(Config, deadline=None, on_segment: Optional[Callable[[List[Dict]], None]] = None,
+                   exclude: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Plan the trip as a skeleton call plus parallel segment calls, returning the stitched locations.
+    on_segment, if given, is called with the stops of each segment as soon as it is ready.
+    exclude: Optional place names the segments must avoid (covered by earlier variations).
+    """
+    # The skeleton's length follows the trip length (one base per few nights), so it is sized
+    # from its own history per trip day rather than from the full plans'
+    skeleton = safe_extract_locations(_invoke(Config, _get_skeleton_prompt(Config), "segment_skeleton",
+                                              days=int(Config.duration), deadline=deadline,
+                                              budget_call="segment_skeleton", budget_format=None))
+    nights = nights_from_skeleton(skeleton, int(Config.duration))
+    start = {"name": Config.city_start}
+    segments = split_segments(nights, start)
+    print(f"Planning {Config.duration} days in {len(segments)} parallel segments")
+
+    repair_llm = get_llm_model(Config, timeout=LLM_TIMEOUT_CAP if deadline is None else deadline.timeout(LLM_TIMEOUT_CAP))
+
+    def plan_segment(segment):
+        days = segment["last_day"] - segment["first_day"] + 1
+        result = _invoke(Config, _get_segment_prompt(Config, segment, exclude), "main_plan_segment", days=days,
+                         deadline=deadline, first_day=segment["first_day"])
+        locations = extract_coords_from_llm_result(result, llm=repair_llm, deadline=deadline) or []
+        if on_segment is not None:
+            on_segment(locations)
+        return locations
+
+    with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix="segment") as pool:
+        results = list(pool.map(plan_segment, segments))
+    return stitch_segments(segments, results, Config.max_km_dist_per_day)
@@ -0,0 +1,142 @@
+"""
+Stage DAG
+Runs a pipeline as a DAG of stages, each memoized on exactly the inputs it
+depends on: the request fields it reads (its params) and the outputs of its
+upstream stages. When a request changes only a downstream parameter (e.g. the
+clustering distance), the upstream stages are served from the memo and only
+the changed stage and the ones after it run again.
+
+Memo entries live in a per-process LRU of DAG_CACHE_SIZE entries, shared by
+all requests of the process (e.g. every Streamlit session).
+"""
+
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+DAG_CACHE_SIZE = int(os.getenv("DAG_CACHE_SIZE", "256"))
+
+
+def fingerprint(value) -> str:
+    """Stable hash of a JSON-serializable value."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+
+class Stage:
+    """
+    One pipeline step. func(Config, *upstream outputs) computes the stage's output;
+    params(Config) returns the request fields it reads, everything else of the request
+    is ignored when deciding whether the memoized output still applies.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], deps: Iterable[str] = (),
+                 params: Optional[Callable[[Any], Dict]] = None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or (lambda Config: {})
+
+
+class StageCache:
+    """Thread-safe LRU of stage outputs. Values are copied in and out, so callers may mutate them."""
+
+    def __init__(self, max_entries: int = DAG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            value = self._entries[key]
+        return True, copy.deepcopy(value)
+
+    def put(self, key: str, value) -> None:
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = StageCache()
+
+
+class StageDAG:
+    """Stages in topological order (every stage after its deps) over a shared memo."""
+
+    def __init__(self, stages: List[Stage], cache: Optional[StageCache] = None):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            missing = [d for d in stage.deps if d not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on {missing}, which must come before it")
+            self.stages[stage.name] = stage
+        self.cache = _cache if cache is None else cache
+        # Stage outputs other stages read; only these need a digest
+        self._read = {d for stage in stages for d in stage.deps}
+
+    def _key(self, stage: Stage, Config, digests: Dict[str, str]) -> str:
+        return fingerprint({"stage": stage.name, "params": stage.params(Config),
+                            "inputs": [digests[d] for d in stage.deps]})
+
+    def _upto(self, target: Optional[str]) -> List[Stage]:
+        """The target and its ancestors in run order, or every stage."""
+        if target is None:
+            return list(self.stages.values())
+        needed, todo = set(), [target]
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].deps)
+        return [stage for name, stage in self.stages.items() if name in needed]
+
+    def cached(self, Config, target: str) -> bool:
+        """Whether the target stage's output for this request is memoized, without running anything."""
+        digests = {}
+        for stage in self._upto(target):
+            hit, value = self.cache.get(self._key(stage, Config, digests))
+            if not hit:
+                return False
+            digests[stage.name] = fingerprint(value)
+        return True
+
+    def run(self, Config, target: Optional[str] = None, force: Iterable[str] = (), deadline=None,
+            on_stage: Optional[Callable[[str], None]] = None) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Run the stages up to target (all by default), serving memoized outputs where the inputs match.
+        Stages in force run regardless (e.g. a fresh LLM sample), and whatever reads their output runs
+        again if it changed. on_stage(name) is called before a stage is computed. Outputs produced while
+        the deadline degraded the result are not memoized.
+        Returns ({stage: output}, names of the stages that were computed).
+        """
+        force = set(force)
+        values, digests, computed = {}, {}, []
+        for stage in self._upto(target):
+            key = self._key(stage, Config, digests)
+            hit, value = (False, None) if stage.name in force else self.cache.get(key)
+            if not hit:
+                if on_stage is not None:
+                    on_stage(stage.name)
+                degraded = len(deadline.degraded_reasons) if deadline is not None else 0
+                value = stage.func(Config, *[values[d] for d in stage.deps])
+                if deadline is None or len(deadline.degraded_reasons) == degraded:
+                    self.cache.put(key, value)
+                computed.append(stage.name)
+            values[stage.name] = value
+            if stage.name in self._read:
+                digests[stage.name] = fingerprint(value)
+        return values, computed
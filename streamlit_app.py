@@ -1,6 +1,10 @@
+import time
 import streamlit as st
-from main import main_plan_prompt, extract_coords_from_llm_result, ignore_null_coords_locations, generate_map
-from prompt_trip import main_plan_prompt , _get_trip_prompt_template
+from job_queue import JobQueue, payload_from_config
+from multi_day_map import build_map
+from trip_job import TripJob
+
+POLL_INTERVAL_SECONDS = 1.0
 
 # Simple config class to mimic the original get_config() structure
 class ConfigObj:
@@ -40,27 +44,91 @@ with st.form("trip_form"):
     month = st.selectbox("Month of Travel", ["January" , "February" , "march" , "April" , "May", 
                                              "June", "July", "August", "September",
                                              "October", "November", "December"])
+    fresh = st.checkbox("Generate a fresh plan (don't reuse stored plans)", False)
+    reuse_similar = st.checkbox("Accept a stored plan for a similar request (faster)", False)
+    queued = st.checkbox("Run on the worker queue (start workers with job_worker.py)", False)
     
     submitted = st.form_submit_button("Generate Itinerary")
 
 if submitted:
-    st.info("Generating trip... This may take a few seconds.")
-    
     # Create config
     Config = ConfigObj(country, city_start, city_end, composition, max_km, duration, month, preferences)
-    
-    # Prompt + process
-    prompt = _get_trip_prompt_template(Config)
-    result = main_plan_prompt(prompt, Config)
-    locations = extract_coords_from_llm_result(result)
-    locations_orig = locations.copy()
-    locations = ignore_null_coords_locations(locations, locations_orig, 0,
-                                             threshold_km=Config.max_km_dist_per_day,
-                                             ignore_geolocator=False)
 
-    # Save and display the map
-    
-    generate_map(locations, 0)
+    if queued:
+        # Hand the request to the job workers, this script only polls the queue for its status
+        st.session_state.pop("trip_job", None)
+        st.session_state["queue_job_id"] = JobQueue().enqueue(
+            payload_from_config(Config, fresh=fresh, reuse_similar=reuse_similar))
+    else:
+        # Run the pipeline in a background thread, this script only polls its progress.
+        # Open the app with ?profile=1 to profile this request (PROFILE / PROFILE_SAMPLE_RATE apply too)
+        st.session_state.pop("queue_job_id", None)
+        st.session_state["trip_job"] = TripJob(Config, fresh=fresh, reuse_similar=reuse_similar,
+                                               profile=st.query_params.get("profile") == "1").start()
+
+with st.sidebar:
+    st.subheader("Worker queue")
+    counts = JobQueue().counts()
+    st.write(" · ".join(f"{status}: {count}" for status, count in counts.items()))
+    lookup_id = st.text_input("Job id")
+    if lookup_id:
+        found = JobQueue().get(lookup_id.strip())
+        if found is None:
+            st.write("Unknown job id")
+        else:
+            st.session_state.pop("trip_job", None)
+            st.session_state["queue_job_id"] = found["id"]
+
+queue_job_id = st.session_state.get("queue_job_id")
+if queue_job_id is not None:
+    queue_job = JobQueue().get(queue_job_id)
+    st.caption(f"Job {queue_job_id}: {queue_job['status']} (attempt {queue_job['attempts']}/{queue_job['max_attempts']})")
+    if queue_job["status"] == "dead":
+        st.error(f"Trip generation failed after {queue_job['attempts']} attempts: {queue_job['error']}")
+    elif queue_job["status"] == "done":
+        result = queue_job["result"]
+        if result["degraded_reasons"]:
+            st.warning("Partial itinerary - some steps were skipped to answer in time: "
+                       + "; ".join(result["degraded_reasons"]))
+        st.success("Trip generated - In blue circles locations to vist, in red circles locations to stay overnight.")
+        # Rebuilt from the stops, the worker's map file may be on another host
+        st.components.v1.html(build_map(result["locations"]).get_root().render(), height=500, width=800)
+        st.dataframe([{key: loc.get(key) for key in ("day", "name", "lat", "lon", "description")}
+                      for loc in result["locations"]])
+    else:
+        if queue_job["error"]:
+            st.warning(f"Previous attempt failed, retrying: {queue_job['error']}")
+        st.info("Waiting for a worker..." if queue_job["status"] == "queued" else "A worker is planning the trip...")
+        time.sleep(POLL_INTERVAL_SECONDS)
+        st.rerun()
+
+job = st.session_state.get("trip_job")
+if job is not None:
+    state = job.snapshot()
+
+    if state["error"]:
+        st.error(f"Trip generation failed: {state['error']}")
+    elif not state["finished"]:
+        st.info(f"{state['stage_label']}... stops appear below as they are planned.")
+    elif state["from_store"] and state["similarity"] is not None and state["similarity"] < 1:
+        st.info(f"Serving a stored plan for a similar request ({state['similarity']:.0%} match) - "
+                "tick 'Generate a fresh plan' for one made for your exact choices.")
+    elif state["from_store"]:
+        st.info("Serving a stored plan for this request - tick 'Generate a fresh plan' for a new one.")
+
+    if state["degraded_reasons"]:
+        st.warning("Partial itinerary - some steps were skipped to answer in time: " + "; ".join(state["degraded_reasons"]))
+    if state["stage"] == "done":
+        st.success("Trip generated - In blue circles locations to vist, in red circles locations to stay overnight.")
+        if state["reused_stages"]:
+            st.caption("Reused from an earlier run: " + ", ".join(state["reused_stages"]))
+
+    if state["map_html"]:
+        st.components.v1.html(state["map_html"], height=500 , width=800)
+    if state["stops"]:
+        st.dataframe([{key: loc.get(key) for key in ("day", "name", "lat", "lon", "description")}
+                      for loc in state["stops"]])
 
-    st.success("Trip generated - In blue circles locations to vist, in red circles locations to stay overnight.")
-    st.components.v1.html(open(f"./output/trip_map_0.html", "r", encoding="utf-8").read(), height=500 , width=800)
+    if not state["finished"]:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        st.rerun()
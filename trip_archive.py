@@ -0,0 +1,231 @@
+"""
+Trip Archive
+Append-only Parquet store of every generated itinerary, partitioned by country
+and month, with a small query API for analytics over the plan history.
+Each run lands in a small file of its own; once a partition holds
+ARCHIVE_COMPACT_FILES of them they are merged into one, so queries do not
+have to open thousands of tiny files.
+
+Compact every partition now with:
+    python trip_archive.py --compact
+"""
+
+import os
+import glob
+import time
+import uuid
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "output/archive")
+# Per-run files a partition may collect before they are compacted into one
+ARCHIVE_COMPACT_FILES = int(os.getenv("ARCHIVE_COMPACT_FILES", "64"))
+# A compaction lock older than this was left by a crashed process
+COMPACT_LOCK_SECONDS = 600
+
+# One row per stop; failed runs are stored as a single row without stop fields
+ARCHIVE_SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("created_at", pa.timestamp("s", tz="UTC")),
+    ("source", pa.string()),
+    ("iteration", pa.int32()),
+    ("model", pa.string()),
+    ("success", pa.bool_()),
+    ("error", pa.string()),
+    ("city_start", pa.string()),
+    ("city_end", pa.string()),
+    ("duration", pa.int32()),
+    ("composition", pa.string()),
+    ("preferences", pa.string()),
+    ("max_km_dist_per_day", pa.int32()),
+    ("day", pa.int32()),
+    ("name", pa.string()),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("stay_lat", pa.float64()),
+    ("stay_lon", pa.float64()),
+    ("description", pa.string()),
+])
+
+
+def _partition_value(value) -> str:
+    """Normalize a partition value so 'march' and 'March' land in the same directory."""
+    value = str(value or "").strip().replace("/", "-")
+    return value.title() if value else "Unknown"
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def archive_itinerary(locations: List[Dict], config, iteration: int = 0, source: str = "main",
+                      success: bool = True, error: Optional[str] = None,
+                      archive_dir: str = ARCHIVE_DIR) -> str:
+    """
+    Append one itinerary run to the archive as a new Parquet file.
+    Args:
+        locations: List of location dicts ('day', 'name', 'lat', 'lon', 'Stay_lat', 'Stay_lon', 'description').
+        config: Config object used for the run (attributes are read with getattr, missing ones stay null).
+        iteration: Variation index of the run.
+        source: Which entry point produced the run.
+        success / error: Run outcome, failed runs are archived too for failure-rate queries.
+    Returns:
+        Path of the written Parquet file.
+    """
+    run_id = uuid.uuid4().hex
+    preferences = getattr(config, "preferences", None) or getattr(config, "interests", None) or []
+    run_meta = {
+        "run_id": run_id,
+        "created_at": datetime.now(timezone.utc).replace(microsecond=0),
+        "source": source,
+        "iteration": iteration,
+        "model": getattr(config, "model_name", None) or getattr(config, "MODEL_NAME", None),
+        "success": success,
+        "error": error,
+        "city_start": getattr(config, "city_start", None),
+        "city_end": getattr(config, "city_end", None),
+        "duration": _to_int(getattr(config, "duration", None)),
+        "composition": getattr(config, "composition", None),
+        "preferences": ",".join(sorted(preferences)),
+        "max_km_dist_per_day": _to_int(getattr(config, "max_km_dist_per_day", None)),
+    }
+
+    rows = []
+    for loc in locations or [{}]:
+        row = dict(run_meta)
+        row.update({
+            "day": _to_int(loc.get("day")),
+            "name": loc.get("name"),
+            "lat": _to_float(loc.get("lat")),
+            "lon": _to_float(loc.get("lon")),
+            "stay_lat": _to_float(loc.get("Stay_lat")),
+            "stay_lon": _to_float(loc.get("Stay_lon")),
+            "description": loc.get("description"),
+        })
+        rows.append(row)
+
+    partition_dir = os.path.join(archive_dir,
+                                 f"country={_partition_value(getattr(config, 'country', None))}",
+                                 f"month={_partition_value(getattr(config, 'month', None))}")
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"part-{run_id}.parquet")
+
+    # Write to a hidden temp file first so concurrent readers never see a partial file
+    tmp_path = os.path.join(partition_dir, f".part-{run_id}.tmp")
+    pq.write_table(pa.Table.from_pylist(rows, schema=ARCHIVE_SCHEMA), tmp_path)
+    os.replace(tmp_path, path)
+
+    if len(glob.glob(os.path.join(partition_dir, "part-*.parquet"))) >= ARCHIVE_COMPACT_FILES:
+        compact_partition(partition_dir)
+    return path
+
+
+def compact_partition(partition_dir: str) -> int:
+    """
+    Merge the Parquet files of one partition into a single file. Files written meanwhile are
+    left for the next compaction; a lock file keeps two processes from merging the same files.
+    Readers may see a run twice for the moment between the merged file appearing and the
+    merged files being removed. Returns the number of files merged.
+    """
+    lock_path = os.path.join(partition_dir, ".compact.lock")
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lock_path) > COMPACT_LOCK_SECONDS:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        return 0
+    os.close(fd)
+    try:
+        paths = sorted(glob.glob(os.path.join(partition_dir, "*.parquet")))
+        if len(paths) < 2:
+            return 0
+        table = pa.concat_tables([pq.ParquetFile(p).read() for p in paths])
+        compact_id = uuid.uuid4().hex
+        tmp_path = os.path.join(partition_dir, f".compacted-{compact_id}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(partition_dir, f"compacted-{compact_id}.parquet"))
+        for p in paths:
+            os.remove(p)
+        return len(paths)
+    finally:
+        os.remove(lock_path)
+
+
+def compact_archive(archive_dir: str = ARCHIVE_DIR) -> int:
+    """Compact every partition of the archive. Returns the number of files merged."""
+    return sum(compact_partition(os.path.dirname(p))
+               for p in glob.glob(os.path.join(archive_dir, "country=*", "month=*", "")))
+
+
+def _dataset(archive_dir: str):
+    return ds.dataset(archive_dir, format="parquet", partitioning="hive",
+                      exclude_invalid_files=True, ignore_prefixes=[".", "_"])
+
+
+def load_archive(country: Optional[str] = None, month: Optional[str] = None,
+                 columns: Optional[List[str]] = None, archive_dir: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """
+    Load archived itineraries as a DataFrame.
+    Country/month filters prune whole partitions, so only matching files are read.
+    """
+    if not os.path.isdir(archive_dir):
+        return pd.DataFrame(columns=columns or ARCHIVE_SCHEMA.names + ["country", "month"])
+
+    flt = None
+    if country is not None:
+        flt = ds.field("country") == _partition_value(country)
+    if month is not None:
+        month_flt = ds.field("month") == _partition_value(month)
+        flt = month_flt if flt is None else flt & month_flt
+    return _dataset(archive_dir).to_table(columns=columns, filter=flt).to_pandas()
+
+
+def popular_pois(country: Optional[str] = None, month: Optional[str] = None, top_n: int = 20,
+                 archive_dir: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """Return the most frequently planned locations, counted once per run."""
+    df = load_archive(country, month, columns=["run_id", "success", "name", "lat", "lon"],
+                      archive_dir=archive_dir)
+    df = df[df["success"] & df["name"].notna()]
+    return (df.groupby("name")
+              .agg(runs=("run_id", "nunique"), lat=("lat", "median"), lon=("lon", "median"))
+              .sort_values("runs", ascending=False)
+              .head(top_n)
+              .reset_index())
+
+
+def failure_rate(by: str = "country", archive_dir: str = ARCHIVE_DIR) -> pd.DataFrame:
+    """Return number of runs, failed runs and failure rate grouped by a column (e.g. 'country', 'month', 'source')."""
+    df = load_archive(columns=["run_id", "success", by], archive_dir=archive_dir).drop_duplicates("run_id")
+    summary = df.groupby(by).agg(runs=("run_id", "count"), failed=("success", lambda s: int((~s).sum())))
+    summary["failure_rate"] = summary["failed"] / summary["runs"]
+    return summary.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the Parquet trip archive.")
+    parser.add_argument("--compact", action="store_true", help="Merge each partition's files into one")
+    args = parser.parse_args()
+    if args.compact:
+        print(f"✅ Merged {compact_archive()} files in {ARCHIVE_DIR}")
+    else:
+        parser.print_help()
@@ -0,0 +1,245 @@
+"""
+Trip Export
+Streams trip locations to machine-readable files (GeoJSON, GPX and a compact
+binary columnar format) next to the HTML maps.
+"""
+
+import os
+import json
+import math
+import shutil
+import struct
+import tempfile
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+
+COLUMNAR_MAGIC = b"TRIPCOL1"
+NUMERIC_COLUMNS = ["lat", "lon", "Stay_lat", "Stay_lon"]
+TEXT_COLUMNS = ["name", "description"]
+
+
+def _as_float(value) -> Optional[float]:
+    """Return value as float, or None if it is missing or not a number."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+class GeoJSONStreamWriter:
+    """Writes stops, stays and route as three GeoJSON FeatureCollections, one feature at a time."""
+
+    def __init__(self, base_path: str):
+        self.paths = {kind: f"{base_path}_{kind}.geojson" for kind in ("stops", "stays", "route")}
+        self.files = {kind: open(path, "w", encoding="utf-8") for kind, path in self.paths.items()}
+        self.counts = {kind: 0 for kind in self.files}
+        self.last_stay = None
+
+        header = '{"type": "FeatureCollection", "features": [\n'
+        self.files["stops"].write(header)
+        self.files["stays"].write(header)
+        self.files["route"].write(header + '{"type": "Feature", "properties": {"kind": "route"}, '
+                                  '"geometry": {"type": "LineString", "coordinates": [\n')
+
+    def _write_item(self, kind: str, text: str) -> None:
+        if self.counts[kind]:
+            self.files[kind].write(",\n")
+        self.files[kind].write(text)
+        self.counts[kind] += 1
+
+    def write(self, loc: Dict) -> None:
+        lat, lon = _as_float(loc.get("lat")), _as_float(loc.get("lon"))
+        if lat is not None and lon is not None:
+            feature = {
+                "type": "Feature",
+                "properties": {"kind": "stop", "day": loc.get("day"), "name": loc.get("name"),
+                               "description": loc.get("description", "")},
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            }
+            self._write_item("stops", json.dumps(feature, ensure_ascii=False))
+            self._write_item("route", json.dumps([lon, lat]))
+
+        stay = (_as_float(loc.get("Stay_lat")), _as_float(loc.get("Stay_lon")))
+        # Consecutive days at the same accommodation are a single stay
+        if None not in stay and stay != self.last_stay:
+            feature = {
+                "type": "Feature",
+                "properties": {"kind": "stay", "first_day": loc.get("day")},
+                "geometry": {"type": "Point", "coordinates": [stay[1], stay[0]]},
+            }
+            self._write_item("stays", json.dumps(feature))
+            self.last_stay = stay
+
+    def close(self) -> None:
+        self.files["stops"].write("\n]}\n")
+        self.files["stays"].write("\n]}\n")
+        self.files["route"].write("\n]}}\n]}\n")
+        for f in self.files.values():
+            f.close()
+
+
+class GPXStreamWriter:
+    """
+    Writes stops as GPX waypoints and the route as a track.
+    GPX requires all <wpt> elements before <trk>, so track points are spooled
+    to a temporary file and appended on close.
+    """
+
+    def __init__(self, base_path: str, track_name: str = "Trip"):
+        self.path = f"{base_path}.gpx"
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.track = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.track_name = track_name
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<gpx version="1.1" creator="trip_planner" xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+    def write(self, loc: Dict) -> None:
+        lat, lon = _as_float(loc.get("lat")), _as_float(loc.get("lon"))
+        if lat is None or lon is None:
+            return
+        name = escape(f"Day {loc.get('day')}: {loc.get('name', '')}")
+        self.file.write(f'  <wpt lat="{lat}" lon="{lon}"><name>{name}</name>'
+                        f'<desc>{escape(str(loc.get("description", "")))}</desc></wpt>\n')
+        self.track.write(f'      <trkpt lat="{lat}" lon="{lon}"><name>{name}</name></trkpt>\n')
+
+    def close(self) -> None:
+        self.file.write(f"  <trk><name>{escape(self.track_name)}</name><trkseg>\n")
+        self.track.seek(0)
+        shutil.copyfileobj(self.track, self.file)
+        self.file.write("  </trkseg></trk>\n</gpx>\n")
+        self.track.close()
+        self.file.close()
+
+
+class ColumnarStreamWriter:
+    """
+    Writes locations to a compact binary columnar file in fixed-size row chunks.
+
+    Layout: magic, then chunks of `<uint32 rows>` followed by one block per column:
+    'day' as int16, numeric columns as float64 (NaN for missing) and text
+    columns as uint32 offsets plus UTF-8 bytes. Only one chunk is held in memory.
+    """
+
+    def __init__(self, base_path: str, chunk_rows: int = 1024):
+        self.path = f"{base_path}.tripcol"
+        self.file = open(self.path, "wb")
+        self.file.write(COLUMNAR_MAGIC)
+        self.chunk_rows = chunk_rows
+        self._reset_chunk()
+
+    def _reset_chunk(self) -> None:
+        self.rows = 0
+        self.days = array("h")
+        self.numeric = {col: array("d") for col in NUMERIC_COLUMNS}
+        self.text = {col: [] for col in TEXT_COLUMNS}
+
+    def write(self, loc: Dict) -> None:
+        try:
+            self.days.append(int(loc.get("day", 0)))
+        except (TypeError, ValueError):
+            self.days.append(0)
+        for col in NUMERIC_COLUMNS:
+            value = _as_float(loc.get(col))
+            self.numeric[col].append(math.nan if value is None else value)
+        for col in TEXT_COLUMNS:
+            self.text[col].append(str(loc.get(col) or "").encode("utf-8"))
+        self.rows += 1
+        if self.rows >= self.chunk_rows:
+            self._flush_chunk()
+
+    def _flush_chunk(self) -> None:
+        if not self.rows:
+            return
+        self.file.write(struct.pack("<I", self.rows))
+        self.file.write(self.days.tobytes())
+        for col in NUMERIC_COLUMNS:
+            self.file.write(self.numeric[col].tobytes())
+        for col in TEXT_COLUMNS:
+            offsets = array("I", [0])
+            for value in self.text[col]:
+                offsets.append(offsets[-1] + len(value))
+            self.file.write(offsets.tobytes())
+            self.file.write(b"".join(self.text[col]))
+        self._reset_chunk()
+
+    def close(self) -> None:
+        self._flush_chunk()
+        self.file.close()
+
+
+def read_columnar(path: str) -> Iterator[Dict]:
+    """Read back a file written by ColumnarStreamWriter, one location at a time."""
+    with open(path, "rb") as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a trip columnar file")
+        while True:
+            header = f.read(4)
+            if not header:
+                break
+            rows = struct.unpack("<I", header)[0]
+            days = array("h")
+            days.frombytes(f.read(rows * days.itemsize))
+            columns = {}
+            for col in NUMERIC_COLUMNS:
+                values = array("d")
+                values.frombytes(f.read(rows * values.itemsize))
+                columns[col] = [None if math.isnan(v) else v for v in values]
+            for col in TEXT_COLUMNS:
+                offsets = array("I")
+                offsets.frombytes(f.read((rows + 1) * offsets.itemsize))
+                data = f.read(offsets[-1])
+                columns[col] = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(rows)]
+            for i in range(rows):
+                loc = {"day": days[i]}
+                loc.update({col: columns[col][i] for col in NUMERIC_COLUMNS + TEXT_COLUMNS})
+                yield loc
+
+
+class TripExportWriter:
+    """Fans a stream of locations out to all requested export formats."""
+
+    WRITERS = {"geojson": GeoJSONStreamWriter, "gpx": GPXStreamWriter, "tripcol": ColumnarStreamWriter}
+
+    def __init__(self, base_path: str, formats: Iterable[str] = ("geojson", "gpx", "tripcol")):
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        self.writers = [self.WRITERS[fmt](base_path) for fmt in formats]
+
+    def write(self, loc: Dict) -> None:
+        for writer in self.writers:
+            writer.write(loc)
+
+    def close(self) -> None:
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def export_trip(locations: Iterable[Dict], base_path: str,
+                formats: Iterable[str] = ("geojson", "gpx", "tripcol")) -> List[str]:
+    """
+    Export trip locations to GeoJSON, GPX and binary columnar files.
+    Args:
+        locations: Iterable (list or generator) of location dicts with 'day', 'name', 'lat', 'lon',
+                   and optionally 'Stay_lat', 'Stay_lon' and 'description'.
+        base_path: Output path without extension, e.g. 'output/trip_0'.
+        formats: Subset of 'geojson', 'gpx' and 'tripcol'.
+    Returns:
+        List of written file paths.
+    """
+    with TripExportWriter(base_path, formats) as writer:
+        for loc in locations:
+            writer.write(loc)
+
+    paths = []
+    for w in writer.writers:
+        paths.extend(w.paths.values() if hasattr(w, "paths") else [w.path])
+    print(f"✅ Trip exported to {', '.join(paths)}")
+    return paths
@@ -0,0 +1,259 @@
+"""
+Trip Job
+Runs the planning pipeline on a background thread and publishes its progress
+(stage, stops parsed so far, latest map) so the Streamlit UI can poll it
+without blocking its script thread.
+"""
+
+import os
+import copy
+import uuid
+import threading
+from typing import Dict, List, Optional
+
+from artifacts import get_or_create
+from deadline import Deadline
+from extract_coordinates import iter_stream_compact_rows, iter_stream_locations, parse_itinerary
+from llm_ledger import LedgerCallbackHandler, request_tags, suggest_max_tokens
+from multi_day_map import build_map
+from plan_store import MAX_KM_BUCKET, PlanStore, max_km_bucket, normalize_request
+from profiler import profile_request
+from prompt_trip import _get_trip_prompt_template, get_llm_model, LLM_TIMEOUT_CAP, OUTPUT_FORMAT
+from rate_limit import call_with_retry
+from remove_problemtaic_coords import ignore_null_coords_locations
+from segmented_planner import plan_segmented, use_segmented_planning
+from stage_dag import Stage, StageDAG
+from validate_locations_coords import validate_location, MIN_GEOCODE_SECONDS
+
+
+STAGES = {
+    "queued": "Waiting to start",
+    "stored": "Loading stored plan",
+    "llm": "Generating itinerary",
+    "validating": "Checking locations with the geocoder",
+    "clustering": "Removing outlier locations",
+    "rendering": "Rendering map",
+    "done": "Done",
+    "error": "Failed",
+}
+
+
+# Job stage shown while each DAG stage runs
+DAG_STAGES = {"prompt": "llm", "llm": "llm", "parse": "llm", "validate": "validating",
+              "cluster": "clustering", "render": "rendering"}
+
+
+class _ConfigOverride:
+    """The config with some fields overridden, for class- and instance-style configs alike."""
+
+    def __init__(self, Config, **fields):
+        self._config = Config
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name):
+        return getattr(self._config, name)
+
+
+def _mappable(locations: List[Dict]) -> List[Dict]:
+    """Keep stops with coordinates, defaulting the overnight stay to the stop itself."""
+    stops = []
+    for loc in locations:
+        if loc.get("lat") is None or loc.get("lon") is None:
+            continue
+        loc = dict(loc)
+        if loc.get("Stay_lat") is None or loc.get("Stay_lon") is None:
+            loc["Stay_lat"], loc["Stay_lon"] = loc["lat"], loc["lon"]
+        stops.append(loc)
+    return stops
+
+
+class TripJob:
+    """A single trip request running in a background thread."""
+
+    def __init__(self, Config, fresh: bool = False, reuse_similar: bool = False, profile: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.Config = Config
+        self.fresh = fresh
+        self.reuse_similar = reuse_similar
+        self.profile = profile
+        self.deadline = Deadline()
+        self._lock = threading.Lock()
+        self._state = {"stage": "queued", "stops": [], "map_html": None, "error": None, "from_store": False,
+                       "similarity": None, "map_path": None,
+                       "reused_stages": []}
+        self._thread = threading.Thread(target=self._run, name=f"trip-job-{self.id}", daemon=True)
+
+    def start(self) -> "TripJob":
+        self._thread.start()
+        return self
+
+    def snapshot(self) -> Dict:
+        """Return a copy of the current state, safe to read from the UI thread."""
+        with self._lock:
+            state = copy.deepcopy(self._state)
+        state["stage_label"] = STAGES[state["stage"]]
+        state["degraded_reasons"] = list(self.deadline.degraded_reasons)
+        state["finished"] = state["stage"] in ("done", "error")
+        return state
+
+    def _update(self, **fields) -> None:
+        with self._lock:
+            self._state.update(copy.deepcopy(fields))
+
+    def _render_partial(self, locations: List[Dict]) -> None:
+        stops = _mappable(locations)
+        if stops:
+            self._update(map_html=build_map(stops).get_root().render())
+
+    def _render_artifact(self, locations: List[Dict]) -> Optional[str]:
+        """Path of the final map's content-addressed artifact, rendering it only if it is new."""
+        stops = _mappable(locations)
+        if not stops:
+            return None
+        return get_or_create("trip_map", "html", stops, lambda path: build_map(stops).save(path))
+
+    def _publish_map(self, path: Optional[str], locations: List[Dict]) -> None:
+        if path is not None and not os.path.exists(path):
+            # Evicted from the artifact directory since it was memoized
+            path = self._render_artifact(locations)
+        if path is None:
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            self._update(map_html=f.read(), map_path=path)
+
+    def _stream_llm(self, prompt: str) -> str:
+        """Stream the LLM answer, publishing each stop as soon as its entry is complete. Returns the full answer."""
+        compact = OUTPUT_FORMAT == "compact"
+        max_tokens = suggest_max_tokens("main_plan_prompt", self.Config.duration, output_format=OUTPUT_FORMAT)
+        ledger = LedgerCallbackHandler("main_plan_prompt", dict(request_tags(self.Config), format=OUTPUT_FORMAT))
+
+        def consume():
+            # Built per attempt, so a retry's timeout is capped by the time left then
+            llm_model = get_llm_model(self.Config, timeout=self.deadline.timeout(LLM_TIMEOUT_CAP), max_tokens=max_tokens)
+            chunks = []
+            stops = []
+            self._update(stops=[])
+
+            def texts():
+                for chunk in llm_model.stream(prompt, config={"callbacks": [ledger]}):
+                    chunks.append(chunk.content)
+                    yield chunk.content
+
+            parse_stream = iter_stream_compact_rows(texts(), self.Config.duration) if compact else iter_stream_locations(texts())
+            for loc in parse_stream:
+                stops.append(loc)
+                self._update(stops=stops)
+                # Redraw the map once per new day, not for every stop
+                if len(stops) == 1 or stops[-1].get("day") != stops[-2].get("day"):
+                    self._render_partial(stops)
+            return "".join(chunks)
+
+        self.deadline.check("LLM call")
+        return call_with_retry("groq", consume, deadline=self.deadline)
+
+    def _segmented_plan(self, Config) -> List[Dict]:
+        """Plan a long trip in parallel segments, publishing each segment's stops as it finishes."""
+        stops = []
+        stops_lock = threading.Lock()
+
+        def on_segment(locations):
+            with stops_lock:
+                stops.extend(locations)
+                stops.sort(key=lambda loc: loc.get("day") if isinstance(loc.get("day"), int) else 0)
+                current = list(stops)
+            self._update(stops=current)
+            self._render_partial(current)
+
+        self._update(stops=[])
+        return plan_segmented(Config, deadline=self.deadline, on_segment=on_segment)
+
+    def _run(self) -> None:
+        with profile_request(f"trip_job_{self.id}", force=self.profile):
+            self._run_pipeline()
+
+    def _stages(self) -> List[Stage]:
+        """
+        The pipeline as memoized stages. The prompt (and so the LLM answer) depends on the request
+        with max_km bucketed like the plan store does, clustering on the exact max_km, so moving the
+        slider within a bucket only re-runs clustering and rendering.
+        """
+        def prompt_config(Config):
+            km = max(max_km_bucket(Config.max_km_dist_per_day), 1) * MAX_KM_BUCKET
+            return _ConfigOverride(Config, max_km_dist_per_day=km)
+
+        def prompt(Config):
+            return _get_trip_prompt_template(prompt_config(Config), compact=OUTPUT_FORMAT == "compact")
+
+        def llm(Config, prompt_text):
+            # Segmented plans come back already parsed, from their own skeleton and segment prompts
+            if use_segmented_planning(Config):
+                return self._segmented_plan(prompt_config(Config))
+            return self._stream_llm(prompt_text)
+
+        def parse(Config, answer):
+            if isinstance(answer, list):
+                return answer
+            repair_llm = get_llm_model(Config, timeout=self.deadline.timeout(LLM_TIMEOUT_CAP))
+            return parse_itinerary(answer, OUTPUT_FORMAT == "compact", Config.duration, llm=repair_llm,
+                                   deadline=self.deadline)
+
+        def validate(Config, locations):
+            self._update(stops=locations)
+            if not getattr(Config, "location_val", False):
+                return [locations, locations.copy()]
+            if not self.deadline.has_time_for(MIN_GEOCODE_SECONDS):
+                self.deadline.degrade("skipped location validation")
+                return [locations, locations.copy()]
+            llm_model = get_llm_model(Config, timeout=self.deadline.timeout(LLM_TIMEOUT_CAP))
+            return list(validate_location(locations, llm_model, deadline=self.deadline,
+                                          progress=lambda ix, loc: self._update(stops=locations),
+                                          country=Config.country))
+
+        def cluster(Config, validated):
+            locations, locations_orig = validated
+            return ignore_null_coords_locations(locations, locations_orig, 0, threshold_km=Config.max_km_dist_per_day,
+                                                ignore_geolocator=False)
+
+        def render(Config, locations):
+            return self._render_artifact(locations)
+
+        def request(Config):
+            return normalize_request(Config)
+
+        return [
+            Stage("prompt", prompt, params=lambda C: dict(request(C), format=OUTPUT_FORMAT)),
+            Stage("llm", llm, ["prompt"], params=lambda C: {"segmented": use_segmented_planning(C)}),
+            Stage("parse", parse, ["llm"], params=lambda C: {"format": OUTPUT_FORMAT, "duration": int(C.duration)}),
+            Stage("validate", validate, ["parse"],
+                  params=lambda C: {"location_val": bool(getattr(C, "location_val", False)),
+                                    "country": request(C)["country"]}),
+            Stage("cluster", cluster, ["validate"], params=lambda C: {"max_km": float(C.max_km_dist_per_day)}),
+            Stage("render", render, ["cluster"]),
+        ]
+
+    def _run_pipeline(self) -> None:
+        try:
+            store = PlanStore()
+            dag = StageDAG(self._stages())
+            # A plan from this process's stage memo (the user tweaking the form) wins over the plan store,
+            # which only holds finished plans and cannot re-cluster them
+            locations, similarity = None, None
+            if not self.fresh and not dag.cached(self.Config, "llm"):
+                locations, similarity = store.lookup(self.Config, self.reuse_similar)
+            if locations is not None:
+                self._update(stage="stored", stops=locations, from_store=True, similarity=similarity)
+                self._update(stage="rendering")
+                self._publish_map(self._render_artifact(locations), locations)
+            else:
+                values, computed = dag.run(self.Config, force=["llm"] if self.fresh else [], deadline=self.deadline,
+                                           on_stage=lambda name: self._update(stage=DAG_STAGES[name]))
+                locations = values["cluster"]
+                self._update(stops=locations, reused_stages=[name for name in values if name not in computed])
+                # Only new LLM plans go to the store, re-clustered ones are variants of a stored plan
+                if "llm" in computed and not self.deadline.degraded:
+                    store.save_plan(self.Config, locations)
+                self._publish_map(values["render"], locations)
+            self._update(stage="done")
+        except Exception as e:
+            print(f"Trip job {self.id} failed: {e}")
+            self._update(stage="error", error=str(e))
@@ -2,8 +2,21 @@ from geopy.geocoders import Nominatim
 from langchain.prompts import PromptTemplate
 import re
 from extract_coordinates import get_coordinates_from_query
+from rate_limit import call_with_retry
+from llm_ledger import LedgerCallbackHandler
+from country_index import get_country_index
 
-def detect_coords_with_llm( query: str, llm ) -> str:
+# Seconds the remaining deadline must allow before starting a geocode or an LLM fallback call
+GEOCODE_TIMEOUT_CAP = 10
+MIN_GEOCODE_SECONDS = 2
+MIN_LLM_FALLBACK_SECONDS = 8
+
+def geocode_within_deadline(geolocator, query: str, deadline=None):
+    """One geocoder attempt, for call_with_retry: its timeout is capped by the time left when it starts."""
+    timeout = GEOCODE_TIMEOUT_CAP if deadline is None else deadline.timeout(GEOCODE_TIMEOUT_CAP)
+    return geolocator.geocode(query, timeout=timeout)
+
+def detect_coords_with_llm( query: str, llm , deadline=None) -> str:
 
     # Define the prompt template
     prompt_template = PromptTemplate(
@@ -18,29 +31,62 @@ def detect_coords_with_llm( query: str, llm ) -> str:
     llm_chain = prompt_template | llm | (lambda result : get_coordinates_from_query(result))
 
     input_data = {"query": query}
-    result = llm_chain.invoke(input_data)
+    ledger = LedgerCallbackHandler("detect_coords_with_llm", {"query": query})
+    result = call_with_retry("groq", llm_chain.invoke, input_data, config={"callbacks": [ledger]},
+                             deadline=deadline)
 
     return result
 
-def query_coordinates_from_name(loc: dict  ,llm_model) -> tuple:
+def query_coordinates_from_name(loc: dict  ,llm_model, deadline=None) -> tuple:
     """
     Query coordinates from a location name using geopy.
     If not found, use RAG to get coordinates.
     """
     print(f"Can't find coords for {loc['name']}, looking from query")
-    result_coords = detect_coords_with_llm(query=loc['name'], llm=llm_model)
+    result_coords = detect_coords_with_llm(query=loc['name'], llm=llm_model, deadline=deadline)
     loc['lat'], loc['lon'] =  result_coords
     print ("Found coordinates for from query: ", result_coords)
     
-def validate_location(locations , llm_model ):
+def validate_location(locations , llm_model , deadline=None, progress=None, country=None):
+        """
+        Geocode every location and re-query coordinates with the LLM when they differ significantly.
+        Geocoder calls share the host-wide Nominatim rate limit (GEOCODE_MIN_DELAY seconds apart).
+        With a deadline.Deadline, each call's timeout is capped by the time left and the remaining
+        locations keep their LLM coordinates once the budget runs out.
+        progress, if given, is called as progress(index, location) after each location is geocoded.
+        With country and a built country index (country_index.py), only stops the index flags
+        (outside the country, far from a region in their name, missing coordinates) are geocoded.
+        """
         locations_orig = locations.copy()
+        index = get_country_index() if country else None
+        flags = index.triage(locations, country) if index is not None else [True] * len(locations)
+        if index is not None:
+            print(f"Country index flagged {sum(1 for f in flags if f)}/{len(locations)} locations for geocoding")
         # --- Fill missing coordinates ---
-        geolocator = Nominatim(user_agent="trip_planner", timeout=100)
-        for loc in locations:
+        geolocator = Nominatim(user_agent="trip_planner", timeout=GEOCODE_TIMEOUT_CAP)
+        for ix, loc in enumerate(locations):
+            if not flags[ix]:
+                continue
+            if deadline is not None and not deadline.has_time_for(MIN_GEOCODE_SECONDS):
+                deadline.degrade(f"validated only {ix}/{len(locations)} locations")
+                break
             #if not loc.get("lat") or not loc.get("lon"):
-            geo = geolocator.geocode(f"{loc['name']}")
+            try:
+                geo = call_with_retry("nominatim", geocode_within_deadline, geolocator, f"{loc['name']}", deadline,
+                                      deadline=deadline)
+            except Exception as e:
+                print(f"Could not geocode {loc['name']}: {e}")
+                continue
             # If coordinates are not similar
-            if geo is not None and (abs(geo.latitude - loc.get("lat", 0)) > 0.25 or abs(geo.longitude - loc.get("lon", 0)) > 0.25):
-                query_coordinates_from_name(loc, llm_model)
+            if geo is not None and (abs(geo.latitude - (loc.get("lat") or 0)) > 0.25 or abs(geo.longitude - (loc.get("lon") or 0)) > 0.25):
+                if deadline is not None and not deadline.has_time_for(MIN_LLM_FALLBACK_SECONDS):
+                    deadline.degrade(f"skipped LLM coordinate fallback for {loc['name']}")
+                    continue
+                try:
+                    query_coordinates_from_name(loc, llm_model, deadline=deadline)
+                except Exception as e:
+                    print(f"LLM coordinate fallback failed for {loc['name']}: {e}")
+            if progress is not None:
+                progress(ix, loc)
         
         return locations , locations_orig
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+Variation Controller
+Decides when generating more trip variations stops paying off. Each new
+itinerary is compared with the accepted ones on stop-set overlap (same name,
+or within SAME_STOP_KM) and on route distance (how far apart the overnight
+stays of the same day are). Near-duplicates are rejected; after the first one
+the next prompts carry an exclusion list of the places already covered, and
+once VARIATION_PATIENCE samples in a row add nothing new generation stops.
+The report tells how many LLM calls that saved against the fixed budget.
+"""
+
+import os
+import unicodedata
+from collections import Counter
+from statistics import mean
+from typing import Dict, List, Optional, Sequence
+
+from geopy.distance import geodesic
+
+
+VARIATION_EARLY_STOP = os.getenv("VARIATION_EARLY_STOP", "False").lower() == "true"
+# Itineraries at least this similar to an accepted one count as duplicates
+VARIATION_SIMILARITY_THRESHOLD = float(os.getenv("VARIATION_SIMILARITY_THRESHOLD", "0.8"))
+# Consecutive duplicates (the later ones despite the exclusion list) before generation stops
+VARIATION_PATIENCE = int(os.getenv("VARIATION_PATIENCE", "2"))
+# Places listed in the exclusion prompt
+VARIATION_EXCLUDE_MAX = int(os.getenv("VARIATION_EXCLUDE_MAX", "15"))
+# Differently named stops this close together are the same place
+SAME_STOP_KM = 2.0
+# Mean distance between same-day overnight stays at which routes count as unrelated
+ROUTE_SCALE_KM = 50.0
+SIMILARITY_WEIGHTS = {"stops": 0.6, "route": 0.4}
+
+
+def _stop_key(name) -> str:
+    text = unicodedata.normalize("NFKD", str(name or ""))
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split()).casefold()
+
+
+def _unique_stops(locations: List[Dict]) -> List[Dict]:
+    stops = {}
+    for loc in locations:
+        stops.setdefault(_stop_key(loc.get("name")), loc)
+    stops.pop("", None)
+    return list(stops.values())
+
+
+def _same_stop(a: Dict, b: Dict) -> bool:
+    if _stop_key(a.get("name")) == _stop_key(b.get("name")):
+        return True
+    if None in (a.get("lat"), a.get("lon"), b.get("lat"), b.get("lon")):
+        return False
+    return geodesic((a["lat"], a["lon"]), (b["lat"], b["lon"])).kilometers <= SAME_STOP_KM
+
+
+def stop_overlap(a: List[Dict], b: List[Dict]) -> float:
+    """Jaccard overlap of the two stop sets, matching stops by name or position."""
+    stops_a, stops_b = _unique_stops(a), _unique_stops(b)
+    if not stops_a and not stops_b:
+        return 1.0
+    matched = sum(1 for stop in stops_a if any(_same_stop(stop, other) for other in stops_b))
+    return matched / (len(stops_a) + len(stops_b) - matched)
+
+
+def _nightly_stays(locations: List[Dict]) -> Dict[int, tuple]:
+    """Day -> overnight stay, falling back to the day's last stop."""
+    stays = {}
+    for loc in locations:
+        try:
+            day = int(loc.get("day"))
+        except (TypeError, ValueError):
+            continue
+        if loc.get("Stay_lat") is not None and loc.get("Stay_lon") is not None:
+            lat, lon = loc["Stay_lat"], loc["Stay_lon"]
+        else:
+            lat, lon = loc.get("lat"), loc.get("lon")
+        if lat is not None and lon is not None:
+            stays[day] = (lat, lon)
+    return stays
+
+
+def route_similarity(a: List[Dict], b: List[Dict]) -> float:
+    """1 for the same overnight stays day by day, 0 once they are ROUTE_SCALE_KM apart on average."""
+    stays_a, stays_b = _nightly_stays(a), _nightly_stays(b)
+    days = set(stays_a) | set(stays_b)
+    if not days:
+        return 0.0
+    gaps = [geodesic(stays_a[d], stays_b[d]).kilometers if d in stays_a and d in stays_b else ROUTE_SCALE_KM
+            for d in days]
+    return max(0.0, 1.0 - mean(gaps) / ROUTE_SCALE_KM)
+
+
+def itinerary_similarity(a: List[Dict], b: List[Dict]) -> float:
+    """Weighted stop overlap and route similarity, between 0 and 1."""
+    return (SIMILARITY_WEIGHTS["stops"] * stop_overlap(a, b)
+            + SIMILARITY_WEIGHTS["route"] * route_similarity(a, b))
+
+
+class VariationController:
+    """
+    Accepts variations until `target` distinct ones are found, the samples converge, or
+    max_calls LLM calls (by default the fixed budget of `target` calls) are spent.
+    """
+
+    def __init__(self, target: int, fixed: Sequence[str] = (), max_calls: Optional[int] = None,
+                 threshold: float = VARIATION_SIMILARITY_THRESHOLD, patience: int = VARIATION_PATIENCE):
+        self.target = target
+        self.max_calls = target if max_calls is None else max_calls
+        self.threshold = threshold
+        self.patience = patience
+        # Places every variation needs (start / end city), never excluded
+        self.fixed = {_stop_key(name) for name in fixed}
+        self.accepted: List[List[Dict]] = []
+        self.calls = 0
+        self.duplicates = 0
+        self.excluding_calls = 0
+        self._streak = 0
+
+    @property
+    def converged(self) -> bool:
+        return self._streak >= self.patience
+
+    @property
+    def done(self) -> bool:
+        return len(self.accepted) >= self.target or self.converged or self.calls >= self.max_calls
+
+    def exclusions(self) -> List[str]:
+        """Places for the next prompt to avoid: the most common stops so far, once a duplicate was seen."""
+        if not self.duplicates:
+            return []
+        counts = Counter()
+        names = {}
+        for locations in self.accepted:
+            for stop in _unique_stops(locations):
+                key = _stop_key(stop.get("name"))
+                if key not in self.fixed:
+                    counts[key] += 1
+                    names.setdefault(key, stop["name"])
+        return [names[key] for key, _ in counts.most_common(VARIATION_EXCLUDE_MAX)]
+
+    def offer(self, locations: List[Dict], excluded: bool = False) -> bool:
+        """
+        Record one LLM call's itinerary (excluded: it was prompted with an exclusion list).
+        Returns True if it is accepted as a new variation.
+        """
+        self.calls += 1
+        self.excluding_calls += bool(excluded)
+        if not locations:
+            return False
+        similarity = max((itinerary_similarity(locations, other) for other in self.accepted), default=0.0)
+        if similarity >= self.threshold:
+            self.duplicates += 1
+            self._streak += 1
+            print(f"Variation is {similarity:.0%} similar to an earlier one, rejected "
+                  f"({self._streak}/{self.patience} in a row)")
+            return False
+        self._streak = 0
+        self.accepted.append(locations)
+        return True
+
+    def report(self) -> str:
+        if len(self.accepted) >= self.target:
+            reason = "target reached"
+        elif self.converged:
+            reason = f"converged after {self._streak} duplicates in a row"
+        else:
+            reason = "call budget spent"
+        saved = max(0, self.target - self.calls)
+        return (f"{len(self.accepted)}/{self.target} distinct variations from {self.calls} LLM calls ({reason}); "
+                f"{self.duplicates} near-duplicates rejected, {self.excluding_calls} calls with an exclusion list; "
+                f"{saved} of {self.target} calls saved")